@@ -0,0 +1,103 @@
+# -*- coding: utf-8 -*-
+"""
+最近の更新（GET /api/activity）
+- ワークスペース全体で最近作成・更新されたページとブロックを新しい順に返す
+- pages / blocks それぞれ updated_at のインデックスを新しい順に読み、必要な件数だけでマージする
+- キーセットページング（updated_at, 種類, ID）。件数が増えても1ページのコストは一定
+"""
+
+import heapq
+from datetime import datetime
+
+from utils import encode_cursor, decode_cursor
+
+DEFAULT_LIMIT = 50
+MAX_LIMIT = 200
+
+# 種類 → SELECT 句。ゴミ箱のページとその中のブロックは出さない
+SOURCES = {
+    'page': '''
+        SELECT p.id, p.id AS page_id, p.title, p.icon, NULL AS block_type, NULL AS content,
+               p.created_at, p.updated_at
+        FROM pages p
+        WHERE p.is_deleted = 0
+    ''',
+    'block': '''
+        SELECT b.id, b.page_id, p.title, p.icon, b.type AS block_type, b.content,
+               b.created_at, b.updated_at
+        FROM blocks b
+        JOIN pages p ON p.id = b.page_id
+        WHERE p.is_deleted = 0
+    ''',
+}
+
+
+def parse_since(value):
+    """?since= （YYYY-MM-DD か YYYY-MM-DD HH:MM:SS、UTC）を updated_at と比べられる形にする。不正なら ValueError"""
+    for fmt in ('%Y-%m-%d %H:%M:%S', '%Y-%m-%dT%H:%M:%S', '%Y-%m-%d'):
+        try:
+            return datetime.strptime(value, fmt).strftime('%Y-%m-%d %H:%M:%S')
+        except ValueError:
+            continue
+    raise ValueError('Invalid since (expected YYYY-MM-DD or YYYY-MM-DD HH:MM:SS)')
+
+
+def _fetch(cursor, kind, since, after, limit):
+    """kind の行を (updated_at, id) の降順で limit 件。after は前ページ最後の (updated_at, kind, id)"""
+    alias = 'p' if kind == 'page' else 'b'
+    sql = SOURCES[kind]
+    params = []
+    if since:
+        sql += f' AND {alias}.updated_at >= ?'
+        params.append(since)
+    if after:
+        updated_at, after_kind, after_id = after
+        # 同じ時刻は種類（'page' > 'block'）→ ID の降順で並べる
+        if kind == after_kind:
+            # updated_at の範囲1つにして、インデックスを降順に読むだけにする
+            sql += f' AND {alias}.updated_at <= ? AND ({alias}.updated_at < ? OR {alias}.id < ?)'
+            params.extend([updated_at, updated_at, after_id])
+        elif kind < after_kind:
+            sql += f' AND {alias}.updated_at <= ?'
+            params.append(updated_at)
+        else:
+            sql += f' AND {alias}.updated_at < ?'
+            params.append(updated_at)
+    sql += f' ORDER BY {alias}.updated_at DESC, {alias}.id DESC LIMIT ?'
+    params.append(limit)
+    cursor.execute(sql, params)
+    items = []
+    for row in cursor.fetchall():
+        item = dict(row)
+        item['type'] = kind
+        item['action'] = 'created' if item['created_at'] == item['updated_at'] else 'updated'
+        if kind == 'page':
+            del item['block_type'], item['content']
+        items.append(item)
+    return items
+
+
+def get_activity(cursor, since=None, limit=DEFAULT_LIMIT, after=None):
+    """最近作成・更新されたページ/ブロックを新しい順に返す
+
+    since は parse_since 済みの下限（None なら制限なし）、after は前回の next_cursor。
+    戻り値は (項目のリスト, next_cursor)。続きがなければ next_cursor は None。
+    after が不正なら ValueError。
+    """
+    limit = max(1, min(int(limit), MAX_LIMIT))
+    after = decode_cursor(after, str, str, int) if after else None
+    if after and after[1] not in SOURCES:
+        raise ValueError('Invalid cursor')
+
+    def sort_key(item):
+        return (item['updated_at'] or '', item['type'], item['id'])
+
+    # それぞれ limit + 1 件読めば、マージ後の先頭 limit + 1 件は必ず揃う
+    sources = [_fetch(cursor, kind, since, after, limit + 1) for kind in SOURCES]
+    merged = list(heapq.merge(*sources, key=sort_key, reverse=True))
+    items = merged[:limit]
+    next_cursor = None
+    if len(merged) > limit:
+        last = items[-1]
+        next_cursor = encode_cursor(last['updated_at'], last['type'], last['id'])
+    return items, next_cursor
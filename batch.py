@@ -0,0 +1,181 @@
+# -*- coding: utf-8 -*-
+"""
+一括更新（POST /api/batch）
+- ページ/ブロックの create / update / delete / move を順番どおりに1トランザクションで実行
+- クライアントが付けた仮ID（文字列）を、作成した行の実IDに置き換えながら進める
+- 1件でも失敗したら全体をロールバックする
+- 書き込みは write_queue.submit_transaction で書き込みスレッドに流す（自動保存の更新と同じ1本の書き込み口）
+"""
+
+import sqlite3
+
+from database import get_next_position, get_block_next_position, mark_tree_deleted
+from ordering import position_after
+from write_queue import apply_updates, check_values
+
+# update で変更できるカラム（PUT /api/pages/<id>・PUT /api/blocks/<id> と同じ）
+PAGE_FIELDS = ('title', 'icon', 'parent_id', 'cover_image', 'is_pinned', 'is_deleted', 'position')
+BLOCK_FIELDS = ('type', 'content', 'checked', 'position', 'collapsed', 'details', 'props')
+
+# create で指定できるカラムと既定値
+PAGE_DEFAULTS = {'title': '', 'icon': '📄'}
+BLOCK_DEFAULTS = {'type': 'text', 'content': '', 'checked': 0, 'collapsed': 0, 'details': '', 'props': '{}'}
+
+
+class BatchError(Exception):
+    """operations[index] の実行に失敗した"""
+
+    def __init__(self, index, message):
+        super().__init__(message)
+        self.index = index
+        self.message = message
+
+
+class _Batch:
+    def __init__(self, cursor):
+        self.cursor = cursor
+        self.id_map = {}
+
+    def resolve(self, value):
+        """仮ID（文字列）を実IDに置き換える。None と数値はそのまま"""
+        if value is None or isinstance(value, int):
+            return value
+        if isinstance(value, str):
+            if value in self.id_map:
+                return self.id_map[value]
+            raise ValueError(f'Unknown temporary id: {value}')
+        raise ValueError(f'Invalid id: {value!r}')
+
+    def data(self, op):
+        """op の data（値は文字列・数値・null のみ）"""
+        data = op.get('data') or {}
+        if not isinstance(data, dict):
+            raise ValueError('data must be an object')
+        check_values(data)
+        return data
+
+    def fetch(self, table, row_id):
+        self.cursor.execute(f'SELECT * FROM {table} WHERE id = ?', (row_id,))
+        row = self.cursor.fetchone()
+        if row is None:
+            raise ValueError(f'{table[:-1].capitalize()} not found: {row_id}')
+        return dict(row)
+
+    def create_page(self, op):
+        data = self.data(op)
+        parent_id = self.resolve(op.get('parent_id', data.get('parent_id')))
+        self.cursor.execute(
+            'INSERT INTO pages (title, icon, parent_id, position) VALUES (?, ?, ?, ?)',
+            (data.get('title', PAGE_DEFAULTS['title']), data.get('icon', PAGE_DEFAULTS['icon']),
+             parent_id, get_next_position(self.cursor, parent_id))
+        )
+        page_id = self.cursor.lastrowid
+        # POST /api/pages と同じく空のテキストブロックを1つ作る
+        self.cursor.execute(
+            "INSERT INTO blocks (page_id, type, content, position) VALUES (?, 'text', '', ?)",
+            (page_id, get_block_next_position(self.cursor, page_id))
+        )
+        return page_id
+
+    def create_block(self, op):
+        data = self.data(op)
+        page_id = self.resolve(op.get('page_id', data.get('page_id')))
+        if page_id is None:
+            raise ValueError('page_id is required')
+        self.fetch('pages', page_id)
+        if data.get('position') is not None:
+            position = float(data['position'])
+        elif 'after_id' in op:
+            position = position_after(self.cursor, 'blocks', page_id, self.resolve(op['after_id']))
+        else:
+            position = get_block_next_position(self.cursor, page_id)
+        values = {field: data.get(field, default) for field, default in BLOCK_DEFAULTS.items()}
+        self.cursor.execute(
+            'INSERT INTO blocks (page_id, type, content, checked, collapsed, details, props, position) '
+            'VALUES (?, ?, ?, ?, ?, ?, ?, ?)',
+            (page_id, values['type'], values['content'], values['checked'], values['collapsed'],
+             values['details'], values['props'], position)
+        )
+        return self.cursor.lastrowid
+
+    def update(self, table, row_id, op):
+        allowed = PAGE_FIELDS if table == 'pages' else BLOCK_FIELDS
+        data = self.data(op)
+        unknown = set(data) - set(allowed)
+        if unknown:
+            raise ValueError(f'Unknown fields: {", ".join(sorted(unknown))}')
+        fields = dict(data)
+        if 'parent_id' in fields:
+            fields['parent_id'] = self.resolve(fields['parent_id'])
+        row = apply_updates(self.cursor, table, row_id, fields)
+        if row is None:
+            raise ValueError(f'{table[:-1].capitalize()} not found: {row_id}')
+        return row
+
+    def move(self, table, row_id, op):
+        """別の親/ページの after_id の直後（after_id が null なら先頭）へ移動"""
+        current = self.fetch(table, row_id)
+        scope_field = 'parent_id' if table == 'pages' else 'page_id'
+        scope_id = self.resolve(op[scope_field]) if scope_field in op else current[scope_field]
+        if table == 'blocks' and scope_id is None:
+            raise ValueError('page_id is required')
+        if 'after_id' in op:
+            position = position_after(self.cursor, table, scope_id, self.resolve(op['after_id']))
+        elif table == 'pages':
+            position = get_next_position(self.cursor, scope_id)
+        else:
+            position = get_block_next_position(self.cursor, scope_id)
+        return apply_updates(self.cursor, table, row_id, {scope_field: scope_id, 'position': position})
+
+    def run(self, op):
+        kind = op.get('op')
+        table = {'page': 'pages', 'block': 'blocks'}.get(op.get('type'))
+        if table is None:
+            raise ValueError("type must be 'page' or 'block'")
+
+        if kind == 'create':
+            row_id = self.create_page(op) if table == 'pages' else self.create_block(op)
+            temp_id = op.get('temp_id')
+            if temp_id is not None:
+                if not isinstance(temp_id, str) or temp_id in self.id_map:
+                    raise ValueError(f'Invalid or duplicate temp_id: {temp_id!r}')
+                self.id_map[temp_id] = row_id
+            return {'temp_id': temp_id, 'row': self.fetch(table, row_id)}
+
+        row_id = self.resolve(op.get('id'))
+        if row_id is None:
+            raise ValueError('id is required')
+        if kind == 'update':
+            return {'row': self.update(table, row_id, op)}
+        if kind == 'move':
+            return {'row': self.move(table, row_id, op)}
+        if kind == 'delete':
+            self.fetch(table, row_id)
+            if table == 'pages':
+                # DELETE /api/pages/<id> と違い、ページはゴミ箱へ移すだけ
+                mark_tree_deleted(self.cursor, row_id, is_deleted=True)
+            else:
+                self.cursor.execute('DELETE FROM blocks WHERE id = ?', (row_id,))
+            return {'id': row_id, 'deleted': True}
+        raise ValueError("op must be one of 'create', 'update', 'delete', 'move'")
+
+
+def apply_batch(cursor, operations):
+    """operations を順に実行し、(結果のリスト, 仮ID→実IDの対応) を返す
+
+    失敗した場合は BatchError を送出する（ロールバックは呼び出し側で行う）。
+    """
+    batch = _Batch(cursor)
+    results = []
+    for index, op in enumerate(operations):
+        if not isinstance(op, dict):
+            raise BatchError(index, 'Operation must be an object')
+        try:
+            result = batch.run(op)
+        except (ValueError, KeyError, TypeError) as e:
+            raise BatchError(index, str(e))
+        except sqlite3.IntegrityError:
+            raise BatchError(index, 'Constraint violation (e.g. moving a page under itself)')
+        result.update({'op': op.get('op'), 'type': op.get('type')})
+        results.append(result)
+    return results, batch.id_map
@@ -0,0 +1,111 @@
+# -*- coding: utf-8 -*-
+"""
+読書の進捗（book_progress）
+- 本ブロック（type = 'book'）の props.title / props.currentPage と日付は、トリガーで book_progress に写してある
+- 前日のページ数・本ごとの履歴は (book_title, journal_date) のインデックスで引く（props の JSON は読まない）
+"""
+
+from datetime import datetime, timedelta
+
+# ゴミ箱のページにある本ブロックは数えない
+_LIVE_PROGRESS = '''
+    FROM book_progress bp
+    JOIN pages p ON p.id = bp.page_id AND p.is_deleted = 0
+'''
+
+
+def get_journal_date(cursor, page_id):
+    """ページ（または親の日付ページ）の journal_date。なければ None"""
+    cursor.execute('''
+        SELECT COALESCE(p.journal_date, parent.journal_date)
+        FROM pages p
+        LEFT JOIN pages parent ON parent.id = p.parent_id
+        WHERE p.id = ?
+    ''', (page_id,))
+    row = cursor.fetchone()
+    return row[0] if row else None
+
+
+def get_progress_on(cursor, book_title, journal_date):
+    """その日に記録した本のページ数（同じ日に複数あれば大きい方。get_book_history と同じ）。なければ None"""
+    cursor.execute(f'''
+        SELECT MAX(bp.current_page)
+        {_LIVE_PROGRESS}
+        WHERE bp.book_title = ? AND bp.journal_date = ? AND bp.current_page IS NOT NULL
+    ''', (book_title, journal_date))
+    return cursor.fetchone()[0]
+
+
+def get_previous_day_progress(cursor, book_title, journal_date):
+    """journal_date の前日に記録した本のページ数。なければ None"""
+    prev_date = datetime.strptime(journal_date, '%Y-%m-%d') - timedelta(days=1)
+    return get_progress_on(cursor, book_title, prev_date.strftime('%Y-%m-%d'))
+
+
+def get_book_history(cursor, book_title, date_from=None, date_to=None):
+    """本の日ごとのページ数と前回からの差分、期間の集計を返す
+
+    戻り値は {'title', 'history': [{'journal_date', 'current_page', 'delta'}], 'summary'}。
+    同じ日に複数の記録があれば大きい方を使う。最初の日の delta は期間より前の最後の記録との差
+    （記録がなければ None）。
+    """
+    conditions = ['bp.book_title = ?', 'bp.journal_date IS NOT NULL', 'bp.current_page IS NOT NULL']
+    params = [book_title]
+    if date_from:
+        conditions.append('bp.journal_date >= ?')
+        params.append(date_from)
+    if date_to:
+        conditions.append('bp.journal_date <= ?')
+        params.append(date_to)
+    cursor.execute(f'''
+        SELECT bp.journal_date, MAX(bp.current_page) AS current_page
+        {_LIVE_PROGRESS}
+        WHERE {' AND '.join(conditions)}
+        GROUP BY bp.journal_date
+        ORDER BY bp.journal_date
+    ''', params)
+    rows = cursor.fetchall()
+
+    previous = None
+    if date_from and rows:
+        cursor.execute(f'''
+            SELECT bp.current_page
+            {_LIVE_PROGRESS}
+            WHERE bp.book_title = ? AND bp.journal_date < ? AND bp.current_page IS NOT NULL
+            ORDER BY bp.journal_date DESC, bp.current_page DESC
+            LIMIT 1
+        ''', (book_title, date_from))
+        row = cursor.fetchone()
+        previous = row[0] if row else None
+
+    history = []
+    pages_read = 0
+    for row in rows:
+        delta = row['current_page'] - previous if previous is not None else None
+        if delta and delta > 0:
+            pages_read += delta
+        history.append({'journal_date': row['journal_date'], 'current_page': row['current_page'], 'delta': delta})
+        previous = row['current_page']
+
+    # 最後の記録の日から遡って、1日も空けずに記録が続いている日数
+    streak = 0
+    expected = None
+    for entry in reversed(history):
+        day = datetime.strptime(entry['journal_date'], '%Y-%m-%d').date()
+        if expected is not None and day != expected:
+            break
+        streak += 1
+        expected = day - timedelta(days=1)
+
+    return {
+        'title': book_title,
+        'history': history,
+        'summary': {
+            'days': len(history),
+            'first_date': history[0]['journal_date'] if history else None,
+            'last_date': history[-1]['journal_date'] if history else None,
+            'current_page': history[-1]['current_page'] if history else None,
+            'pages_read': pages_read,
+            'streak_days': streak,
+        },
+    }
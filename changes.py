@@ -0,0 +1,67 @@
+# -*- coding: utf-8 -*-
+"""
+差分同期（GET /api/changes）
+- change_log はトリガーで (テーブル, ID) ごとに最新の変更だけを持つ（seq は単調増加）
+- カーソル（最後に受け取った seq）より後の変更を seq 順に返す
+- 行が残っていれば upsert（行の内容付き）、削除されていれば墓標（tombstone）
+"""
+
+from utils import encode_cursor, decode_cursor
+
+# 同期対象のテーブル（migrations の change_log トリガーと同じ）
+TABLES = ('pages', 'blocks', 'templates')
+
+DEFAULT_LIMIT = 500
+MAX_LIMIT = 2000
+
+
+def latest_seqs(cursor, tables):
+    """テーブルごとの最新の seq（変更がなければ 0）。テーブル数ぶんのインデックスシークだけ"""
+    columns = ', '.join('(SELECT MAX(seq) FROM change_log WHERE table_name = ?)' for _ in tables)
+    cursor.execute(f'SELECT {columns}', tuple(tables))
+    return {table: seq or 0 for table, seq in zip(tables, cursor.fetchone())}
+
+
+def get_changes(cursor, since=None, limit=DEFAULT_LIMIT, tables=TABLES):
+    """since（前回の next_cursor、None なら最初から）より後の変更を返す
+
+    戻り値は (変更のリスト, next_cursor, has_more)。
+    各変更は {'seq', 'table', 'id', 'op': 'upsert' | 'delete', 'row'(upsert のみ)}。
+    同じ行の変更は最新の1件にまとまっている。since が不正なら ValueError。
+    """
+    since_seq = decode_cursor(since, int)[0] if since else 0
+    limit = max(1, min(int(limit), MAX_LIMIT))
+    placeholders = ', '.join('?' for _ in tables)
+    cursor.execute(f'''
+        SELECT seq, table_name, row_id, deleted FROM change_log
+        WHERE seq > ? AND table_name IN ({placeholders})
+        ORDER BY seq
+        LIMIT ?
+    ''', (since_seq,) + tuple(tables) + (limit + 1,))
+    entries = cursor.fetchall()
+    has_more = len(entries) > limit
+    entries = entries[:limit]
+
+    # upsert の行はテーブルごとに1クエリでまとめて読む
+    rows = {}
+    for table in tables:
+        ids = [entry['row_id'] for entry in entries if entry['table_name'] == table and not entry['deleted']]
+        if ids:
+            cursor.execute(
+                f'SELECT * FROM {table} WHERE id IN ({", ".join("?" for _ in ids)})', ids
+            )
+            rows.update(((table, row['id']), dict(row)) for row in cursor.fetchall())
+
+    changes = []
+    for entry in entries:
+        change = {'seq': entry['seq'], 'table': entry['table_name'], 'id': entry['row_id']}
+        row = rows.get((entry['table_name'], entry['row_id']))
+        if row is None:
+            change['op'] = 'delete'
+        else:
+            change['op'] = 'upsert'
+            change['row'] = row
+        changes.append(change)
+
+    last_seq = entries[-1]['seq'] if entries else since_seq
+    return changes, encode_cursor(last_seq), has_more
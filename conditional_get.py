@@ -0,0 +1,72 @@
+# -*- coding: utf-8 -*-
+"""
+条件付き GET（ETag / If-None-Match）
+- 対象の GET は、依存するテーブルの最新の変更（change_log の seq）から ETag を作る
+- If-None-Match が一致すれば、ルートを実行せず（行を読まず）に 304 を返す
+- 対象のエンドポイントと依存テーブルは CACHEABLE_ENDPOINTS にまとめて登録する
+"""
+
+import os
+
+from flask import request
+
+from changes import latest_seqs
+from database import get_db
+
+# エンドポイント名 → レスポンスが依存するテーブル
+# （今日の日付・外部 API・ファイルに依存するものは登録しない）
+CACHEABLE_ENDPOINTS = {
+    'get_pages': ('pages',),
+    'get_page_children': ('pages',),
+    'get_trash': ('pages',),
+    'list_days': ('pages',),
+    'get_page': ('pages', 'blocks'),
+    'get_page_full': ('pages', 'blocks'),
+    'get_all_workouts': ('pages', 'blocks'),
+    'get_all_english_learning': ('pages', 'blocks'),
+    'get_all_meals': ('pages', 'blocks'),
+    'search': ('pages', 'blocks'),
+    'get_activity_feed': ('pages', 'blocks'),
+    'get_book_history_route': ('pages', 'blocks'),
+    'get_templates': ('templates',),
+}
+
+# プロセスごとに変わる値。再起動（デプロイ）後はレスポンスの形が変わっていても古い ETag を使わせない
+_BOOT_ID = os.urandom(4).hex()
+
+
+def current_etag(tables):
+    """テーブルごとの最新の変更（change_log の seq）から ETag を作る"""
+    conn = get_db()
+    try:
+        seqs = latest_seqs(conn.cursor(), tables)
+    finally:
+        conn.close()
+    return _BOOT_ID + '-' + '-'.join(f'{table}.{seqs[table]}' for table in tables)
+
+
+def init_conditional_get(app):
+    """条件付き GET を app に登録（認証ガードより後に登録すること）"""
+
+    @app.before_request
+    def check_not_modified():
+        tables = CACHEABLE_ENDPOINTS.get(request.endpoint)
+        if request.method != 'GET' or tables is None:
+            return None
+        etag = current_etag(tables)
+        request.environ['conditional_get.etag'] = etag
+        if etag in request.if_none_match:
+            response = app.response_class(status=304)
+            response.set_etag(etag)
+            response.headers['Cache-Control'] = 'no-cache'
+            return response
+        return None
+
+    @app.after_request
+    def add_etag(response):
+        etag = request.environ.get('conditional_get.etag')
+        if etag and response.status_code == 200:
+            # ETag はルート実行前のバージョン。実行中に変更が入っても、次の GET で必ず取り直す
+            response.set_etag(etag)
+            response.headers['Cache-Control'] = 'no-cache'
+        return response
@@ -7,254 +7,189 @@
 """
 import sqlite3
 import os
-import json
+import threading
+from contextlib import contextmanager
 from typing import Optional
 
+from flask import g, has_app_context
+
+from ordering import next_position
+
 # パス設定
 BASE_DIR = os.path.dirname(os.path.abspath(__file__))
 DATABASE = os.path.join(BASE_DIR, 'notion.db')
 
-def get_db():
-    """データベース接続を取得"""
+# 接続を開いた時に一度だけ設定する PRAGMA
+# - WAL: 読み取りと書き込みが互いをブロックしない
+# - synchronous=NORMAL: WAL ではコミット毎の fsync を省略しても破損しない
+# - busy_timeout: 書き込みロック待ちで即座に "database is locked" にしない
+# - mmap_size / cache_size / temp_store: ページ読み込みと一時テーブルをメモリ上で処理
+DB_PRAGMAS = (
+    ('journal_mode', 'WAL'),
+    ('synchronous', 'NORMAL'),
+    ('busy_timeout', 5000),
+    ('mmap_size', 256 * 1024 * 1024),
+    ('cache_size', -64000),
+    ('temp_store', 'MEMORY'),
+)
+
+_thread_local = threading.local()
+
+
+def _connect():
+    """新しい接続を開き、PRAGMA を適用する"""
     conn = sqlite3.connect(DATABASE)
     conn.row_factory = sqlite3.Row
+    for name, value in DB_PRAGMAS:
+        conn.execute(f'PRAGMA {name} = {value}')
     return conn
 
-def init_db():
-    """データベーステーブルを初期化"""
+
+class PooledConnection:
+    """リクエスト（またはスレッド）内で共有される接続のラッパー
+
+    既存コードの ``conn = get_db() ... conn.close()`` をそのまま使えるよう、
+    close() は実際には接続を閉じず参照カウントを減らすだけにする。
+    最後の close() で未コミットの変更は破棄される（本物の close と同じ挙動）。
+    接続自体はアプリコンテキスト終了時に close_db() で、スレッドの接続はスレッド終了時に閉じる。
+
+    接続は呼び出し元と共有しているので、ヘルパーは commit() / rollback() / BEGIN を直接使わず
+    transaction() で書き込む（呼び出し元がトランザクション中なら SAVEPOINT になる）。
+    """
+
+    def __init__(self, conn):
+        self._conn = conn
+        self._depth = 0
+        self._savepoints = 0
+
+    def __getattr__(self, name):
+        return getattr(self._conn, name)
+
+    def __enter__(self):
+        self._conn.__enter__()
+        return self
+
+    def __exit__(self, *exc_info):
+        return self._conn.__exit__(*exc_info)
+
+    @contextmanager
+    def transaction(self):
+        """書き込みトランザクション。抜ける時にコミット、例外ならロールバック
+
+        すでにトランザクション中（呼び出し元が書き込み途中）なら SAVEPOINT にして、
+        自分の変更だけを確定・取り消しする。外側のトランザクションはコミットもロールバックもしない。
+        """
+        if not self._conn.in_transaction:
+            self._conn.execute('BEGIN IMMEDIATE')
+            try:
+                yield self
+            except BaseException:
+                self._conn.rollback()
+                raise
+            self._conn.commit()
+            return
+
+        self._savepoints += 1
+        name = f'pooled_sp_{self._savepoints}'
+        self._conn.execute(f'SAVEPOINT {name}')
+        try:
+            yield self
+        except BaseException:
+            self._conn.execute(f'ROLLBACK TO {name}')
+            self._conn.execute(f'RELEASE {name}')
+            raise
+        finally:
+            self._savepoints -= 1
+        self._conn.execute(f'RELEASE {name}')
+
+    def close(self):
+        self._depth = max(self._depth - 1, 0)
+        if self._depth == 0 and self._conn.in_transaction:
+            self._conn.rollback()
+
+    def reset(self):
+        """close() し忘れで残った参照カウントとトランザクションを捨てる"""
+        self._depth = 0
+        if self._conn.in_transaction:
+            self._conn.rollback()
+
+    def really_close(self):
+        self._depth = 0
+        self._conn.close()
+
+
+class _ThreadConnection:
+    """スレッドごとの接続の入れ物。スレッドが終わって thread-local が片付く時に接続を閉じる"""
+
+    def __init__(self):
+        self.pooled = PooledConnection(_connect())
+
+    def __del__(self):
+        try:
+            self.pooled.really_close()
+        except sqlite3.Error:
+            pass
+
+
+def get_db():
+    """データベース接続を取得（アプリコンテキスト/スレッド毎に1本を再利用）"""
+    if has_app_context():
+        pooled = g.get('_db_conn')
+        if pooled is None:
+            pooled = g._db_conn = PooledConnection(_connect())
+    else:
+        holder = getattr(_thread_local, 'holder', None)
+        if holder is None:
+            holder = _thread_local.holder = _ThreadConnection()
+        pooled = holder.pooled
+    pooled._depth += 1
+    return pooled
+
+
+@contextmanager
+def write_transaction():
+    """書き込み用のカーソルを返す（get_db() の接続で transaction() を開き、抜けたら close()）"""
     conn = get_db()
-    cursor = conn.cursor()
-    cursor.execute('''
-    CREATE TABLE IF NOT EXISTS pages (
-        id INTEGER PRIMARY KEY AUTOINCREMENT,
-        title TEXT DEFAULT '',
-        icon TEXT DEFAULT '📄',
-        cover_image TEXT DEFAULT '', 
-        parent_id INTEGER,
-        position REAL DEFAULT 0.0,
-        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-        updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-        FOREIGN KEY (parent_id) REFERENCES pages(id) ON DELETE CASCADE
-    )
-    ''')
-    try:
-        cursor.execute("ALTER TABLE pages ADD COLUMN cover_image TEXT DEFAULT ''")
-    except sqlite3.OperationalError:
-        pass
-    
-    # 新機能用カラム追加
-    try:
-        cursor.execute("ALTER TABLE pages ADD COLUMN is_pinned BOOLEAN DEFAULT 0")
-    except sqlite3.OperationalError:
-        pass
-    
-    try:
-        cursor.execute("ALTER TABLE pages ADD COLUMN is_deleted BOOLEAN DEFAULT 0")
-    except sqlite3.OperationalError:
-        pass
-    
-    # ブロック用の折りたたみカラム
-    try:
-        cursor.execute("ALTER TABLE blocks ADD COLUMN collapsed BOOLEAN DEFAULT 0")
-    except sqlite3.OperationalError:
-        pass
-    
-    # トグルブロック用の詳細内容カラム
-    try:
-        cursor.execute("ALTER TABLE blocks ADD COLUMN details TEXT DEFAULT ''")
-    except sqlite3.OperationalError:
-        pass
-    
-    # position を REAL に変更（既存インデックスの衝突を防ぐ）
-    try:
-        cursor.execute("ALTER TABLE pages ADD COLUMN position_new REAL DEFAULT 0.0")
-        cursor.execute("UPDATE pages SET position_new = CAST(position AS REAL) * 1000.0")
-        cursor.execute("ALTER TABLE pages DROP COLUMN position")
-        cursor.execute("ALTER TABLE pages RENAME COLUMN position_new TO position")
-    except sqlite3.OperationalError:
-        pass
-    
-    # props JSON カラムをブロックに追加
-    try:
-        cursor.execute("ALTER TABLE blocks ADD COLUMN props TEXT DEFAULT '{}'")
-    except sqlite3.OperationalError:
-        pass
-    
-    # ムード（感情）カラムを追加
-    try:
-        cursor.execute("ALTER TABLE pages ADD COLUMN mood INTEGER DEFAULT 0")
-    except sqlite3.OperationalError:
-        pass
-    
-    # 感謝日記カラムを追加
-    try:
-        cursor.execute("ALTER TABLE pages ADD COLUMN gratitude_text TEXT DEFAULT ''")
-    except sqlite3.OperationalError:
-        pass
-    
-    cursor.execute('''
-    CREATE TABLE IF NOT EXISTS blocks (
-        id INTEGER PRIMARY KEY AUTOINCREMENT,
-        page_id INTEGER NOT NULL,
-        type TEXT DEFAULT 'text',
-        content TEXT DEFAULT '',
-        checked BOOLEAN DEFAULT 0,
-        position REAL DEFAULT 0.0,
-        collapsed BOOLEAN DEFAULT 0,
-        details TEXT DEFAULT '',
-        props TEXT DEFAULT '{}',
-        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-        updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-        FOREIGN KEY (page_id) REFERENCES pages(id) ON DELETE CASCADE
-    )
-    ''')
-    cursor.execute('CREATE VIRTUAL TABLE IF NOT EXISTS blocks_fts USING fts5(title, content, content=blocks, content_rowid=id)')
-    cursor.execute('CREATE TRIGGER IF NOT EXISTS blocks_ai AFTER INSERT ON blocks BEGIN INSERT INTO blocks_fts(rowid, title, content) VALUES (new.id, (SELECT title FROM pages WHERE id = new.page_id), new.content); END;')
-    cursor.execute('CREATE TRIGGER IF NOT EXISTS blocks_ad AFTER DELETE ON blocks BEGIN INSERT INTO blocks_fts(blocks_fts, rowid, title, content) VALUES("delete", old.id, (SELECT title FROM pages WHERE id = old.page_id), old.content); END;')
-    cursor.execute('CREATE TRIGGER IF NOT EXISTS blocks_au AFTER UPDATE ON blocks BEGIN INSERT INTO blocks_fts(blocks_fts, rowid, title, content) VALUES("delete", old.id, (SELECT title FROM pages WHERE id = old.page_id), old.content); INSERT INTO blocks_fts(rowid, title, content) VALUES (new.id, (SELECT title FROM pages WHERE id = new.page_id), new.content); END;')
-    
-    # パフォーマンス改善用インデックス
-    try:
-        cursor.execute('CREATE INDEX IF NOT EXISTS idx_pages_parent_position ON pages(parent_id, position, is_deleted)')
-    except sqlite3.OperationalError:
-        pass
-    
-    try:
-        cursor.execute('CREATE INDEX IF NOT EXISTS idx_pages_is_deleted ON pages(is_deleted)')
-    except sqlite3.OperationalError:
-        pass
-    
     try:
-        cursor.execute('CREATE INDEX IF NOT EXISTS idx_blocks_page_position ON blocks(page_id, position)')
-    except sqlite3.OperationalError:
-        pass
-    
-    # テンプレート用テーブル
-    cursor.execute('''
-    CREATE TABLE IF NOT EXISTS templates (
-        id INTEGER PRIMARY KEY AUTOINCREMENT,
-        name TEXT NOT NULL,
-        icon TEXT DEFAULT '📋',
-        description TEXT DEFAULT '',
-        content_json TEXT NOT NULL,
-        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-        updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-    )
-    ''')
+        with conn.transaction():
+            yield conn.cursor()
+    finally:
+        conn.close()
 
-    # ユーザー認証用テーブル
-    cursor.execute('''
-    CREATE TABLE IF NOT EXISTS users (
-        id INTEGER PRIMARY KEY AUTOINCREMENT,
-        username TEXT NOT NULL UNIQUE,
-        password_hash TEXT NOT NULL,
-        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-    )
-    ''')
 
-    # 課金情報カラム追加
-    try:
-        cursor.execute("ALTER TABLE users ADD COLUMN stripe_customer_id TEXT")
-    except sqlite3.OperationalError:
-        pass
-    try:
-        cursor.execute("ALTER TABLE users ADD COLUMN subscription_status TEXT DEFAULT 'inactive'")
-    except sqlite3.OperationalError:
-        pass
-    try:
-        cursor.execute("ALTER TABLE users ADD COLUMN subscription_ends_at TIMESTAMP")
-    except sqlite3.OperationalError:
-        pass
+def release_thread_db(close=False):
+    """バックグラウンドスレッドの処理の区切りで呼ぶ
 
-    # パスワード再設定トークン
-    cursor.execute('''
-    CREATE TABLE IF NOT EXISTS password_reset_tokens (
-        id INTEGER PRIMARY KEY AUTOINCREMENT,
-        user_id INTEGER NOT NULL,
-        token TEXT NOT NULL UNIQUE,
-        expires_at TIMESTAMP NOT NULL,
-        used BOOLEAN DEFAULT 0,
-        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-        FOREIGN KEY (user_id) REFERENCES users(id) ON DELETE CASCADE
-    )
-    ''')
+    close() し忘れで残ったトランザクション（書き込みロックを持ったまま）を破棄する。
+    close=True ならスレッドの接続も閉じる（スレッドの終わりに呼ぶ）。
+    """
+    holder = getattr(_thread_local, 'holder', None)
+    if holder is None:
+        return
+    holder.pooled.reset()
+    if close:
+        del _thread_local.holder
+
+
+def close_db(exc=None):
+    """アプリコンテキスト終了時に接続を閉じる（teardown_appcontext 用）"""
+    pooled = g.pop('_db_conn', None)
+    if pooled is not None:
+        pooled.really_close()
 
-    # HealthPlanetトークン
-    cursor.execute('''
-    CREATE TABLE IF NOT EXISTS healthplanet_tokens (
-        id INTEGER PRIMARY KEY AUTOINCREMENT,
-        access_token TEXT NOT NULL,
-        refresh_token TEXT,
-        expires_at TIMESTAMP,
-        scope TEXT,
-        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-        updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-    )
-    ''')
-    
-    # デフォルトテンプレートを初期化
-    try:
-        cursor.execute('SELECT COUNT(*) FROM templates')
-        if cursor.fetchone()[0] == 0:
-            # 感謝日記テンプレート
-            gratitude_template = {
-                'title': '感謝日記',
-                'blocks': [
-                    {'type': 'h1', 'content': '感謝日記', 'position': 1000},
-                    {'type': 'text', 'content': '今日感謝したことを3つ書きましょう。', 'position': 2000},
-                    {'type': 'text', 'content': '1. ', 'position': 3000},
-                    {'type': 'text', 'content': '2. ', 'position': 4000},
-                    {'type': 'text', 'content': '3. ', 'position': 5000},
-                ]
-            }
-            
-            # PDCA日報テンプレート
-            pdca_template = {
-                'title': 'PDCA日報',
-                'blocks': [
-                    {'type': 'h1', 'content': 'PDCA日報', 'position': 1000},
-                    {'type': 'h2', 'content': '計画（Plan）', 'position': 2000},
-                    {'type': 'text', 'content': '', 'position': 3000},
-                    {'type': 'h2', 'content': '実行（Do）', 'position': 4000},
-                    {'type': 'text', 'content': '', 'position': 5000},
-                    {'type': 'h2', 'content': '確認（Check）', 'position': 6000},
-                    {'type': 'text', 'content': '', 'position': 7000},
-                    {'type': 'h2', 'content': '改善（Act）', 'position': 8000},
-                    {'type': 'text', 'content': '', 'position': 9000},
-                ]
-            }
-            
-            # 5行日記テンプレート
-            five_line_template = {
-                'title': '5行日記',
-                'blocks': [
-                    {'type': 'h1', 'content': '5行日記', 'position': 1000},
-                    {'type': 'text', 'content': '1. 今日起きたこと：', 'position': 2000},
-                    {'type': 'text', 'content': '2. その時の気持ち：', 'position': 3000},
-                    {'type': 'text', 'content': '3. その出来事の意味：', 'position': 4000},
-                    {'type': 'text', 'content': '4. その経験から学んだこと：', 'position': 5000},
-                    {'type': 'text', 'content': '5. 明日への決意：', 'position': 6000},
-                ]
-            }
-            
-            templates_data = [
-                ('感謝日記', '🙏', '毎日の感謝を記録するテンプレート', gratitude_template),
-                ('PDCA日報', '📊', 'Plan-Do-Check-Actフレームワーク', pdca_template),
-                ('5行日記', '📖', '1日の出来事を5行で整理するテンプレート', five_line_template),
-            ]
-            
-            for name, icon, desc, content in templates_data:
-                cursor.execute(
-                    'INSERT INTO templates (name, icon, description, content_json) VALUES (?, ?, ?, ?)',
-                    (name, icon, desc, json.dumps(content, ensure_ascii=False))
-                )
-            
-            conn.commit()
-    except Exception as e:
-        pass
-    
-    conn.commit()
-    conn.close()
+
+def register_db_teardown(app):
+    """Flask アプリに接続のクローズ処理を登録"""
+    app.teardown_appcontext(close_db)
+
+
+def init_db():
+    """データベーススキーマを最新化（migrations.py のマイグレーションを適用）
+
+    最新なら PRAGMA user_version を1回読むだけで戻る。
+    """
+    from migrations import migrate
+    return migrate()
 
 def get_healthplanet_token() -> Optional[sqlite3.Row]:
     """HealthPlanetのトークンを取得"""
@@ -268,23 +203,17 @@ def get_healthplanet_token() -> Optional[sqlite3.Row]:
 def save_healthplanet_token(access_token: str, refresh_token: Optional[str] = None,
                             expires_at: Optional[str] = None, scope: Optional[str] = None) -> None:
     """HealthPlanetのトークンを保存（最新1件のみ保持）"""
-    conn = get_db()
-    cursor = conn.cursor()
-    cursor.execute('DELETE FROM healthplanet_tokens')
-    cursor.execute(
-        'INSERT INTO healthplanet_tokens (access_token, refresh_token, expires_at, scope) VALUES (?, ?, ?, ?)',
-        (access_token, refresh_token, expires_at, scope)
-    )
-    conn.commit()
-    conn.close()
+    with write_transaction() as cursor:
+        cursor.execute('DELETE FROM healthplanet_tokens')
+        cursor.execute(
+            'INSERT INTO healthplanet_tokens (access_token, refresh_token, expires_at, scope) VALUES (?, ?, ?, ?)',
+            (access_token, refresh_token, expires_at, scope)
+        )
 
 def clear_healthplanet_token() -> None:
     """HealthPlanetのトークンを削除"""
-    conn = get_db()
-    cursor = conn.cursor()
-    cursor.execute('DELETE FROM healthplanet_tokens')
-    conn.commit()
-    conn.close()
+    with write_transaction() as cursor:
+        cursor.execute('DELETE FROM healthplanet_tokens')
 
 def get_user_count() -> int:
     """登録ユーザー数を取得"""
@@ -315,35 +244,26 @@ def get_user_by_id(user_id: int) -> Optional[sqlite3.Row]:
 
 def create_user(username: str, password_hash: str) -> int:
     """ユーザー作成"""
-    conn = get_db()
-    cursor = conn.cursor()
-    cursor.execute(
-        'INSERT INTO users (username, password_hash) VALUES (?, ?)',
-        (username, password_hash)
-    )
-    user_id = cursor.lastrowid
-    conn.commit()
-    conn.close()
+    with write_transaction() as cursor:
+        cursor.execute(
+            'INSERT INTO users (username, password_hash) VALUES (?, ?)',
+            (username, password_hash)
+        )
+        user_id = cursor.lastrowid
     return int(user_id)
 
 def update_user_password(user_id: int, password_hash: str) -> None:
     """パスワード更新"""
-    conn = get_db()
-    cursor = conn.cursor()
-    cursor.execute('UPDATE users SET password_hash = ? WHERE id = ?', (password_hash, user_id))
-    conn.commit()
-    conn.close()
+    with write_transaction() as cursor:
+        cursor.execute('UPDATE users SET password_hash = ? WHERE id = ?', (password_hash, user_id))
 
 def set_password_reset_token(user_id: int, token: str, expires_at: str) -> None:
     """パスワード再設定トークン登録"""
-    conn = get_db()
-    cursor = conn.cursor()
-    cursor.execute(
-        'INSERT INTO password_reset_tokens (user_id, token, expires_at) VALUES (?, ?, ?)',
-        (user_id, token, expires_at)
-    )
-    conn.commit()
-    conn.close()
+    with write_transaction() as cursor:
+        cursor.execute(
+            'INSERT INTO password_reset_tokens (user_id, token, expires_at) VALUES (?, ?, ?)',
+            (user_id, token, expires_at)
+        )
 
 def get_password_reset_token(token: str) -> Optional[sqlite3.Row]:
     """トークン取得"""
@@ -356,19 +276,13 @@ def get_password_reset_token(token: str) -> Optional[sqlite3.Row]:
 
 def mark_password_reset_token_used(token: str) -> None:
     """トークン使用済み"""
-    conn = get_db()
-    cursor = conn.cursor()
-    cursor.execute('UPDATE password_reset_tokens SET used = 1 WHERE token = ?', (token,))
-    conn.commit()
-    conn.close()
+    with write_transaction() as cursor:
+        cursor.execute('UPDATE password_reset_tokens SET used = 1 WHERE token = ?', (token,))
 
 def update_user_stripe_customer(user_id: int, customer_id: str) -> None:
     """Stripe顧客ID更新"""
-    conn = get_db()
-    cursor = conn.cursor()
-    cursor.execute('UPDATE users SET stripe_customer_id = ? WHERE id = ?', (customer_id, user_id))
-    conn.commit()
-    conn.close()
+    with write_transaction() as cursor:
+        cursor.execute('UPDATE users SET stripe_customer_id = ? WHERE id = ?', (customer_id, user_id))
 
 def get_user_by_stripe_customer(customer_id: str) -> Optional[sqlite3.Row]:
     """Stripe顧客IDでユーザー取得"""
@@ -381,219 +295,327 @@ def get_user_by_stripe_customer(customer_id: str) -> Optional[sqlite3.Row]:
 
 def update_user_subscription(user_id: int, status: str, ends_at: Optional[str] = None) -> None:
     """サブスク状態更新"""
-    conn = get_db()
-    cursor = conn.cursor()
-    cursor.execute(
-        'UPDATE users SET subscription_status = ?, subscription_ends_at = ? WHERE id = ?',
-        (status, ends_at, user_id)
-    )
-    conn.commit()
-    conn.close()
+    with write_transaction() as cursor:
+        cursor.execute(
+            'UPDATE users SET subscription_status = ?, subscription_ends_at = ? WHERE id = ?',
+            (status, ends_at, user_id)
+        )
 
 def get_next_position(cursor, parent_id):
     """次のposition値を計算（1000刻み方式）"""
-    if parent_id:
-        cursor.execute('SELECT MAX(position) FROM pages WHERE parent_id = ?', (parent_id,))
-    else:
-        cursor.execute('SELECT MAX(position) FROM pages WHERE parent_id IS NULL')
-    max_pos = cursor.fetchone()[0]
-    if max_pos is None:
-        return 1000.0
-    return max_pos + 1000.0
+    return next_position(cursor, 'pages', parent_id or None)
 
 def get_block_next_position(cursor, page_id):
     """ブロックの次のposition値を計算"""
-    cursor.execute('SELECT MAX(position) FROM blocks WHERE page_id = ?', (page_id,))
-    max_pos = cursor.fetchone()[0]
-    if max_pos is None:
-        return 1000.0
-    return max_pos + 1000.0
+    return next_position(cursor, 'blocks', page_id)
+
+def next_row_id(cursor, table):
+    """table の次に使われる ID（AUTOINCREMENT の sqlite_sequence も見る）
+
+    まとめて ID を割り当てる時に使う。書き込みロックを持った状態
+    （BEGIN IMMEDIATE 済みか、同じトランザクションで書き込み済み）で呼ぶこと。
+    """
+    cursor.execute(f'''
+        SELECT MAX(COALESCE((SELECT seq FROM sqlite_sequence WHERE name = ?), 0),
+                   COALESCE((SELECT MAX(id) FROM {table}), 0)) + 1
+    ''', (table,))
+    return cursor.fetchone()[0]
+
+def get_subtree_ids(cursor, page_id):
+    """ページとその全子孫のIDを取得（page_closure を1回引くだけ）"""
+    cursor.execute('SELECT descendant_id FROM page_closure WHERE ancestor_id = ?', (page_id,))
+    return [row[0] for row in cursor.fetchall()]
+
+def get_subtree_pages(cursor, page_id):
+    """ページとその全子孫を深さ→position順で取得（親が必ず子より先に来る）"""
+    cursor.execute('''
+        SELECT pages.* FROM page_closure
+        JOIN pages ON pages.id = page_closure.descendant_id
+        WHERE page_closure.ancestor_id = ?
+        ORDER BY page_closure.depth, pages.position
+    ''', (page_id,))
+    return [dict(row) for row in cursor.fetchall()]
+
+def get_subtree_blocks(cursor, page_id):
+    """部分木に含まれる全ページのブロックをまとめて取得（page_id, position順）"""
+    cursor.execute('''
+        SELECT * FROM blocks
+        WHERE page_id IN (SELECT descendant_id FROM page_closure WHERE ancestor_id = ?)
+        ORDER BY page_id, position
+    ''', (page_id,))
+    return [dict(row) for row in cursor.fetchall()]
+
+def get_ancestor_map(cursor, page_ids):
+    """各ページの祖先（ルート→親の順、自身は含まない）を1クエリでまとめて取得"""
+    ids = list({page_id for page_id in page_ids if page_id})
+    if not ids:
+        return {}
+    placeholders = ', '.join('?' for _ in ids)
+    cursor.execute(f'''
+        SELECT page_closure.descendant_id, pages.id, pages.title, pages.icon
+        FROM page_closure
+        JOIN pages ON pages.id = page_closure.ancestor_id
+        WHERE page_closure.descendant_id IN ({placeholders}) AND page_closure.depth > 0
+        ORDER BY page_closure.descendant_id, page_closure.depth DESC
+    ''', ids)
+    ancestors = {page_id: [] for page_id in ids}
+    for row in cursor.fetchall():
+        ancestors[row['descendant_id']].append({'id': row['id'], 'title': row['title'], 'icon': row['icon']})
+    return ancestors
+
+def get_page_depth(cursor, page_id):
+    """ページの深さ（ルート = 0）を取得"""
+    cursor.execute('SELECT MAX(depth) FROM page_closure WHERE descendant_id = ?', (page_id,))
+    depth = cursor.fetchone()[0]
+    return int(depth or 0)
+
+def _select_columns(cursor, table, fields, required):
+    """SELECT するカラムのリスト。fields が None なら全カラム、未知のカラムがあれば ValueError"""
+    cursor.execute(f'PRAGMA table_info({table})')
+    columns = [row[1] for row in cursor.fetchall()]
+    if fields is None:
+        return [f'{table}.{column}' for column in columns]
+    unknown = [field for field in fields if field not in columns]
+    if unknown:
+        raise ValueError(f'Unknown {table} fields: {", ".join(unknown)}')
+    selected = list(required) + [field for field in fields if field not in required]
+    return [f'{table}.{column}' for column in selected]
+
+def get_page_tree(cursor, page_id, max_depth=1, page_fields=None, block_fields=None):
+    """ページと max_depth 段下までの子孫ページ、その全ブロックを入れ子の dict で取得
+
+    部分木1回・ブロック1回の2クエリで取得する（削除済みの子孫は含めない）。
+    page_fields / block_fields を渡すとそのカラムだけを返す（pages の id・parent_id と
+    blocks の id・page_id は常に含む）。ページがなければ None。
+    """
+    page_columns = _select_columns(cursor, 'pages', page_fields, ('id', 'parent_id'))
+    block_columns = _select_columns(cursor, 'blocks', block_fields, ('id', 'page_id'))
+    subtree = '''
+        FROM page_closure
+        JOIN pages ON pages.id = page_closure.descendant_id
+        WHERE page_closure.ancestor_id = ? AND page_closure.depth <= ?
+          AND (page_closure.depth = 0 OR pages.is_deleted = 0)
+    '''
+    cursor.execute(
+        f'SELECT {", ".join(page_columns)} {subtree} ORDER BY page_closure.depth, pages.position',
+        (page_id, max_depth)
+    )
+    nodes = {}
+    root = None
+    for row in cursor.fetchall():
+        node = dict(row)
+        node['blocks'] = []
+        node['children'] = []
+        if root is None:
+            root = node
+        elif node['parent_id'] in nodes:
+            nodes[node['parent_id']]['children'].append(node)
+        else:
+            # 削除済みのページの下に残った子孫
+            continue
+        nodes[node['id']] = node
+    if root is None:
+        return None
+
+    cursor.execute(f'''
+        SELECT {", ".join(block_columns)} FROM blocks
+        WHERE blocks.page_id IN (SELECT pages.id {subtree})
+        ORDER BY blocks.page_id, blocks.position
+    ''', (page_id, max_depth))
+    for row in cursor.fetchall():
+        node = nodes.get(row['page_id'])
+        if node is not None:
+            node['blocks'].append(dict(row))
+    return root
+
+def _subtrees(page_ids):
+    """page_ids を根とする部分木の全ページIDを返すサブクエリとパラメータ"""
+    placeholders = ', '.join('?' for _ in page_ids)
+    return f'SELECT descendant_id FROM page_closure WHERE ancestor_id IN ({placeholders})', tuple(page_ids)
+
+def mark_trees_deleted(cursor, page_ids, is_deleted=True):
+    """複数のページとその全子ページの削除フラグを1文で変更（soft delete）
+
+    ゴミ箱に入れた時刻を deleted_at に記録する（すでにゴミ箱にあるページは元の時刻のまま）。
+    復元では日付キー（journal_date）を外したページの日付のリストを返す（一意インデックスとぶつかるもの）。
+    """
+    subtree, params = _subtrees(page_ids)
+    if is_deleted:
+        cursor.execute(f'''
+            UPDATE pages SET is_deleted = 1, deleted_at = CURRENT_TIMESTAMP
+            WHERE id IN ({subtree}) AND is_deleted = 0
+        ''', params)
+        return None
+    # 削除中に同じ日付のページが作り直されていた・同じ日付のページを一緒に復元する場合は、
+    # 復元する側（一緒に復元するものは ID の小さい1つ以外）の日付キーを外す（一意インデックス）
+    cursor.execute(f'''
+        SELECT id, journal_date FROM pages
+        WHERE id IN ({subtree}) AND is_deleted = 1 AND journal_date IS NOT NULL
+          AND (journal_date IN (SELECT journal_date FROM pages WHERE journal_date IS NOT NULL AND is_deleted = 0)
+               OR id > (SELECT MIN(other.id) FROM pages other
+                        WHERE other.id IN ({subtree}) AND other.is_deleted = 1
+                          AND other.journal_date = pages.journal_date))
+    ''', params + params)
+    detached = cursor.fetchall()
+    cursor.executemany('UPDATE pages SET journal_date = NULL WHERE id = ?', [(row[0],) for row in detached])
+    cursor.execute(f'UPDATE pages SET is_deleted = 0, deleted_at = NULL WHERE id IN ({subtree})', params)
+    return sorted({row[1] for row in detached})
 
 def mark_tree_deleted(cursor, page_id, is_deleted=True):
-    """ページとその全子ページを再帰的に削除フラグ変更（soft delete）"""
-    cursor.execute('UPDATE pages SET is_deleted = ? WHERE id = ?', (1 if is_deleted else 0, page_id))
-    cursor.execute('SELECT id FROM pages WHERE parent_id = ?', (page_id,))
-    for row in cursor.fetchall():
-        mark_tree_deleted(cursor, row['id'], is_deleted)
+    """ページとその全子ページの削除フラグを変更（soft delete）。戻り値は mark_trees_deleted と同じ"""
+    return mark_trees_deleted(cursor, [page_id], is_deleted)
+
+def hard_delete_trees(cursor, page_ids):
+    """複数のページとその全子ページを完全削除（hard delete）
+
+    ブロックも明示的に消すので、接続の PRAGMA foreign_keys（ON DELETE CASCADE）には依存しない。
+    """
+    subtree, params = _subtrees(page_ids)
+    # ブロックを先に消す（ページが残っているうちに消さないと search_fts から正しく外せない）
+    cursor.execute(f'DELETE FROM blocks WHERE page_id IN ({subtree})', params)
+    cursor.execute(f'DELETE FROM pages WHERE id IN ({subtree})', params)
 
 def hard_delete_tree(cursor, page_id):
-    """ページとその全子ページを再帰的に完全削除（hard delete）"""
-    cursor.execute('SELECT id FROM pages WHERE parent_id = ?', (page_id,))
-    for row in cursor.fetchall():
-        hard_delete_tree(cursor, row['id'])
-    cursor.execute('DELETE FROM pages WHERE id = ?', (page_id,))
+    """ページとその全子ページを完全削除（hard delete）"""
+    hard_delete_trees(cursor, [page_id])
+
+# === システムページ（あとで調べる・知識の宝庫・読了） ===
+
+# role → 作成時の内容（parent は親ページの role）
+SYSTEM_PAGES = {
+    'inbox': {'title': '🔖 あとで調べる', 'icon': '🔖', 'blocks': [{'type': 'text', 'content': ''}]},
+    'knowledge': {'title': '📚 知識の宝庫', 'icon': '📚', 'blocks': [{'type': 'text', 'content': ''}]},
+    'finished': {'title': '📚 読了', 'icon': '📚', 'blocks': []},
+    'finished_books': {
+        'title': '読了した本', 'icon': '✅', 'parent': 'finished',
+        'blocks': [{'type': 'h1', 'content': '読了した本'}, {'type': 'text', 'content': ''}],
+    },
+    'finished_thoughts': {
+        'title': '日々の感想', 'icon': '📝', 'parent': 'finished',
+        'blocks': [{'type': 'h1', 'content': '日々の感想'}, {'type': 'text', 'content': ''}],
+    },
+}
+
+# role → page_id（system_pages テーブルのプロセス内コピー）
+_system_page_ids = {}
+_system_page_lock = threading.Lock()
+
+def _load_system_pages(cursor):
+    cursor.execute('SELECT role, page_id FROM system_pages')
+    ids = {row[0]: row[1] for row in cursor.fetchall()}
+    with _system_page_lock:
+        _system_page_ids.clear()
+        _system_page_ids.update(ids)
+    return ids
+
+def get_system_page_id(cursor, role, reload=False):
+    """role のページIDを返す（キャッシュになければ system_pages を読み直す）。未登録なら None"""
+    if not reload:
+        page_id = _system_page_ids.get(role)
+        if page_id is not None:
+            return page_id
+    return _load_system_pages(cursor).get(role)
+
+def is_system_page(cursor, role, page_id):
+    """page_id が role のページか（別プロセスが作り直した場合に備え、違えば一度だけ読み直す）"""
+    if page_id is None:
+        return False
+    if get_system_page_id(cursor, role) == page_id:
+        return True
+    return get_system_page_id(cursor, role, reload=True) == page_id
+
+def _create_system_page(cursor, role, parent_id=None):
+    """role のページを作って system_pages に登録（呼び出し側のトランザクション内）"""
+    spec = SYSTEM_PAGES[role]
+    cursor.execute('INSERT INTO pages (title, icon, parent_id, position) VALUES (?, ?, ?, ?)',
+                   (spec['title'], spec['icon'], parent_id, get_next_position(cursor, parent_id)))
+    page_id = cursor.lastrowid
+    cursor.executemany(
+        'INSERT INTO blocks (page_id, type, content, position) VALUES (?, ?, ?, ?)',
+        [(page_id, block['type'], block['content'], (i + 1) * 1000.0) for i, block in enumerate(spec['blocks'])]
+    )
+    cursor.execute(
+        'INSERT INTO system_pages (role, page_id) VALUES (?, ?) '
+        'ON CONFLICT (role) DO UPDATE SET page_id = excluded.page_id',
+        (role, page_id)
+    )
+    with _system_page_lock:
+        _system_page_ids[role] = page_id
+    return page_id
+
+def _ensure_system_page(cursor, role):
+    """role のページIDを返す。未登録か、登録先のページが完全削除・ゴミ箱にあれば作り直す
+
+    ゴミ箱のページは復元しない（ゴミ箱の中身はそのまま残す）。
+    親を作り直した時、生きている子のページは新しい親の下へ移す。
+    """
+    parent = SYSTEM_PAGES[role].get('parent')
+    parent_id = _ensure_system_page(cursor, parent) if parent else None
+    page_id = get_system_page_id(cursor, role, reload=True)
+    if page_id is not None:
+        cursor.execute('SELECT parent_id, is_deleted FROM pages WHERE id = ?', (page_id,))
+        row = cursor.fetchone()
+        if row and not row['is_deleted']:
+            if parent and row['parent_id'] != parent_id:
+                cursor.execute('UPDATE pages SET parent_id = ?, position = ? WHERE id = ?',
+                               (parent_id, get_next_position(cursor, parent_id), page_id))
+            return page_id
+    return _create_system_page(cursor, role, parent_id)
+
+def _live_children(cursor, children):
+    """子の role のページがすべて登録済みで、ゴミ箱に入っていないか"""
+    if not children:
+        return True
+    page_ids = [_system_page_ids.get(child) for child in children]
+    if None in page_ids:
+        return False
+    cursor.execute(
+        f"SELECT COUNT(*) FROM pages WHERE id IN ({', '.join('?' for _ in page_ids)}) AND is_deleted = 0", page_ids
+    )
+    return cursor.fetchone()[0] == len(page_ids)
+
+def get_or_create_system_page(role):
+    """role のページを取得、なければ作成
+
+    普段はキャッシュした ID で主キーを1回引くだけ。ページが見つからない時だけ
+    書き込みロックを取って system_pages を読み直し、作成・登録する（何度呼んでも1つ）。
+    呼び出し元のトランザクションの中から呼んでもよい（その場合は SAVEPOINT で書き、確定は呼び出し元）。
+    ゴミ箱に入っているページは使わず作り直す。
+    子ページを持つ role（読了）は、子が未登録・完全削除済み・ゴミ箱の時だけ子も作る。
+    """
+    children = [child for child, spec in SYSTEM_PAGES.items() if spec.get('parent') == role]
+    conn = get_db()
+    cursor = conn.cursor()
+    try:
+        page_id = get_system_page_id(cursor, role)
+        page = None
+        if page_id is not None:
+            cursor.execute('SELECT * FROM pages WHERE id = ?', (page_id,))
+            page = cursor.fetchone()
+        if page is None or page['is_deleted'] or not _live_children(cursor, children):
+            # 呼び出し元がトランザクション中なら SAVEPOINT（呼び出し元の書き込みは確定しない）
+            with conn.transaction():
+                page_id = _ensure_system_page(cursor, role)
+                for child in children:
+                    _ensure_system_page(cursor, child)
+            cursor.execute('SELECT * FROM pages WHERE id = ?', (page_id,))
+            page = cursor.fetchone()
+        return dict(page) if page else None
+    finally:
+        conn.close()
 
 def get_or_create_inbox():
     """'あとで調べる'ページを取得、なければ作成"""
-    conn = get_db()
-    cursor = conn.cursor()
-    cursor.execute('SELECT * FROM pages WHERE title = ? AND parent_id IS NULL LIMIT 1', ('🔖 あとで調べる',))
-    inbox = cursor.fetchone()
-    if not inbox:
-        cursor.execute('SELECT MAX(position) FROM pages WHERE parent_id IS NULL')
-        max_pos = cursor.fetchone()[0]
-        new_pos = (max_pos if max_pos is not None else -1) + 1
-        cursor.execute('INSERT INTO pages (title, icon, parent_id, position) VALUES (?, ?, ?, ?)',
-                       ('🔖 あとで調べる', '🔖', None, new_pos))
-        inbox_id = cursor.lastrowid
-        cursor.execute("INSERT INTO blocks (page_id, type, content, position) VALUES (?, 'text', '', ?)",
-                       (inbox_id, 1000.0))
-        conn.commit()
-        cursor.execute('SELECT * FROM pages WHERE id = ?', (inbox_id,))
-        inbox = cursor.fetchone()
-    conn.close()
-    return dict(inbox) if inbox else None
+    return get_or_create_system_page('inbox')
 
 def get_or_create_knowledge_base():
     """'知識の宝庫'ページを取得、なければ作成"""
-    conn = get_db()
-    cursor = conn.cursor()
-    cursor.execute('SELECT * FROM pages WHERE title = ? AND parent_id IS NULL LIMIT 1', ('📚 知識の宝庫',))
-    knowledge = cursor.fetchone()
-    if not knowledge:
-        cursor.execute('SELECT MAX(position) FROM pages WHERE parent_id IS NULL')
-        max_pos = cursor.fetchone()[0]
-        new_pos = (max_pos if max_pos is not None else -1) + 1
-        cursor.execute('INSERT INTO pages (title, icon, parent_id, position) VALUES (?, ?, ?, ?)',
-                       ('📚 知識の宝庫', '📚', None, new_pos))
-        knowledge_id = cursor.lastrowid
-        cursor.execute("INSERT INTO blocks (page_id, type, content, position) VALUES (?, 'text', '', ?)",
-                       (knowledge_id, 1000.0))
-        conn.commit()
-        cursor.execute('SELECT * FROM pages WHERE id = ?', (knowledge_id,))
-        knowledge = cursor.fetchone()
-    conn.close()
-    return dict(knowledge) if knowledge else None
+    return get_or_create_system_page('knowledge')
 
 def get_or_create_finished():
-    """'読了'ページを取得、なければ作成"""
-    conn = get_db()
-    cursor = conn.cursor()
-    cursor.execute('SELECT * FROM pages WHERE title = ? AND parent_id IS NULL LIMIT 1', ('📚 読了',))
-    finished = cursor.fetchone()
-    if not finished:
-        cursor.execute('SELECT MAX(position) FROM pages WHERE parent_id IS NULL')
-        max_pos = cursor.fetchone()[0]
-        new_pos = (max_pos if max_pos is not None else -1) + 1
-        cursor.execute('INSERT INTO pages (title, icon, parent_id, position) VALUES (?, ?, ?, ?)',
-                       ('📚 読了', '📚', None, new_pos))
-        finished_id = cursor.lastrowid
-
-        children = [
-            {
-                'title': '読了した本',
-                'icon': '✅',
-                'blocks': [
-                    {'type': 'h1', 'content': '読了した本'},
-                    {'type': 'text', 'content': ''},
-                ]
-            },
-            {
-                'title': '日々の感想',
-                'icon': '📝',
-                'blocks': [
-                    {'type': 'h1', 'content': '日々の感想'},
-                    {'type': 'text', 'content': ''},
-                ]
-            }
-        ]
-
-        for i, child in enumerate(children):
-            cursor.execute('INSERT INTO pages (title, icon, parent_id, position) VALUES (?, ?, ?, ?)',
-                           (child['title'], child['icon'], finished_id, (i + 1) * 1000.0))
-            child_id = cursor.lastrowid
-            for j, block in enumerate(child['blocks']):
-                cursor.execute(
-                    'INSERT INTO blocks (page_id, type, content, position) VALUES (?, ?, ?, ?)',
-                    (child_id, block.get('type', 'text'), block.get('content', ''), (j + 1) * 1000.0)
-                )
-
-        conn.commit()
-        cursor.execute('SELECT * FROM pages WHERE id = ?', (finished_id,))
-        finished = cursor.fetchone()
-    else:
-        finished_id = finished['id']
-        cursor.execute('SELECT title FROM pages WHERE parent_id = ? AND is_deleted = 0', (finished_id,))
-        existing_titles = {row['title'] for row in cursor.fetchall()}
-
-        children = [
-            {
-                'title': '読了した本',
-                'icon': '✅',
-                'blocks': [
-                    {'type': 'h1', 'content': '読了した本'},
-                    {'type': 'text', 'content': ''},
-                ]
-            },
-            {
-                'title': '日々の感想',
-                'icon': '📝',
-                'blocks': [
-                    {'type': 'h1', 'content': '日々の感想'},
-                    {'type': 'text', 'content': ''},
-                ]
-            }
-        ]
-
-        next_pos = get_next_position(cursor, finished_id)
-        for child in children:
-            if child['title'] in existing_titles:
-                continue
-            cursor.execute('INSERT INTO pages (title, icon, parent_id, position) VALUES (?, ?, ?, ?)',
-                           (child['title'], child['icon'], finished_id, next_pos))
-            child_id = cursor.lastrowid
-            next_pos += 1000.0
-            for j, block in enumerate(child['blocks']):
-                cursor.execute(
-                    'INSERT INTO blocks (page_id, type, content, position) VALUES (?, ?, ?, ?)',
-                    (child_id, block.get('type', 'text'), block.get('content', ''), (j + 1) * 1000.0)
-                )
-        conn.commit()
+    """'読了'ページ（子ページ '読了した本'・'日々の感想' を含む）を取得、なければ作成"""
+    return get_or_create_system_page('finished')
 
-    conn.close()
-    return dict(finished) if finished else None
 def ensure_indexes():
-    """必要なインデックスが存在することを確認し、存在しなければ作成"""
-    conn = get_db()
-    cursor = conn.cursor()
-    
-    # 既存のインデックスを取得
-    cursor.execute("SELECT name FROM sqlite_master WHERE type='index' AND name LIKE 'idx_%'")
-    existing_indexes = {row[0] for row in cursor.fetchall()}
-    
-    # 作成が必要なインデックス
-    required_indexes = [
-        {
-            'name': 'idx_pages_parent_position',
-            'table': 'pages',
-            'columns': ['parent_id', 'position', 'is_deleted'],
-            'sql': 'CREATE INDEX IF NOT EXISTS idx_pages_parent_position ON pages(parent_id, position, is_deleted)'
-        },
-        {
-            'name': 'idx_pages_is_deleted',
-            'table': 'pages',
-            'columns': ['is_deleted'],
-            'sql': 'CREATE INDEX IF NOT EXISTS idx_pages_is_deleted ON pages(is_deleted)'
-        },
-        {
-            'name': 'idx_blocks_page_position',
-            'table': 'blocks',
-            'columns': ['page_id', 'position'],
-            'sql': 'CREATE INDEX IF NOT EXISTS idx_blocks_page_position ON blocks(page_id, position)'
-        },
-    ]
-    
-    created_count = 0
-    for idx_info in required_indexes:
-        idx_name = idx_info['name']
-        try:
-            cursor.execute(idx_info['sql'])
-            created_count += 1
-            print(f"✅ Index ensured: {idx_name}")
-        except sqlite3.OperationalError as e:
-            print(f"⚠️  Index creation failed for {idx_name}: {e}")
-    
-    conn.commit()
-    conn.close()
-    
-    return created_count
\ No newline at end of file
+    """必要なインデックスが存在することを確認（インデックスはマイグレーションで管理）"""
+    return init_db()
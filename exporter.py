@@ -0,0 +1,321 @@
+# -*- coding: utf-8 -*-
+"""
+ストリーミングエクスポート（JSON / JSON Lines）
+- ページは部分木を閉包テーブルから1クエリで読み、ブロックはツリーの順に1クエリで流す（ページ数によらず2クエリ）
+- 全体の辞書を組み立てずに、コンパクトな JSON を少しずつ書き出す（メモリに持つのは1ページぶんのブロックだけ）
+- 読み始めから書き終わりまで1つの読み取りトランザクションで読む（途中で書き込まれても壊れない）
+- JSON Lines は1行1ページ（blocks 付き、children なし）。親が子より先に来るので /api/import/json でそのまま取り込める
+- ZIP は目録（ページのディレクトリ・page.md・blocks.json・添付）を先に作り、アーカイブを書いたそばから送る。
+  添付は小さなスレッドプールで先読みし、圧縮済みの形式（jpg/png/zip/docx など）は再圧縮せずに格納する
+"""
+
+import json
+import os
+import unicodedata
+import zipfile
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from urllib.parse import quote
+
+from database import get_db
+from utils import page_to_markdown
+
+EXPORT_VERSION = '1.0'
+
+# この文字数溜まったらクライアントへ送る
+FLUSH_SIZE = 64 * 1024
+
+# ZIP: 添付を読むスレッド数と、先読みしておく件数
+ZIP_READ_WORKERS = 4
+ZIP_PREFETCH = 8
+# これより大きい添付は先読みせず、書き込みながら ZIP_CHUNK_SIZE ずつ読む
+ZIP_INLINE_LIMIT = 4 * 1024 * 1024
+ZIP_CHUNK_SIZE = 1024 * 1024
+# すでに圧縮されている形式（deflate しても縮まないので無圧縮で格納する）
+STORED_EXTENSIONS = frozenset({'jpg', 'jpeg', 'png', 'gif', 'webp', 'zip', 'docx', 'xlsx', 'pptx'})
+# ZIP の blocks.json に書くブロックの列（インポートで元に戻せるもの）
+ZIP_BLOCK_FIELDS = ('type', 'content', 'checked', 'position', 'collapsed', 'details', 'props')
+
+
+class ExportTree:
+    """エクスポートするページツリー（ブロックは含まない）"""
+
+    def __init__(self, roots, children):
+        self.roots = roots
+        self.children = children
+
+    def walk(self):
+        """(ページ, 深さ) を親→子の順（深さ優先、兄弟は position 順）で返す"""
+        stack = [(page, 0) for page in reversed(self.roots)]
+        while stack:
+            page, depth = stack.pop()
+            yield page, depth
+            stack.extend((child, depth + 1) for child in reversed(self.children.get(page['id'], [])))
+
+
+def load_tree(cursor, page_id=None):
+    """ページツリーを1クエリで読む（page_id なしなら削除されていない全ルートの部分木）。なければ None
+
+    ゴミ箱の子ページも含める（これまでのエクスポートと同じ）。
+    """
+    if page_id is None:
+        cursor.execute('''
+            SELECT pages.* FROM pages root
+            JOIN page_closure ON page_closure.ancestor_id = root.id
+            JOIN pages ON pages.id = page_closure.descendant_id
+            WHERE root.parent_id IS NULL AND root.is_deleted = 0
+            ORDER BY page_closure.depth, pages.position
+        ''')
+    else:
+        cursor.execute('''
+            SELECT pages.* FROM page_closure
+            JOIN pages ON pages.id = page_closure.descendant_id
+            WHERE page_closure.ancestor_id = ?
+            ORDER BY page_closure.depth, pages.position
+        ''', (page_id,))
+    roots = []
+    children = {}
+    for row in cursor:
+        page = dict(row)
+        if page['id'] == page_id or (page_id is None and page['parent_id'] is None):
+            roots.append(page)
+        else:
+            # 深さ順なので親は読み込み済み
+            children.setdefault(page['parent_id'], []).append(page)
+    return ExportTree(roots, children) if roots else None
+
+
+def iter_pages_with_blocks(conn, tree):
+    """(ページ, 深さ, ブロックのリスト) をツリーの順で返す。ブロックは1クエリで流し、1ページぶんずつ区切る"""
+    order = list(tree.walk())
+    cursor = conn.cursor()
+    cursor.execute('''
+        SELECT blocks.* FROM json_each(?) AS page_order
+        JOIN blocks ON blocks.page_id = page_order.value
+        ORDER BY page_order.key, blocks.position
+    ''', (json.dumps([page['id'] for page, _ in order]),))
+    pending = cursor.fetchone()
+    for page, depth in order:
+        blocks = []
+        while pending is not None and pending['page_id'] == page['id']:
+            blocks.append(dict(pending))
+            pending = cursor.fetchone()
+        yield page, depth, blocks
+
+
+def _dumps(value):
+    return json.dumps(value, ensure_ascii=False, separators=(',', ':'))
+
+
+def _buffered(parts):
+    """細かい文字列をまとめて UTF-8 のバイト列で返す"""
+    buffer = []
+    size = 0
+    for part in parts:
+        buffer.append(part)
+        size += len(part)
+        if size >= FLUSH_SIZE:
+            yield ''.join(buffer).encode('utf-8')
+            buffer = []
+            size = 0
+    if buffer:
+        yield ''.join(buffer).encode('utf-8')
+
+
+def _json_parts(conn, tree, single):
+    head = _dumps({'version': EXPORT_VERSION, 'exported_at': datetime.now().isoformat()})
+    yield head[:-1] + (',"page":' if single else ',"pages":[')
+    if tree is None:
+        yield 'null}' if single else ']}'
+        return
+    # 開いたまま（"children":[ の途中）のページの深さ
+    open_depths = []
+    need_comma = False
+    for page, depth, blocks in iter_pages_with_blocks(conn, tree):
+        while open_depths and open_depths[-1] >= depth:
+            open_depths.pop()
+            yield ']}'
+            need_comma = True
+        if need_comma:
+            yield ','
+        yield _dumps(page)[:-1] + ',"blocks":[' + ','.join(map(_dumps, blocks)) + '],"children":['
+        open_depths.append(depth)
+        need_comma = False
+    yield ']}' * len(open_depths)
+    yield '}' if single else ']}'
+
+
+def _jsonl_parts(conn, tree):
+    if tree is None:
+        return
+    for page, _, blocks in iter_pages_with_blocks(conn, tree):
+        yield _dumps(page)[:-1] + ',"blocks":[' + ','.join(map(_dumps, blocks)) + ']}\n'
+
+
+def _stream(page_id, write):
+    """接続を開いて読み取りトランザクションの中でツリーを読み、write(conn, tree) の出力をバイト列にまとめて返す
+
+    ストリーム中はリクエストのアプリコンテキストが終わっているので、接続はジェネレータの中で取り直す。
+    """
+    conn = get_db()
+    try:
+        conn.execute('BEGIN')
+        yield from _buffered(write(conn, load_tree(conn.cursor(), page_id)))
+    finally:
+        # 書き終わったら（途中で切断されても）トランザクションを閉じる
+        conn.rollback()
+        conn.close()
+
+
+def stream_json(page_id=None):
+    """{"version", "exported_at", "pages": [...]}（page_id 指定なら "page": {...}）をバイト列で少しずつ返す"""
+    return _stream(page_id, lambda conn, tree: _json_parts(conn, tree, single=page_id is not None))
+
+
+def stream_jsonl(page_id=None):
+    """1行1ページ（parent_id / blocks 付き）の JSON Lines をバイト列で少しずつ返す"""
+    return _stream(page_id, _jsonl_parts)
+
+
+class _ZipSink:
+    """ZipFile の書き込み先。書かれたバイト列を溜めておき、drain() で取り出す
+
+    seek できないので、ZipFile は各エントリのサイズと CRC をデータの後ろ（データディスクリプタ）に書く。
+    """
+
+    def __init__(self):
+        self.parts = []
+
+    def write(self, data):
+        self.parts.append(bytes(data))
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def drain(self):
+        data = b''.join(self.parts)
+        self.parts = []
+        return data
+
+
+def _compress_type(arcname):
+    ext = arcname.rsplit('.', 1)[-1].lower() if '.' in arcname else ''
+    return zipfile.ZIP_STORED if ext in STORED_EXTENSIONS else zipfile.ZIP_DEFLATED
+
+
+def zip_manifest(page_id, upload_folder):
+    """ZIP の目録を作る。ページがなければ None
+
+    戻り値は (ルートのページ, [(アーカイブ内のパス, 中身のバイト列 or None, 添付のパス or None), ...])。
+
+    ページツリーとブロックは読み取りトランザクションの中でそれぞれ1クエリで読む。
+    各ページのディレクトリは「タイトル_[ID]」で、子ページは親のディレクトリの中に入る。
+    page.md はそのページのブロックだけ（子ページはそれぞれのディレクトリの page.md）。
+    page.md は読む人向けで元に戻せないので、インポート用にブロックをそのまま blocks.json にも書く。
+    """
+    conn = get_db()
+    try:
+        conn.execute('BEGIN')
+        tree = load_tree(conn.cursor(), page_id)
+        if tree is None:
+            return None
+        entries = []
+        dirs = {}
+        for page, _, blocks in iter_pages_with_blocks(conn, tree):
+            prefix = f"{dirs[page['parent_id']]}/" if page['parent_id'] in dirs else ''
+            page_dir = dirs[page['id']] = f"{prefix}{page.get('title', '無題')}_[{page['id']}]"
+            markdown = page_to_markdown(dict(page, blocks=blocks, children=[]), level=1)
+            entries.append((f"{page_dir}/page.md", markdown.encode('utf-8'), None))
+            metadata = {
+                'id': page['id'],
+                'title': page.get('title', ''),
+                'icon': page.get('icon', ''),
+                'cover_image': page.get('cover_image', ''),
+                'is_pinned': page.get('is_pinned', 0),
+                'created_at': page.get('created_at', ''),
+                'updated_at': page.get('updated_at', '')
+            }
+            entries.append((f"{page_dir}/metadata.json",
+                            json.dumps(metadata, ensure_ascii=False, indent=2).encode('utf-8'), None))
+            block_rows = [{field: block.get(field) for field in ZIP_BLOCK_FIELDS} for block in blocks]
+            entries.append((f"{page_dir}/blocks.json", _dumps(block_rows).encode('utf-8'), None))
+            seen = set()
+            for block in blocks:
+                file_path = block.get('content') or ''
+                if block.get('type') in ('image', 'file') and file_path.startswith('/uploads/'):
+                    filename = file_path.split('/')[-1]
+                    if filename and filename not in seen:
+                        seen.add(filename)
+                        entries.append((f"{page_dir}/files/{filename}", None, os.path.join(upload_folder, filename)))
+        return tree.roots[0], entries
+    finally:
+        conn.rollback()
+        conn.close()
+
+
+def _read_attachment(path, arcname):
+    """添付を読む（スレッドプールで実行）。(ZipInfo, 中身) を返す。大きいファイルは中身 None、なければ None"""
+    try:
+        zinfo = zipfile.ZipInfo.from_file(path, arcname)
+        if zinfo.file_size > ZIP_INLINE_LIMIT:
+            return zinfo, None
+        with open(path, 'rb') as f:
+            return zinfo, f.read()
+    except FileNotFoundError:
+        return None
+
+
+def _prefetched(pool, entries):
+    """(エントリ, 添付を読む Future or None) を返す。添付は ZIP_PREFETCH 件先まで読み始めておく"""
+    window = deque()
+    for entry in entries:
+        arcname, _, path = entry
+        window.append((entry, pool.submit(_read_attachment, path, arcname) if path else None))
+        if len(window) > ZIP_PREFETCH:
+            yield window.popleft()
+    yield from window
+
+
+def stream_zip(entries):
+    """目録の順に ZIP を書き、書いたそばからバイト列を返す"""
+    sink = _ZipSink()
+    pool = ThreadPoolExecutor(max_workers=ZIP_READ_WORKERS, thread_name_prefix='zip-export')
+    try:
+        with zipfile.ZipFile(sink, 'w', zipfile.ZIP_DEFLATED) as zf:
+            for (arcname, data, path), future in _prefetched(pool, entries):
+                if future is None:
+                    zf.writestr(arcname, data, compress_type=_compress_type(arcname))
+                else:
+                    attachment = future.result()
+                    if attachment is None:
+                        continue
+                    zinfo, data = attachment
+                    zinfo.compress_type = _compress_type(arcname)
+                    if data is not None:
+                        zf.writestr(zinfo, data)
+                    else:
+                        with open(path, 'rb') as src, zf.open(zinfo, 'w') as dest:
+                            while True:
+                                chunk = src.read(ZIP_CHUNK_SIZE)
+                                if not chunk:
+                                    break
+                                dest.write(chunk)
+                                yield sink.drain()
+                yield sink.drain()
+        # 中央ディレクトリ
+        yield sink.drain()
+    finally:
+        pool.shutdown(wait=True, cancel_futures=True)
+
+
+def attachment_headers(headers, filename):
+    """Content-Disposition: attachment を付ける（ASCII 以外のファイル名は RFC 5987 の filename* で送る）"""
+    try:
+        filename.encode('ascii')
+        names = {'filename': filename}
+    except UnicodeEncodeError:
+        simple = unicodedata.normalize('NFKD', filename).encode('ascii', 'ignore').decode('ascii')
+        names = {'filename': simple, 'filename*': f"UTF-8''{quote(filename, safe='!#$&+-.^_`|~')}"}
+    headers.set('Content-Disposition', 'attachment', **names)
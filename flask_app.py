@@ -25,11 +25,14 @@ from database import (
     init_db, get_or_create_inbox, get_or_create_finished, get_user_count, get_user_by_username, create_user,
     get_user_by_id, update_user_password, set_password_reset_token, get_password_reset_token,
     mark_password_reset_token_used, update_user_stripe_customer, update_user_subscription,
-    get_user_by_stripe_customer, ensure_indexes
+    get_user_by_stripe_customer, register_db_teardown
 )
 
 from routes import register_routes
 from backup_scheduler import init_backup_scheduler
+from write_queue import init_write_queue
+from trash_purger import init_trash_purger
+from conditional_get import init_conditional_get
 
 # === パス設定 ===
 BASE_DIR = os.path.dirname(os.path.abspath(__file__))
@@ -82,6 +85,7 @@ if not secret:
     print('Warning: APP_SECRET is not set. Set APP_SECRET for production use.')
     secret = os.urandom(24)
 app.secret_key = secret
+register_db_teardown(app)
 
 if STRIPE_SECRET_KEY:
     stripe.api_key = STRIPE_SECRET_KEY
@@ -89,6 +93,9 @@ if STRIPE_SECRET_KEY:
 # === バックアップスケジューラー初期化 ===
 init_backup_scheduler(app)
 
+# === 書き込みキュー（ブロック/ページ更新をまとめてコミット） ===
+init_write_queue()
+
 # === データベース復元関数（本番環境用） ===
 def _restore_db_from_dump_if_needed():
     """DBが空の場合、SQLダンプから復元"""
@@ -605,6 +612,15 @@ def diagnose_database():
         cursor.execute("SELECT COUNT(*) FROM pages WHERE title = '感謝日記' AND is_deleted = 0")
         result['gratitude_pages'] = cursor.fetchone()[0]
         
+        cursor.execute("""
+            SELECT COUNT(*) AS count, MIN(journal_date) AS first, MAX(journal_date) AS last
+            FROM pages WHERE journal_date IS NOT NULL AND is_deleted = 0
+        """)
+        journal = cursor.fetchone()
+        result['journal_pages'] = journal['count']
+        result['journal_first_date'] = journal['first']
+        result['journal_last_date'] = journal['last']
+        
         cursor.execute("SELECT title, id FROM pages WHERE title LIKE '20%年%月' AND is_deleted = 0 ORDER BY title DESC LIMIT 1")
         latest_month = cursor.fetchone()
         if latest_month:
@@ -648,33 +664,31 @@ def check_meal_structure():
         conn.row_factory = sqlite3.Row
         cursor = conn.cursor()
         
-        # 食事ページを全取得
-        cursor.execute("SELECT id, title, parent_id FROM pages WHERE title = '食事' AND is_deleted = 0")
+        # 食事ページを親ページと一緒に全取得
+        cursor.execute("""
+            SELECT p.id, p.title, p.parent_id, parent.title AS parent_title, parent.journal_date
+            FROM pages p
+            LEFT JOIN pages parent ON parent.id = p.parent_id
+            WHERE p.title = '食事' AND p.is_deleted = 0
+        """)
         meal_pages = cursor.fetchall()
         
         for meal_page in meal_pages:
             page_id = meal_page['id']
-            parent_id = meal_page['parent_id']
             
             page_info = {
                 'id': page_id,
-                'parent_id': parent_id,
-                'title': meal_page['title']
+                'parent_id': meal_page['parent_id'],
+                'title': meal_page['title'],
+                'journal_date': meal_page['journal_date']
             }
             result['meal_pages'].append(page_info)
             
-            # 親ページ情報を取得
-            if parent_id:
-                cursor.execute("SELECT id, title FROM pages WHERE id = ?", (parent_id,))
-                parent = cursor.fetchone()
-                if parent:
-                    parent_title = parent['title']
-                    if parent_title not in result['parent_info']:
-                        result['parent_info'][parent_title] = []
-                    result['parent_info'][parent_title].append(page_id)
+            if meal_page['parent_title'] is not None:
+                result['parent_info'].setdefault(meal_page['parent_title'], []).append(page_id)
         
         # 2月4日ページの確認
-        cursor.execute("SELECT id FROM pages WHERE title = '2026年2月4日'")
+        cursor.execute("SELECT id FROM pages WHERE journal_date = '2026-02-04' AND is_deleted = 0")
         feb4 = cursor.fetchone()
         if feb4:
             result['feb4_page_id'] = feb4['id']
@@ -752,6 +766,9 @@ def check_meal_blocks_detail(page_id):
 # === APIルート登録 ===
 register_routes(app)
 
+# === 条件付き GET（ETag / 304） ===
+init_conditional_get(app)
+
 # === アプリケーション起動 ===
 if __name__ == '__main__':
     # ローカル開発用
@@ -765,7 +782,8 @@ if __name__ == '__main__':
     
     with app.app_context():
         init_db()
-        ensure_indexes()
+    # ゴミ箱の自動削除（deleted_at を埋めるマイグレーションの後で始める）
+    init_trash_purger()
     app.run(port=5000)
 else:
     # PythonAnywhere用のWSGI
@@ -774,7 +792,8 @@ else:
             _restore_db_from_dump_if_needed()
             _restore_meal_blocks_if_needed()
             init_db()
-            ensure_indexes()
+        # ゴミ箱の自動削除（deleted_at を埋めるマイグレーションの後で始める）
+        init_trash_purger()
     except Exception as e:
         print(f"Database initialization error: {e}")
         import traceback
@@ -0,0 +1,257 @@
+# -*- coding: utf-8 -*-
+"""
+一括インポート（POST /api/import/json）
+- アップロードをストリームで読み、pages 配列の要素（JSON Lines なら1行）を1つずつ取り出す
+- ページの新IDを部分木ごとに先に割り当て、ページ・ブロックを executemany でまとめて挿入する
+- 全文検索の索引は import_state の印でブロックごとのトリガーを止め、最後に取り込んだブロックぶんを1文で作る
+- 呼び出し側が1トランザクション（BEGIN IMMEDIATE）で囲む。失敗したらロールバックで全部なかったことになる
+"""
+
+import codecs
+import json
+
+from database import get_next_position, next_row_id
+from ordering import POSITION_STEP
+
+# executemany 1回あたりの行数
+CHUNK_SIZE = 1000
+# アップロードを読む単位（文字数）
+READ_SIZE = 1 << 20
+
+
+class _JsonStream:
+    """ストリームの JSON を先頭から少しずつ読む（読み込み済みの未処理部分だけをメモリに持つ）"""
+
+    def __init__(self, stream):
+        self.reader = codecs.getreader('utf-8-sig')(stream)
+        self.decoder = json.JSONDecoder()
+        self.buffer = ''
+        self.pos = 0
+        self.eof = False
+
+    def _fill(self, size=READ_SIZE):
+        chunk = self.reader.read(size)
+        if not chunk:
+            self.eof = True
+        self.buffer = self.buffer[self.pos:] + chunk
+        self.pos = 0
+
+    def peek(self):
+        """空白を読み飛ばして次の1文字（終端なら ''）"""
+        while True:
+            while self.pos < len(self.buffer) and self.buffer[self.pos] in ' \t\r\n':
+                self.pos += 1
+            if self.pos < len(self.buffer) or self.eof:
+                return self.buffer[self.pos:self.pos + 1]
+            self._fill()
+
+    def expect(self, char):
+        if self.peek() != char:
+            raise ValueError(f"Expected '{char}' at offset {self.pos}")
+        self.pos += 1
+
+    def value(self):
+        """次の JSON の値を1つ読む。途中で切れていれば読み足す（未処理部分の長さぶん読んで倍々に増やす）"""
+        self.peek()
+        while True:
+            try:
+                value, end = self.decoder.raw_decode(self.buffer, self.pos)
+            except json.JSONDecodeError:
+                if self.eof:
+                    raise
+                self._fill(max(READ_SIZE, len(self.buffer) - self.pos))
+                continue
+            # 数値などはバッファの終わりで切れていても読めてしまうので、終端でなければ読み足して確かめる
+            if end == len(self.buffer) and not self.eof:
+                self._fill()
+                continue
+            self.pos = end
+            return value
+
+
+def _iter_json(stream):
+    """{"pages": [...]} / {"page": {...}} / [...] からページを1つずつ返す"""
+    js = _JsonStream(stream)
+    if js.peek() == '[':
+        yield from _iter_array(js)
+        return
+    js.expect('{')
+    if js.peek() == '}':
+        return
+    while True:
+        key = js.value()
+        js.expect(':')
+        if key == 'pages' and js.peek() == '[':
+            yield from _iter_array(js)
+        elif key == 'page':
+            page = js.value()
+            if page:
+                yield page
+        else:
+            js.value()
+        if js.peek() == ',':
+            js.pos += 1
+            continue
+        js.expect('}')
+        return
+
+
+def _iter_array(js):
+    js.expect('[')
+    if js.peek() == ']':
+        js.pos += 1
+        return
+    while True:
+        yield js.value()
+        if js.peek() == ',':
+            js.pos += 1
+            continue
+        js.expect(']')
+        return
+
+
+def _iter_jsonl(stream):
+    """JSON Lines（1行1ページ）。空行は読み飛ばす"""
+    for line in codecs.getreader('utf-8-sig')(stream):
+        line = line.strip()
+        if line:
+            yield json.loads(line)
+
+
+def iter_pages(stream, jsonl=False):
+    """アップロード（バイナリのストリーム）からページの辞書を1つずつ返す。壊れた JSON は ValueError"""
+    return _iter_jsonl(stream) if jsonl else _iter_json(stream)
+
+
+def _block_row(page_id, block):
+    props = block.get('props', '{}')
+    if not isinstance(props, str):
+        props = json.dumps(props, ensure_ascii=False)
+    return (page_id, block.get('type', 'text'), block.get('content', ''), block.get('checked', 0),
+            block.get('position', 1000.0), block.get('collapsed', 0), block.get('details', ''), props)
+
+
+class PageImporter:
+    """ページツリーをまとめて挿入する
+
+    with PageImporter(cursor) as importer:
+        for page in iter_pages(stream):
+            importer.add(page)
+
+    呼び出し側が BEGIN IMMEDIATE 済みであること（ID をまとめて割り当てるため）。
+    with を抜ける時に残りを書き込み、取り込み中の印を下ろして索引を作る。
+    失敗した時は何もしない（呼び出し側のロールバックで印も戻る）。
+    """
+
+    def __init__(self, cursor, parent_id=None, chunk_size=CHUNK_SIZE, on_progress=None):
+        self.cursor = cursor
+        self.parent_id = parent_id
+        self.chunk_size = chunk_size
+        self.on_progress = on_progress
+        self.root_ids = []
+        self.page_count = 0
+        self.block_count = 0
+        # 元のページID → 新ID（JSON Lines の parent_id を付け替える）
+        self.id_map = {}
+        self._pages = []
+        self._blocks = []
+        self._positions = {}
+        self._live_parents = {}
+        self._next_id = None
+        self._first_block_id = None
+
+    def __enter__(self):
+        self._next_id = next_row_id(self.cursor, 'pages')
+        self._first_block_id = next_row_id(self.cursor, 'blocks')
+        # ブロックごとの索引（blocks_ai）を止める。この接続のトランザクションの中だけで見える
+        self.cursor.execute('UPDATE import_state SET deferring = 1 WHERE id = 1')
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is not None:
+            return False
+        self.flush()
+        self.cursor.execute('UPDATE import_state SET deferring = 0 WHERE id = 1')
+        # 取り込んだブロックぶんだけ索引を作る（search_source は blocks ⋈ pages のビュー）
+        self.cursor.execute('''
+            INSERT INTO search_fts(rowid, title, content, details)
+            SELECT id, title, content, details FROM search_source WHERE id >= ?
+        ''', (self._first_block_id,))
+        return False
+
+    def _root_parent(self, page_dict):
+        """ルートの親。指定がなければ元の親（このDBにあって削除されていない場合だけ）"""
+        if self.parent_id is not None:
+            return self.parent_id
+        parent_id = page_dict.get('parent_id')
+        if parent_id in self.id_map:
+            return self.id_map[parent_id]
+        if not isinstance(parent_id, int):
+            return None
+        if parent_id not in self._live_parents:
+            self.cursor.execute('SELECT 1 FROM pages WHERE id = ? AND is_deleted = 0', (parent_id,))
+            self._live_parents[parent_id] = self.cursor.fetchone() is not None
+        return parent_id if self._live_parents[parent_id] else None
+
+    def _root_position(self, parent_id, page_dict, is_root):
+        if not is_root and page_dict.get('position') is not None:
+            # JSON Lines の子ページは元の並び順のまま
+            return page_dict['position']
+        if parent_id not in self._positions:
+            self._positions[parent_id] = get_next_position(self.cursor, parent_id)
+        position = self._positions[parent_id]
+        self._positions[parent_id] += POSITION_STEP
+        return position
+
+    def add(self, page_dict):
+        """ページ（children を含む部分木）を追加して新しいIDを返す"""
+        if not isinstance(page_dict, dict):
+            raise ValueError('Each page must be an object')
+        # JSON Lines で親も取り込み済みなら、その子として追加する（ルートには数えない）
+        is_root = self.parent_id is not None or page_dict.get('parent_id') not in self.id_map
+        parent_id = self._root_parent(page_dict)
+        stack = [(page_dict, parent_id, self._root_position(parent_id, page_dict, is_root))]
+        root_id = None
+        # 親が子より先に並ぶように、取り出した順に ID を振って行を積む
+        while stack:
+            page, parent, position = stack.pop()
+            page_id = self._next_id
+            self._next_id += 1
+            if root_id is None:
+                root_id = page_id
+            if page.get('id') is not None:
+                self.id_map[page['id']] = page_id
+            self._pages.append((
+                page_id, page.get('title', ''), page.get('icon', '📄'), page.get('cover_image', ''),
+                parent, position, page.get('is_pinned', 0)
+            ))
+            self._blocks.extend(_block_row(page_id, block) for block in page.get('blocks') or [])
+            children = page.get('children') or []
+            for i in range(len(children) - 1, -1, -1):
+                stack.append((children[i], page_id, (i + 1) * 1000.0))
+            if len(self._pages) >= self.chunk_size or len(self._blocks) >= self.chunk_size * 4:
+                self.flush()
+        if is_root:
+            self.root_ids.append(root_id)
+        return root_id
+
+    def flush(self):
+        """積んである行を書き込む（ページ → ブロックの順）"""
+        if self._pages:
+            self.cursor.executemany(
+                'INSERT INTO pages (id, title, icon, cover_image, parent_id, position, is_pinned, is_deleted) '
+                'VALUES (?, ?, ?, ?, ?, ?, ?, 0)',
+                self._pages
+            )
+            self.page_count += len(self._pages)
+            self._pages = []
+        if self._blocks:
+            self.cursor.executemany(
+                'INSERT INTO blocks (page_id, type, content, checked, position, collapsed, details, props) '
+                'VALUES (?, ?, ?, ?, ?, ?, ?, ?)',
+                self._blocks
+            )
+            self.block_count += len(self._blocks)
+            self._blocks = []
+        if self.on_progress:
+            self.on_progress(self.page_count, self.block_count)
@@ -0,0 +1,742 @@
+# -*- coding: utf-8 -*-
+"""
+スキーママイグレーション
+- PRAGMA user_version でスキーマのバージョンを管理
+- 各ステップは順序付き・冪等（既存DBに再適用しても壊れない）
+- 最新なら PRAGMA を1回読むだけで終了する
+
+使い方:
+    python migrations.py            # 適用状況を表示
+    python migrations.py migrate    # 未適用のマイグレーションを適用
+"""
+import argparse
+import datetime
+import json
+import re
+import sys
+
+from database import get_db
+
+# (version, 説明, 関数) のリスト。version は 1 から連番で追加していく
+MIGRATIONS = []
+
+
+def migration(version, description):
+    """マイグレーションステップを登録するデコレーター"""
+    def decorator(func):
+        if MIGRATIONS and MIGRATIONS[-1][0] != version - 1:
+            raise ValueError(f'Migration versions must be sequential: {version}')
+        MIGRATIONS.append((version, description, func))
+        return func
+    return decorator
+
+
+def latest_version():
+    return MIGRATIONS[-1][0] if MIGRATIONS else 0
+
+
+def _columns(cursor, table):
+    cursor.execute(f'PRAGMA table_info({table})')
+    return {row[1]: row for row in cursor.fetchall()}
+
+
+def _add_column_if_missing(cursor, table, column, ddl):
+    if column not in _columns(cursor, table):
+        cursor.execute(f'ALTER TABLE {table} ADD COLUMN {column} {ddl}')
+
+
+# === マイグレーション定義 ===
+
+@migration(1, 'ベーススキーマ（pages / blocks / templates / users / トークン類）')
+def _m001_base_schema(cursor):
+    cursor.execute('''
+    CREATE TABLE IF NOT EXISTS pages (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        title TEXT DEFAULT '',
+        icon TEXT DEFAULT '📄',
+        cover_image TEXT DEFAULT '',
+        parent_id INTEGER,
+        position REAL DEFAULT 0.0,
+        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+        updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+        is_pinned BOOLEAN DEFAULT 0,
+        is_deleted BOOLEAN DEFAULT 0,
+        mood INTEGER DEFAULT 0,
+        gratitude_text TEXT DEFAULT '',
+        FOREIGN KEY (parent_id) REFERENCES pages(id) ON DELETE CASCADE
+    )
+    ''')
+
+    # 古いDB向け: 後から追加されたカラム
+    _add_column_if_missing(cursor, 'pages', 'cover_image', "TEXT DEFAULT ''")
+    _add_column_if_missing(cursor, 'pages', 'is_pinned', 'BOOLEAN DEFAULT 0')
+    _add_column_if_missing(cursor, 'pages', 'is_deleted', 'BOOLEAN DEFAULT 0')
+    _add_column_if_missing(cursor, 'pages', 'mood', 'INTEGER DEFAULT 0')
+    _add_column_if_missing(cursor, 'pages', 'gratitude_text', "TEXT DEFAULT ''")
+
+    # position が INTEGER だった頃のDBは REAL (1000刻み) に変換
+    columns = _columns(cursor, 'pages')
+    if 'position_new' not in columns and columns['position'][2].upper() != 'REAL':
+        cursor.execute("ALTER TABLE pages ADD COLUMN position_new REAL DEFAULT 0.0")
+        cursor.execute("UPDATE pages SET position_new = CAST(position AS REAL) * 1000.0")
+        cursor.execute("DROP INDEX IF EXISTS idx_pages_parent_position")
+        cursor.execute("ALTER TABLE pages DROP COLUMN position")
+        cursor.execute("ALTER TABLE pages RENAME COLUMN position_new TO position")
+
+    cursor.execute('''
+    CREATE TABLE IF NOT EXISTS blocks (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        page_id INTEGER NOT NULL,
+        type TEXT DEFAULT 'text',
+        content TEXT DEFAULT '',
+        checked BOOLEAN DEFAULT 0,
+        position REAL DEFAULT 0.0,
+        collapsed BOOLEAN DEFAULT 0,
+        details TEXT DEFAULT '',
+        props TEXT DEFAULT '{}',
+        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+        updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+        FOREIGN KEY (page_id) REFERENCES pages(id) ON DELETE CASCADE
+    )
+    ''')
+    _add_column_if_missing(cursor, 'blocks', 'collapsed', 'BOOLEAN DEFAULT 0')
+    _add_column_if_missing(cursor, 'blocks', 'details', "TEXT DEFAULT ''")
+    _add_column_if_missing(cursor, 'blocks', 'props', "TEXT DEFAULT '{}'")
+
+    # テンプレート用テーブル
+    cursor.execute('''
+    CREATE TABLE IF NOT EXISTS templates (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        name TEXT NOT NULL,
+        icon TEXT DEFAULT '📋',
+        description TEXT DEFAULT '',
+        content_json TEXT NOT NULL,
+        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+        updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+    )
+    ''')
+
+    # ユーザー認証用テーブル
+    cursor.execute('''
+    CREATE TABLE IF NOT EXISTS users (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        username TEXT NOT NULL UNIQUE,
+        password_hash TEXT NOT NULL,
+        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+        stripe_customer_id TEXT,
+        subscription_status TEXT DEFAULT 'inactive',
+        subscription_ends_at TIMESTAMP
+    )
+    ''')
+    _add_column_if_missing(cursor, 'users', 'stripe_customer_id', 'TEXT')
+    _add_column_if_missing(cursor, 'users', 'subscription_status', "TEXT DEFAULT 'inactive'")
+    _add_column_if_missing(cursor, 'users', 'subscription_ends_at', 'TIMESTAMP')
+
+    # パスワード再設定トークン
+    cursor.execute('''
+    CREATE TABLE IF NOT EXISTS password_reset_tokens (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        user_id INTEGER NOT NULL,
+        token TEXT NOT NULL UNIQUE,
+        expires_at TIMESTAMP NOT NULL,
+        used BOOLEAN DEFAULT 0,
+        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+        FOREIGN KEY (user_id) REFERENCES users(id) ON DELETE CASCADE
+    )
+    ''')
+
+    # HealthPlanetトークン
+    cursor.execute('''
+    CREATE TABLE IF NOT EXISTS healthplanet_tokens (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        access_token TEXT NOT NULL,
+        refresh_token TEXT,
+        expires_at TIMESTAMP,
+        scope TEXT,
+        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+        updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+    )
+    ''')
+
+
+@migration(2, '全文検索 (blocks_fts) とトリガー')
+def _m002_blocks_fts(cursor):
+    cursor.execute('CREATE VIRTUAL TABLE IF NOT EXISTS blocks_fts USING fts5(title, content, content=blocks, content_rowid=id)')
+    cursor.execute('CREATE TRIGGER IF NOT EXISTS blocks_ai AFTER INSERT ON blocks BEGIN INSERT INTO blocks_fts(rowid, title, content) VALUES (new.id, (SELECT title FROM pages WHERE id = new.page_id), new.content); END;')
+    cursor.execute('CREATE TRIGGER IF NOT EXISTS blocks_ad AFTER DELETE ON blocks BEGIN INSERT INTO blocks_fts(blocks_fts, rowid, title, content) VALUES("delete", old.id, (SELECT title FROM pages WHERE id = old.page_id), old.content); END;')
+    cursor.execute('CREATE TRIGGER IF NOT EXISTS blocks_au AFTER UPDATE ON blocks BEGIN INSERT INTO blocks_fts(blocks_fts, rowid, title, content) VALUES("delete", old.id, (SELECT title FROM pages WHERE id = old.page_id), old.content); INSERT INTO blocks_fts(rowid, title, content) VALUES (new.id, (SELECT title FROM pages WHERE id = new.page_id), new.content); END;')
+
+
+@migration(3, 'パフォーマンス改善用インデックス')
+def _m003_indexes(cursor):
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_pages_parent_position ON pages(parent_id, position, is_deleted)')
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_pages_is_deleted ON pages(is_deleted)')
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_blocks_page_position ON blocks(page_id, position)')
+
+
+@migration(4, 'デフォルトテンプレート（感謝日記 / PDCA日報 / 5行日記）')
+def _m004_default_templates(cursor):
+    cursor.execute('SELECT COUNT(*) FROM templates')
+    if cursor.fetchone()[0] > 0:
+        return
+
+    # 感謝日記テンプレート
+    gratitude_template = {
+        'title': '感謝日記',
+        'blocks': [
+            {'type': 'h1', 'content': '感謝日記', 'position': 1000},
+            {'type': 'text', 'content': '今日感謝したことを3つ書きましょう。', 'position': 2000},
+            {'type': 'text', 'content': '1. ', 'position': 3000},
+            {'type': 'text', 'content': '2. ', 'position': 4000},
+            {'type': 'text', 'content': '3. ', 'position': 5000},
+        ]
+    }
+
+    # PDCA日報テンプレート
+    pdca_template = {
+        'title': 'PDCA日報',
+        'blocks': [
+            {'type': 'h1', 'content': 'PDCA日報', 'position': 1000},
+            {'type': 'h2', 'content': '計画（Plan）', 'position': 2000},
+            {'type': 'text', 'content': '', 'position': 3000},
+            {'type': 'h2', 'content': '実行（Do）', 'position': 4000},
+            {'type': 'text', 'content': '', 'position': 5000},
+            {'type': 'h2', 'content': '確認（Check）', 'position': 6000},
+            {'type': 'text', 'content': '', 'position': 7000},
+            {'type': 'h2', 'content': '改善（Act）', 'position': 8000},
+            {'type': 'text', 'content': '', 'position': 9000},
+        ]
+    }
+
+    # 5行日記テンプレート
+    five_line_template = {
+        'title': '5行日記',
+        'blocks': [
+            {'type': 'h1', 'content': '5行日記', 'position': 1000},
+            {'type': 'text', 'content': '1. 今日起きたこと：', 'position': 2000},
+            {'type': 'text', 'content': '2. その時の気持ち：', 'position': 3000},
+            {'type': 'text', 'content': '3. その出来事の意味：', 'position': 4000},
+            {'type': 'text', 'content': '4. その経験から学んだこと：', 'position': 5000},
+            {'type': 'text', 'content': '5. 明日への決意：', 'position': 6000},
+        ]
+    }
+
+    templates_data = [
+        ('感謝日記', '🙏', '毎日の感謝を記録するテンプレート', gratitude_template),
+        ('PDCA日報', '📊', 'Plan-Do-Check-Actフレームワーク', pdca_template),
+        ('5行日記', '📖', '1日の出来事を5行で整理するテンプレート', five_line_template),
+    ]
+    cursor.executemany(
+        'INSERT INTO templates (name, icon, description, content_json) VALUES (?, ?, ?, ?)',
+        [(name, icon, desc, json.dumps(content, ensure_ascii=False)) for name, icon, desc, content in templates_data]
+    )
+
+
+@migration(5, 'ページ階層のクロージャテーブル (page_closure) とトリガー')
+def _m005_page_closure(cursor):
+    # (祖先, 子孫, 深さ) を全組み合わせで保持し、部分木・祖先・深さを1クエリで引けるようにする
+    cursor.execute('''
+    CREATE TABLE IF NOT EXISTS page_closure (
+        ancestor_id INTEGER NOT NULL,
+        descendant_id INTEGER NOT NULL,
+        depth INTEGER NOT NULL,
+        PRIMARY KEY (ancestor_id, descendant_id)
+    ) WITHOUT ROWID
+    ''')
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_page_closure_descendant ON page_closure(descendant_id, depth)')
+
+    cursor.execute('''
+    CREATE TRIGGER IF NOT EXISTS pages_closure_ai AFTER INSERT ON pages BEGIN
+        INSERT INTO page_closure (ancestor_id, descendant_id, depth) VALUES (new.id, new.id, 0);
+        INSERT INTO page_closure (ancestor_id, descendant_id, depth)
+            SELECT ancestor_id, new.id, depth + 1 FROM page_closure WHERE descendant_id = new.parent_id;
+    END;
+    ''')
+    # 親の付け替え: 旧祖先→部分木のリンクを消し、新しい親の祖先×部分木を張り直す
+    # 自分の子孫の下へ移動しようとすると主キー衝突でエラーになる（循環の防止）
+    cursor.execute('''
+    CREATE TRIGGER IF NOT EXISTS pages_closure_au AFTER UPDATE OF parent_id ON pages
+    WHEN old.parent_id IS NOT new.parent_id BEGIN
+        DELETE FROM page_closure
+        WHERE descendant_id IN (SELECT descendant_id FROM page_closure WHERE ancestor_id = new.id)
+          AND ancestor_id IN (SELECT ancestor_id FROM page_closure WHERE descendant_id = new.id AND depth > 0);
+        INSERT INTO page_closure (ancestor_id, descendant_id, depth)
+            SELECT a.ancestor_id, d.descendant_id, a.depth + d.depth + 1
+            FROM page_closure a, page_closure d
+            WHERE a.descendant_id = new.parent_id AND d.ancestor_id = new.id;
+    END;
+    ''')
+    cursor.execute('''
+    CREATE TRIGGER IF NOT EXISTS pages_closure_ad AFTER DELETE ON pages BEGIN
+        DELETE FROM page_closure WHERE descendant_id = old.id;
+        DELETE FROM page_closure WHERE ancestor_id = old.id;
+    END;
+    ''')
+
+    # 既存ページから再構築（壊れたデータで循環していても止まるよう深さを制限）
+    cursor.execute('DELETE FROM page_closure')
+    cursor.execute('''
+    WITH RECURSIVE tree(ancestor_id, descendant_id, depth) AS (
+        SELECT id, id, 0 FROM pages
+        UNION ALL
+        SELECT tree.ancestor_id, pages.id, tree.depth + 1
+        FROM tree JOIN pages ON pages.parent_id = tree.descendant_id
+        WHERE tree.depth < 64
+    )
+    INSERT OR IGNORE INTO page_closure (ancestor_id, descendant_id, depth)
+    SELECT ancestor_id, descendant_id, depth FROM tree
+    ''')
+
+
+@migration(6, '日付ページのキー (pages.journal_date) と一意インデックス')
+def _m006_journal_date(cursor):
+    # 'YYYY-MM-DD'。日付ページ以外は NULL
+    _add_column_if_missing(cursor, 'pages', 'journal_date', 'TEXT')
+
+    # 既存の「YYYY年M月D日」タイトルから埋める。同じ日付が複数あれば id の小さい方を採用
+    # （従来の WHERE title = ? LIMIT 1 が返していたページ）
+    title_re = re.compile(r'^(\d{4})年(\d{1,2})月(\d{1,2})日$')
+    cursor.execute("SELECT id, title FROM pages WHERE is_deleted = 0 AND journal_date IS NULL AND title LIKE '%年%月%日' ORDER BY id")
+    claimed = {}
+    for row in cursor.fetchall():
+        m = title_re.match(row[1] or '')
+        if not m:
+            continue
+        year, month, day = map(int, m.groups())
+        try:
+            key = datetime.date(year, month, day).isoformat()
+        except ValueError:
+            continue
+        claimed.setdefault(key, row[0])
+    cursor.execute('SELECT journal_date FROM pages WHERE journal_date IS NOT NULL AND is_deleted = 0')
+    for row in cursor.fetchall():
+        claimed.pop(row[0], None)
+    cursor.executemany('UPDATE pages SET journal_date = ? WHERE id = ?', [(k, v) for k, v in claimed.items()])
+
+    # ゴミ箱のページは対象外（同じ日付を作り直せるように）
+    cursor.execute('''
+    CREATE UNIQUE INDEX IF NOT EXISTS idx_pages_journal_date
+    ON pages(journal_date) WHERE journal_date IS NOT NULL AND is_deleted = 0
+    ''')
+
+
+@migration(7, '全文検索トリガーを本文/タイトルの変更時だけに限定')
+def _m007_conditional_fts_triggers(cursor):
+    # チェック・並べ替え・props の自動保存では blocks_fts を触らない
+    cursor.execute('DROP TRIGGER IF EXISTS blocks_au')
+    cursor.execute('''
+    CREATE TRIGGER blocks_au AFTER UPDATE OF content, page_id ON blocks
+    WHEN old.content IS NOT new.content OR old.page_id IS NOT new.page_id BEGIN
+        INSERT INTO blocks_fts(blocks_fts, rowid, title, content)
+            VALUES ('delete', old.id, (SELECT title FROM pages WHERE id = old.page_id), old.content);
+        INSERT INTO blocks_fts(rowid, title, content)
+            VALUES (new.id, (SELECT title FROM pages WHERE id = new.page_id), new.content);
+    END;
+    ''')
+    # ページ名の変更時だけ、そのページのブロックに複製しているタイトルを入れ替える
+    cursor.execute('''
+    CREATE TRIGGER IF NOT EXISTS pages_fts_title_au AFTER UPDATE OF title ON pages
+    WHEN old.title IS NOT new.title BEGIN
+        INSERT INTO blocks_fts(blocks_fts, rowid, title, content)
+            SELECT 'delete', id, old.title, content FROM blocks WHERE page_id = new.id;
+        INSERT INTO blocks_fts(rowid, title, content)
+            SELECT id, new.title, content FROM blocks WHERE page_id = new.id;
+    END;
+    ''')
+
+    # これまでページ名の変更が反映されていなかったので作り直す
+    # （blocks に title 列がないため 'rebuild' は使えない）
+    cursor.execute("INSERT INTO blocks_fts(blocks_fts) VALUES ('delete-all')")
+    cursor.execute('''
+    INSERT INTO blocks_fts(rowid, title, content)
+    SELECT blocks.id, pages.title, blocks.content FROM blocks LEFT JOIN pages ON pages.id = blocks.page_id
+    ''')
+
+
+@migration(8, '日本語対応の全文検索 (search_fts: trigram) に置き換え')
+def _m008_search_fts(cursor):
+    # 旧 blocks_fts（unicode61 は日本語を分かち書きしない）と関連トリガーを廃止
+    for trigger in ('blocks_ai', 'blocks_ad', 'blocks_au', 'pages_fts_title_au'):
+        cursor.execute(f'DROP TRIGGER IF EXISTS {trigger}')
+    cursor.execute('DROP TABLE IF EXISTS blocks_fts')
+
+    # 索引する値の末尾に番兵 char(1) を2文字付ける。1〜2文字の語（日記・食事など）が
+    # 値の末尾にあっても必ずどれかのトライグラムの先頭になり、語彙表から引けるようにするため
+    cursor.execute('''
+    CREATE VIEW IF NOT EXISTS search_source AS
+    SELECT blocks.id AS id,
+           COALESCE(pages.title, '') || char(1, 1) AS title,
+           COALESCE(blocks.content, '') || char(1, 1) AS content,
+           COALESCE(blocks.details, '') || char(1, 1) AS details
+    FROM blocks LEFT JOIN pages ON pages.id = blocks.page_id
+    ''')
+    cursor.execute('''
+    CREATE VIRTUAL TABLE IF NOT EXISTS search_fts USING fts5(
+        title, content, details,
+        content = 'search_source', content_rowid = 'id', tokenize = 'trigram'
+    )
+    ''')
+    cursor.execute("CREATE VIRTUAL TABLE IF NOT EXISTS search_fts_vocab USING fts5vocab(search_fts, 'row')")
+    # bm25 の列の重み: タイトル > 本文 > 詳細
+    cursor.execute("INSERT INTO search_fts(search_fts, rank) VALUES ('rank', 'bm25(4.0, 2.0, 1.0)')")
+
+    values = '''
+            COALESCE((SELECT title FROM pages WHERE id = {row}.page_id), '') || char(1, 1),
+            COALESCE({row}.content, '') || char(1, 1),
+            COALESCE({row}.details, '') || char(1, 1)'''
+    cursor.execute(f'''
+    CREATE TRIGGER blocks_ai AFTER INSERT ON blocks BEGIN
+        INSERT INTO search_fts(rowid, title, content, details) VALUES (new.id, {values.format(row='new')});
+    END;
+    ''')
+    cursor.execute(f'''
+    CREATE TRIGGER blocks_ad AFTER DELETE ON blocks BEGIN
+        INSERT INTO search_fts(search_fts, rowid, title, content, details) VALUES ('delete', old.id, {values.format(row='old')});
+    END;
+    ''')
+    cursor.execute(f'''
+    CREATE TRIGGER blocks_au AFTER UPDATE OF content, details, page_id ON blocks
+    WHEN old.content IS NOT new.content OR old.details IS NOT new.details OR old.page_id IS NOT new.page_id BEGIN
+        INSERT INTO search_fts(search_fts, rowid, title, content, details) VALUES ('delete', old.id, {values.format(row='old')});
+        INSERT INTO search_fts(rowid, title, content, details) VALUES (new.id, {values.format(row='new')});
+    END;
+    ''')
+    cursor.execute('''
+    CREATE TRIGGER pages_fts_title_au AFTER UPDATE OF title ON pages
+    WHEN old.title IS NOT new.title BEGIN
+        INSERT INTO search_fts(search_fts, rowid, title, content, details)
+            SELECT 'delete', id, COALESCE(old.title, '') || char(1, 1), COALESCE(content, '') || char(1, 1),
+                   COALESCE(details, '') || char(1, 1)
+            FROM blocks WHERE page_id = new.id;
+        INSERT INTO search_fts(rowid, title, content, details)
+            SELECT id, COALESCE(new.title, '') || char(1, 1), COALESCE(content, '') || char(1, 1),
+                   COALESCE(details, '') || char(1, 1)
+            FROM blocks WHERE page_id = new.id;
+    END;
+    ''')
+    cursor.execute("INSERT INTO search_fts(search_fts) VALUES ('rebuild')")
+
+
+@migration(9, '（欠番: 条件付き GET の変更カウンターは 10 の change_log に統合）')
+def _m009_reserved(cursor):
+    # 番号だけ残す（適用済みの user_version を変えないため）
+    pass
+
+
+@migration(10, '変更ログ (change_log) と差分同期・条件付き GET のバージョン')
+def _m010_change_log(cursor):
+    # 1行（テーブル, ID）につき最新の変更だけを残す。REPLACE で古い行を消して新しい seq を振るので、
+    # seq > カーソル を順に読めば、その後に変わった行が1回ずつ（upsert か削除の墓標で）得られる
+    cursor.execute('''
+    CREATE TABLE IF NOT EXISTS change_log (
+        seq INTEGER PRIMARY KEY AUTOINCREMENT,
+        table_name TEXT NOT NULL,
+        row_id INTEGER NOT NULL,
+        deleted INTEGER NOT NULL DEFAULT 0,
+        changed_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+        UNIQUE (table_name, row_id)
+    )
+    ''')
+    # テーブルごとの最新 seq（ETag）を1回のシークで引く
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_change_log_table_seq ON change_log(table_name, seq)')
+
+    # 条件付き GET（ETag）のバージョンもテーブルごとの最新 seq を使う（1行の変更で2回書かない）
+    for table in ('pages', 'blocks', 'templates'):
+        for event, row, deleted in (('INSERT', 'new', 0), ('UPDATE', 'new', 0), ('DELETE', 'old', 1)):
+            cursor.execute(f'''
+            CREATE TRIGGER IF NOT EXISTS {table}_change_{event.lower()} AFTER {event} ON {table} BEGIN
+                INSERT OR REPLACE INTO change_log (table_name, row_id, deleted)
+                VALUES ('{table}', {row}.id, {deleted});
+            END;
+            ''')
+        # 既存の行を最初の upsert として記録（seq 0 からの同期で全件が得られる）
+        cursor.execute(f'''
+        INSERT OR IGNORE INTO change_log (table_name, row_id, deleted)
+        SELECT '{table}', id, 0 FROM {table} ORDER BY id
+        ''')
+
+
+@migration(11, 'ゴミ箱に入れた時刻 (pages.deleted_at)')
+def _m011_deleted_at(cursor):
+    _add_column_if_missing(cursor, 'pages', 'deleted_at', 'TIMESTAMP')
+    # 既存のゴミ箱の中身はいつ入れたか分からない（updated_at は最後の編集時刻）。
+    # マイグレーションの時刻から数えて、保存期間をまるごと残す
+    cursor.execute('UPDATE pages SET deleted_at = CURRENT_TIMESTAMP WHERE is_deleted = 1 AND deleted_at IS NULL')
+    # 保存期間を過ぎたページを古い順に引く（ゴミ箱の自動削除）
+    cursor.execute(
+        'CREATE INDEX IF NOT EXISTS idx_pages_deleted_at ON pages(deleted_at) WHERE is_deleted = 1'
+    )
+
+
+@migration(12, 'インデックスの見直し（削除されていないページの部分インデックスなど）')
+def _m012_live_indexes(cursor):
+    # ほぼ全てのクエリが is_deleted = 0 で絞るので、生きているページだけの部分インデックスを持つ
+    cursor.execute(
+        'CREATE INDEX IF NOT EXISTS idx_pages_live_parent_position ON pages(parent_id, position) WHERE is_deleted = 0'
+    )
+    # カテゴリーページ（食事・筋トレなど）をタイトルで引く
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_pages_live_title ON pages(title) WHERE is_deleted = 0')
+    # 今日のハイライト（ページ内で今日作られたブロック）
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_blocks_page_created ON blocks(page_id, created_at)')
+    # ゴミ箱・最近の更新の一覧
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_pages_updated_at ON pages(updated_at)')
+    # 値が 0/1 しかなく選択性が低い。部分インデックスで置き換える
+    # （idx_pages_parent_position は削除済みも含む兄弟の position 計算で使うので残す）
+    cursor.execute('DROP INDEX IF EXISTS idx_pages_is_deleted')
+
+
+@migration(13, 'システムページの登録表 (system_pages)')
+def _m013_system_pages(cursor):
+    # あとで調べる・知識の宝庫・読了をタイトルではなく role → page_id で引く
+    cursor.execute("""
+    CREATE TABLE IF NOT EXISTS system_pages (
+        role TEXT PRIMARY KEY,
+        page_id INTEGER NOT NULL
+    )
+    """)
+    # 既存のページを登録（これまでタイトル検索で見つかっていたページ）
+    for role, title in (('inbox', '🔖 あとで調べる'), ('knowledge', '📚 知識の宝庫'), ('finished', '📚 読了')):
+        cursor.execute("""
+        INSERT OR IGNORE INTO system_pages (role, page_id)
+        SELECT ?, MIN(id) FROM pages WHERE title = ? AND parent_id IS NULL AND is_deleted = 0
+        HAVING MIN(id) IS NOT NULL
+        """, (role, title))
+    for role, title in (('finished_books', '読了した本'), ('finished_thoughts', '日々の感想')):
+        cursor.execute("""
+        INSERT OR IGNORE INTO system_pages (role, page_id)
+        SELECT ?, MIN(id) FROM pages
+        WHERE title = ? AND is_deleted = 0
+          AND parent_id = (SELECT page_id FROM system_pages WHERE role = 'finished')
+        HAVING MIN(id) IS NOT NULL
+        """, (role, title))
+
+
+@migration(14, 'ブロックの更新日時インデックス（最近の更新）')
+def _m014_blocks_updated_at(cursor):
+    # GET /api/activity でブロックを更新の新しい順に読む
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_blocks_updated_at ON blocks(updated_at)')
+
+
+@migration(15, '読書の進捗 (book_progress): 本ブロックの props を日付・本のタイトルで引けるようにする')
+def _m015_book_progress(cursor):
+    # type = 'book' のブロック1つにつき1行。props（JSON）の title / currentPage と、
+    # ページ（または親の日付ページ）の journal_date をトリガーで写しておく
+    cursor.execute('''
+    CREATE TABLE IF NOT EXISTS book_progress (
+        block_id INTEGER PRIMARY KEY,
+        page_id INTEGER NOT NULL,
+        book_title TEXT NOT NULL,
+        journal_date TEXT,
+        current_page INTEGER,
+        FOREIGN KEY (block_id) REFERENCES blocks(id) ON DELETE CASCADE
+    )
+    ''')
+    # 本ごとの日付順（前日の値・履歴）
+    cursor.execute(
+        'CREATE INDEX IF NOT EXISTS idx_book_progress_title_date ON book_progress(book_title, journal_date)'
+    )
+    # ページの日付が変わった時の付け替え
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_book_progress_page ON book_progress(page_id)')
+
+    # props が JSON でない・タイトルがないブロックは写さない（ブロックの書き込みは失敗させない）
+    project = '''
+        INSERT OR REPLACE INTO book_progress (block_id, page_id, book_title, journal_date, current_page)
+        SELECT {row}.id, {row}.page_id, TRIM(json_extract({row}.props, '$.title')),
+               (SELECT COALESCE(p.journal_date, parent.journal_date)
+                FROM pages p LEFT JOIN pages parent ON parent.id = p.parent_id
+                WHERE p.id = {row}.page_id),
+               CASE WHEN json_type({row}.props, '$.currentPage') IN ('integer', 'real')
+                    THEN CAST(json_extract({row}.props, '$.currentPage') AS INTEGER) END
+        {source}
+        WHERE {row}.type = 'book' AND json_valid({row}.props)
+          AND json_type({row}.props, '$.title') = 'text'
+          AND TRIM(json_extract({row}.props, '$.title')) != ''
+    '''
+    cursor.execute(f'''
+    CREATE TRIGGER IF NOT EXISTS blocks_book_ai AFTER INSERT ON blocks WHEN new.type = 'book' BEGIN
+        {project.format(row='new', source='')};
+    END;
+    ''')
+    cursor.execute(f'''
+    CREATE TRIGGER IF NOT EXISTS blocks_book_au AFTER UPDATE OF type, props, page_id ON blocks
+    WHEN old.type = 'book' OR new.type = 'book' BEGIN
+        DELETE FROM book_progress WHERE block_id = old.id;
+        {project.format(row='new', source='')};
+    END;
+    ''')
+    cursor.execute('''
+    CREATE TRIGGER IF NOT EXISTS blocks_book_ad AFTER DELETE ON blocks WHEN old.type = 'book' BEGIN
+        DELETE FROM book_progress WHERE block_id = old.id;
+    END;
+    ''')
+    # 日付ページの日付が変わる・読書メモのページが別の日へ移る
+    cursor.execute('''
+    CREATE TRIGGER IF NOT EXISTS pages_book_au AFTER UPDATE OF journal_date, parent_id ON pages BEGIN
+        UPDATE book_progress SET journal_date = (
+            SELECT COALESCE(p.journal_date, parent.journal_date)
+            FROM pages p LEFT JOIN pages parent ON parent.id = p.parent_id
+            WHERE p.id = book_progress.page_id
+        )
+        WHERE page_id = new.id OR page_id IN (SELECT id FROM pages WHERE parent_id = new.id);
+    END;
+    ''')
+    cursor.execute(project.format(row='blocks', source='FROM blocks'))
+
+
+@migration(16, '更新日時インデックスを生きているページ・ゴミ箱の部分インデックスに分ける')
+def _m016_split_updated_at(cursor):
+    # updated_at 順の一覧は必ず is_deleted で絞る。全ページのインデックスだと、ゴミ箱の一覧は
+    # 生きているページまで、最近の更新はゴミ箱のページまで読み飛ばすことになる
+    cursor.execute(
+        'CREATE INDEX IF NOT EXISTS idx_pages_live_updated ON pages(updated_at) WHERE is_deleted = 0'
+    )
+    cursor.execute(
+        'CREATE INDEX IF NOT EXISTS idx_pages_trash_updated ON pages(updated_at) WHERE is_deleted = 1'
+    )
+    # 各ページはどちらか一方にだけ入るので、書き込みのコストは変わらない
+    cursor.execute('DROP INDEX IF EXISTS idx_pages_updated_at')
+
+
+@migration(17, '短い語の出現表 (search_fts_instance) とページタイトルだけの全文検索 (page_title_fts)')
+def _m017_short_terms_and_page_titles(cursor):
+    # 語彙表に展開しきれない1〜2文字の語は、出現表でその語で始まるトライグラムの範囲を引き、
+    # 行 ID の集合にする（全表の LIKE にしない）
+    cursor.execute("CREATE VIRTUAL TABLE IF NOT EXISTS search_fts_instance USING fts5vocab(search_fts, 'instance')")
+
+    # search_fts はブロックの行なので、ブロックのないページはタイトルで見つからない。
+    # ページタイトルだけの索引を別に持つ（番兵は search_source と同じ）
+    cursor.execute('''
+    CREATE VIEW IF NOT EXISTS page_title_source AS
+    SELECT id, COALESCE(title, '') || char(1, 1) AS title FROM pages
+    ''')
+    cursor.execute('''
+    CREATE VIRTUAL TABLE IF NOT EXISTS page_title_fts USING fts5(
+        title, content='page_title_source', content_rowid='id', tokenize='trigram'
+    )
+    ''')
+    cursor.execute("CREATE VIRTUAL TABLE IF NOT EXISTS page_title_fts_vocab USING fts5vocab(page_title_fts, 'row')")
+    cursor.execute(
+        "CREATE VIRTUAL TABLE IF NOT EXISTS page_title_fts_instance USING fts5vocab(page_title_fts, 'instance')"
+    )
+    cursor.execute('''
+    CREATE TRIGGER IF NOT EXISTS pages_title_fts_ai AFTER INSERT ON pages BEGIN
+        INSERT INTO page_title_fts(rowid, title) VALUES (new.id, COALESCE(new.title, '') || char(1, 1));
+    END;
+    ''')
+    cursor.execute('''
+    CREATE TRIGGER IF NOT EXISTS pages_title_fts_ad AFTER DELETE ON pages BEGIN
+        INSERT INTO page_title_fts(page_title_fts, rowid, title)
+            VALUES ('delete', old.id, COALESCE(old.title, '') || char(1, 1));
+    END;
+    ''')
+    cursor.execute('''
+    CREATE TRIGGER IF NOT EXISTS pages_title_fts_au AFTER UPDATE OF title ON pages
+    WHEN old.title IS NOT new.title BEGIN
+        INSERT INTO page_title_fts(page_title_fts, rowid, title)
+            VALUES ('delete', old.id, COALESCE(old.title, '') || char(1, 1));
+        INSERT INTO page_title_fts(rowid, title) VALUES (new.id, COALESCE(new.title, '') || char(1, 1));
+    END;
+    ''')
+    cursor.execute("INSERT INTO page_title_fts(page_title_fts) VALUES ('rebuild')")
+
+
+@migration(18, '取り込み中の印 (import_state)。取り込み中はブロックごとの全文検索の索引を止める')
+def _m018_import_state(cursor):
+    # 一括インポートはトリガーを DROP/CREATE せず、この印を立てて索引を止める
+    # （スキーマを変えないので他の接続の準備済み文を無効にせず、ロールバックで印も戻る）
+    cursor.execute('''
+    CREATE TABLE IF NOT EXISTS import_state (
+        id INTEGER PRIMARY KEY CHECK (id = 1),
+        deferring INTEGER NOT NULL DEFAULT 0
+    )
+    ''')
+    cursor.execute('INSERT OR IGNORE INTO import_state (id, deferring) VALUES (1, 0)')
+    cursor.execute('DROP TRIGGER IF EXISTS blocks_ai')
+    cursor.execute('''
+    CREATE TRIGGER blocks_ai AFTER INSERT ON blocks
+    WHEN (SELECT deferring FROM import_state WHERE id = 1) = 0 BEGIN
+        INSERT INTO search_fts(rowid, title, content, details) VALUES (
+            new.id,
+            COALESCE((SELECT title FROM pages WHERE id = new.page_id), '') || char(1, 1),
+            COALESCE(new.content, '') || char(1, 1),
+            COALESCE(new.details, '') || char(1, 1)
+        );
+    END;
+    ''')
+
+
+# === 実行 ===
+
+def get_schema_version(conn):
+    return conn.execute('PRAGMA user_version').fetchone()[0]
+
+
+def pending_migrations(conn):
+    current = get_schema_version(conn)
+    return [m for m in MIGRATIONS if m[0] > current]
+
+
+def migrate(verbose=False):
+    """未適用のマイグレーションを順に適用し、適用した件数を返す
+
+    スキーマが最新なら PRAGMA user_version を1回読むだけで戻る。
+    各ステップは BEGIN IMMEDIATE の中で実行するので、複数ワーカーが同時に
+    起動しても1つだけが適用し、他は待機後にバージョンを読み直してスキップする。
+    """
+    conn = get_db()
+    try:
+        if get_schema_version(conn) >= latest_version():
+            return 0
+
+        applied = 0
+        for version, description, func in MIGRATIONS:
+            conn.execute('BEGIN IMMEDIATE')
+            try:
+                if get_schema_version(conn) >= version:
+                    conn.rollback()
+                    continue
+                func(conn.cursor())
+                conn.execute(f'PRAGMA user_version = {version:d}')
+                conn.commit()
+            except Exception:
+                conn.rollback()
+                raise
+            applied += 1
+            if verbose:
+                print(f"✅ Migration {version:03d} applied: {description}")
+        return applied
+    finally:
+        conn.close()
+
+
+def print_status():
+    conn = get_db()
+    try:
+        current = get_schema_version(conn)
+    finally:
+        conn.close()
+    print(f"現在のスキーマバージョン: {current} / 最新: {latest_version()}")
+    for version, description, _ in MIGRATIONS:
+        mark = '✅' if version <= current else '⏳'
+        print(f"  {mark} {version:03d} {description}")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='スキーママイグレーションの確認・適用')
+    parser.add_argument('command', nargs='?', choices=['status', 'migrate'], default='status')
+    parser.add_argument('--db', help='対象のDBファイル（省略時は notion.db）')
+    args = parser.parse_args(argv)
+
+    if args.db:
+        import database
+        database.DATABASE = args.db
+
+    if args.command == 'migrate':
+        applied = migrate(verbose=True)
+        print(f"{applied} 件のマイグレーションを適用しました。")
+    print_status()
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,182 @@
+# -*- coding: utf-8 -*-
+"""
+並び順 (position) の管理
+- ページは parent_id、ブロックは page_id ごとの兄弟リストの中で position (REAL) 昇順に並ぶ
+- 末尾への追加は 1000 刻み、兄弟の間への挿入は両隣の中点（分数インデックス）
+- 中点が取れなくなったら（浮動小数点の精度切れ）兄弟リストを 1000 刻みに振り直す
+- 並べ替えは順序の変わらない最長の並びを残し、動いた行だけに新しい position を付ける
+"""
+
+import bisect
+
+POSITION_STEP = 1000.0
+
+# これより隙間が狭くなったら振り直す（1000 刻みから約30回の中点挿入に相当）
+MIN_GAP = 1e-6
+
+# テーブル → 兄弟リストを区切るカラム
+SCOPES = {
+    'pages': 'parent_id',
+    'blocks': 'page_id',
+}
+
+
+def _scope(table, scope_id):
+    """兄弟リストを絞り込む WHERE 句とパラメータ"""
+    column = SCOPES[table]
+    if scope_id is None:
+        return f'{column} IS NULL', ()
+    return f'{column} = ?', (scope_id,)
+
+
+def next_position(cursor, table, scope_id):
+    """兄弟リストの末尾に追加する position"""
+    where, params = _scope(table, scope_id)
+    cursor.execute(f'SELECT MAX(position) FROM {table} WHERE {where}', params)
+    max_pos = cursor.fetchone()[0]
+    if max_pos is None:
+        return POSITION_STEP
+    if max_pos + POSITION_STEP == max_pos:
+        # 値が大きすぎて 1000 を足しても変わらない
+        return rebalance(cursor, table, scope_id) * POSITION_STEP + POSITION_STEP
+    return max_pos + POSITION_STEP
+
+
+def _neighbours(cursor, table, scope_id, after_id):
+    """after_id の position と、その直後の兄弟の position（after_id が None なら先頭の前）"""
+    where, params = _scope(table, scope_id)
+    if after_id is None:
+        cursor.execute(f'SELECT MIN(position) FROM {table} WHERE {where}', params)
+        return None, cursor.fetchone()[0]
+
+    cursor.execute(f'SELECT position FROM {table} WHERE id = ? AND {where}', (after_id,) + params)
+    row = cursor.fetchone()
+    if row is None:
+        raise ValueError(f'{table} {after_id} is not in this list')
+    low = row[0]
+    cursor.execute(
+        f'SELECT MIN(position) FROM {table} WHERE {where} AND position > ?',
+        params + (low,)
+    )
+    return low, cursor.fetchone()[0]
+
+
+def _between(low, high):
+    """low と high の間の値。精度が足りなければ None"""
+    if low is None and high is None:
+        return POSITION_STEP
+    if low is None:
+        return high - POSITION_STEP
+    if high is None:
+        return low + POSITION_STEP
+    if high - low < MIN_GAP:
+        return None
+    mid = (low + high) / 2
+    if not low < mid < high:
+        return None
+    return mid
+
+
+def position_after(cursor, table, scope_id, after_id=None):
+    """after_id の直後（None なら先頭）に挿入する position
+
+    両隣の隙間が詰まっていれば兄弟リストを振り直してから計算する。
+    after_id が兄弟リストにない場合は ValueError。
+    """
+    low, high = _neighbours(cursor, table, scope_id, after_id)
+    position = _between(low, high)
+    if position is None:
+        rebalance(cursor, table, scope_id)
+        low, high = _neighbours(cursor, table, scope_id, after_id)
+        position = _between(low, high)
+    return position
+
+
+def rebalance(cursor, table, scope_id):
+    """兄弟リストを現在の順序のまま 1000 刻みに振り直す（1回の executemany）"""
+    where, params = _scope(table, scope_id)
+    cursor.execute(f'SELECT id FROM {table} WHERE {where} ORDER BY position, id', params)
+    ids = [row[0] for row in cursor.fetchall()]
+    cursor.executemany(
+        f'UPDATE {table} SET position = ? WHERE id = ?',
+        [((i + 1) * POSITION_STEP, item_id) for i, item_id in enumerate(ids)]
+    )
+    return len(ids)
+
+
+def _unmoved(ordered, positions):
+    """ordered のうち position が増えていく最長の並び（書き換えずに済む ID の集合）"""
+    tail_positions = []
+    tail_indexes = []
+    previous = [None] * len(ordered)
+    for i, item_id in enumerate(ordered):
+        position = positions[item_id]
+        k = bisect.bisect_left(tail_positions, position)
+        previous[i] = tail_indexes[k - 1] if k else None
+        if k == len(tail_positions):
+            tail_positions.append(position)
+            tail_indexes.append(i)
+        else:
+            tail_positions[k] = position
+            tail_indexes[k] = i
+    unmoved = set()
+    i = tail_indexes[-1] if tail_indexes else None
+    while i is not None:
+        unmoved.add(ordered[i])
+        i = previous[i]
+    return unmoved
+
+
+def apply_order(cursor, table, scope_id, ordered_ids):
+    """兄弟リストを ordered_ids の順に並べ替える
+
+    ordered_ids に含まれない兄弟は、元の順序のまま後ろに続ける。
+    順序の変わらない行はそのままにして、動いた行だけを前後の間の position に書き換える
+    （1件のドラッグなら1行）。間が詰まっていれば兄弟リスト全体を 1000 刻みで振り直す。
+    兄弟リストにない ID が含まれていれば ValueError。
+    戻り値は [(id, position), ...]。
+    """
+    where, params = _scope(table, scope_id)
+    cursor.execute(f'SELECT id, position FROM {table} WHERE {where} ORDER BY position, id', params)
+    rows = cursor.fetchall()
+    current = [row[0] for row in rows]
+    positions = {row[0]: row[1] for row in rows}
+
+    known = set(current)
+    ordered = []
+    seen = set()
+    for item_id in ordered_ids:
+        if item_id not in known:
+            raise ValueError(f'{table} {item_id} is not in this list')
+        if item_id not in seen:
+            seen.add(item_id)
+            ordered.append(item_id)
+    ordered.extend(item_id for item_id in current if item_id not in seen)
+
+    unmoved = _unmoved(ordered, positions)
+    # 各位置より後ろで最初の動かない行の position（動いた行の上限）
+    next_unmoved = [None] * len(ordered)
+    high = None
+    for i in range(len(ordered) - 1, -1, -1):
+        next_unmoved[i] = high
+        if ordered[i] in unmoved:
+            high = positions[ordered[i]]
+
+    new_positions = dict(positions)
+    updates = []
+    low = None
+    for i, item_id in enumerate(ordered):
+        if item_id not in unmoved:
+            position = _between(low, next_unmoved[i])
+            if position is None:
+                updates = None
+                break
+            new_positions[item_id] = position
+            updates.append((position, item_id))
+        low = new_positions[item_id]
+
+    if updates is None:
+        new_positions = {item_id: (i + 1) * POSITION_STEP for i, item_id in enumerate(ordered)}
+        updates = [(position, item_id) for item_id, position in new_positions.items()]
+    cursor.executemany(f'UPDATE {table} SET position = ? WHERE id = ?', updates)
+    return [(item_id, new_positions[item_id]) for item_id in ordered]
@@ -0,0 +1,190 @@
+# -*- coding: utf-8 -*-
+"""
+ページツリーのキャッシュ（プロセス内）
+- サイドバーに必要なカラム（id, parent_id, title, icon, position, is_pinned）だけを保持
+- ノードは __slots__ のオブジェクトで、親 ID ごとの子リストに並べる
+- 読み出しのたびに change_log の pages の最新 seq と比べ、進んでいればその差分の行だけを読み直す
+  （どのルート・どのワーカーの変更でも、同じ仕組みで反映される）
+"""
+
+import bisect
+import threading
+
+from changes import latest_seqs
+
+FIELDS = ('id', 'parent_id', 'title', 'icon', 'position', 'is_pinned')
+
+# 差分がこれより多ければ全体を作り直す
+MAX_DELTA = 500
+
+
+class PageNode:
+    __slots__ = FIELDS
+
+    def __init__(self, row):
+        for field in FIELDS:
+            setattr(self, field, row[field])
+
+    def sort_key(self):
+        return (self.position or 0, self.id)
+
+
+class PageTreeCache:
+    """削除されていないページのツリー"""
+
+    def __init__(self, max_delta=MAX_DELTA):
+        self.max_delta = max_delta
+        self.nodes = {}
+        self.children = {}
+        self.seq = None
+        self._lock = threading.Lock()
+        self._stats = {'rebuilds': 0, 'deltas': 0, 'hits': 0}
+
+    # --- 同期 ---
+
+    def sync(self, cursor):
+        """change_log と比べて古ければ更新する"""
+        with self._lock:
+            self._sync(cursor)
+
+    def _sync(self, cursor):
+        latest = latest_seqs(cursor, ('pages',))['pages']
+        if self.seq == latest:
+            self._stats['hits'] += 1
+            return
+        if self.seq is None or latest < self.seq:
+            # 初回、または DB が差し替えられた
+            self._rebuild(cursor, latest)
+            return
+        cursor.execute('''
+            SELECT seq, row_id FROM change_log
+            WHERE table_name = 'pages' AND seq > ?
+            ORDER BY seq LIMIT ?
+        ''', (self.seq, self.max_delta + 1))
+        entries = cursor.fetchall()
+        if len(entries) > self.max_delta:
+            self._rebuild(cursor, latest)
+            return
+        self._apply(cursor, [entry['row_id'] for entry in entries])
+        self.seq = entries[-1]['seq'] if entries else latest
+        self._stats['deltas'] += 1
+
+    def _rebuild(self, cursor, seq):
+        cursor.execute(f'SELECT {", ".join(FIELDS)} FROM pages WHERE is_deleted = 0')
+        self.nodes = {}
+        self.children = {}
+        for row in cursor.fetchall():
+            node = PageNode(row)
+            self.nodes[node.id] = node
+            self.children.setdefault(node.parent_id, []).append(node)
+        for siblings in self.children.values():
+            siblings.sort(key=PageNode.sort_key)
+        self.seq = seq
+        self._stats['rebuilds'] += 1
+
+    def _apply(self, cursor, page_ids):
+        """変更された行だけを読み直して差し替える（削除・ゴミ箱入りはツリーから外す）"""
+        touched = set()
+        for page_id in page_ids:
+            node = self.nodes.pop(page_id, None)
+            if node is not None:
+                self.children[node.parent_id].remove(node)
+                touched.add(node.parent_id)
+        if page_ids:
+            cursor.execute(f'''
+                SELECT {", ".join(FIELDS)} FROM pages
+                WHERE is_deleted = 0 AND id IN ({", ".join("?" for _ in page_ids)})
+            ''', page_ids)
+            for row in cursor.fetchall():
+                node = PageNode(row)
+                self.nodes[node.id] = node
+                self.children.setdefault(node.parent_id, []).append(node)
+                touched.add(node.parent_id)
+        for parent_id in touched:
+            if self.children.get(parent_id):
+                self.children[parent_id].sort(key=PageNode.sort_key)
+            else:
+                self.children.pop(parent_id, None)
+
+    # --- 読み出し ---
+
+    def _to_dict(self, node):
+        page = {field: getattr(node, field) for field in FIELDS}
+        page['children'] = [self._to_dict(child) for child in self.children.get(node.id, ())]
+        return page
+
+    def tree(self, cursor):
+        """サイドバー用のツリー（子は position 順）
+
+        親がツリーにないページ（ゴミ箱の親の下に残ったものなど）はルートとして並べる。
+        """
+        with self._lock:
+            self._sync(cursor)
+            roots = list(self.children.get(None, ()))
+            orphan_parents = sorted(
+                parent_id for parent_id in self.children
+                if parent_id is not None and parent_id not in self.nodes
+            )
+            for parent_id in orphan_parents:
+                roots.extend(self.children[parent_id])
+            return [self._to_dict(node) for node in roots]
+
+    def _summary(self, node):
+        page = {field: getattr(node, field) for field in FIELDS}
+        page['child_count'] = len(self.children.get(node.id, ()))
+        return page
+
+    def children_page(self, cursor, parent_id, limit, after=None):
+        """parent_id の子（None ならルート）を position 順に limit 件、child_count 付きで返す
+
+        after は前ページ最後の (position, id)。戻り値は (ページのリスト, 続きがあるか)。
+        parent_id のページがツリーになければ None を返す。
+        """
+        with self._lock:
+            self._sync(cursor)
+            if parent_id is None:
+                # 親がツリーにないページ（ゴミ箱の親の下に残ったものなど）もルートに含める
+                siblings = sorted(
+                    (node for key, nodes in self.children.items()
+                     if key is None or key not in self.nodes for node in nodes),
+                    key=PageNode.sort_key
+                )
+            elif parent_id not in self.nodes:
+                return None
+            else:
+                siblings = self.children.get(parent_id, [])
+            start = bisect.bisect_right(siblings, after, key=PageNode.sort_key) if after else 0
+            selected = siblings[start:start + limit]
+            return [self._summary(node) for node in selected], start + limit < len(siblings)
+
+    def ancestor_map(self, cursor, page_ids):
+        """各ページの祖先（ルート→親の順、自身は含まない）。get_ancestor_map と同じ形
+
+        ゴミ箱に入っている祖先より上はたどらない（サイドバーの表示と同じ）。
+        """
+        with self._lock:
+            self._sync(cursor)
+            result = {}
+            for page_id in {page_id for page_id in page_ids if page_id}:
+                chain = []
+                node = self.nodes.get(page_id)
+                seen = {page_id}
+                while node is not None and node.parent_id is not None and node.parent_id not in seen:
+                    seen.add(node.parent_id)
+                    node = self.nodes.get(node.parent_id)
+                    if node is not None:
+                        chain.append({'id': node.id, 'title': node.title, 'icon': node.icon})
+                result[page_id] = chain[::-1]
+            return result
+
+    def metrics(self):
+        with self._lock:
+            return dict(self._stats, pages=len(self.nodes), seq=self.seq)
+
+
+# グローバルキャッシュインスタンス
+_page_cache = PageTreeCache()
+
+
+def get_page_cache():
+    return _page_cache
@@ -3,7 +3,7 @@ Flask アプリケーション - APIルート定義
 ページ、ブロック、テンプレート、インポート/エクスポート機能など
 """
 
-from flask import request, jsonify, send_file, redirect
+from flask import request, jsonify, send_file, redirect, Response, stream_with_context
 import re
 from datetime import datetime, timedelta
 import os
@@ -19,20 +19,69 @@ import urllib.parse
 from werkzeug.utils import secure_filename
 
 from database import (
-    get_db, get_next_position, get_block_next_position,
-    mark_tree_deleted, hard_delete_tree,
+    get_db, get_next_position, get_block_next_position, is_system_page,
+    mark_tree_deleted, mark_trees_deleted, hard_delete_tree, hard_delete_trees, get_page_tree,
     save_healthplanet_token, get_healthplanet_token, clear_healthplanet_token
 )
+from ordering import position_after, apply_order, POSITION_STEP
+from search import search_blocks, search_pages, split_terms
+from write_queue import submit_update, submit_transaction, get_write_queue
+from batch import apply_batch, BatchError, PAGE_FIELDS, BLOCK_FIELDS
+from changes import get_changes, TABLES as CHANGE_TABLES
+from activity import get_activity, parse_since, DEFAULT_LIMIT as ACTIVITY_DEFAULT_LIMIT
+from books import get_journal_date, get_previous_day_progress, get_book_history
+from page_cache import get_page_cache
+from tree_copy import carry_over_filter, copy_tree, insert_tree
+from importer import PageImporter, iter_pages
+from zip_importer import ZipPageReader
+from exporter import stream_json, stream_jsonl, zip_manifest, stream_zip, attachment_headers
 from utils import (
     allowed_file, estimate_calories, estimate_calories_items, export_page_to_dict,
-    page_to_markdown, create_page_from_dict, copy_page_tree,
-    backup_database_to_json, get_or_create_date_page
+    page_to_markdown, backup_database_to_json, get_or_create_date_page, journal_title,
+    encode_cursor, decode_cursor
 )
 
 DATABASE = 'notion.db'
 UPLOAD_FOLDER = 'uploads'
 BACKUP_FOLDER = 'backups'
 
+# 一覧系のクエリ（scripts/check_query_plans.py が同じ SQL の実行計画を確認する）
+PAGE_BLOCKS_SQL = 'SELECT * FROM blocks WHERE page_id = ? ORDER BY position'
+
+TRASH_SQL = 'SELECT * FROM pages WHERE is_deleted = 1 ORDER BY updated_at DESC'
+
+# {conditions} は p（カテゴリーページ）と parent（日付ページ）の条件、{block_join} はブロックの結合条件
+CATEGORY_SQL = '''
+    WITH category AS (
+        SELECT p.id FROM pages p
+        LEFT JOIN pages parent ON parent.id = p.parent_id
+        WHERE {conditions}
+        ORDER BY p.updated_at DESC, p.id DESC
+        LIMIT ?
+    )
+    SELECT p.*, parent.*, b.*
+    FROM category
+    JOIN pages p ON p.id = category.id
+    LEFT JOIN pages parent ON parent.id = p.parent_id
+    LEFT JOIN blocks b ON {block_join}
+    ORDER BY p.updated_at DESC, p.id DESC, b.position
+'''
+
+# DATE(created_at) = 今日 と同じ範囲を [今日, 明日) で引く（(page_id, created_at) のインデックスを使う）
+TODAY_HIGHLIGHTS_SQL = '''
+    SELECT * FROM blocks
+    WHERE page_id = ? AND created_at >= ? AND created_at < ?
+    ORDER BY created_at DESC
+    LIMIT 10
+'''
+
+DAYS_SQL = '''
+    SELECT id, title, icon, parent_id, journal_date, updated_at
+    FROM pages
+    WHERE {conditions}
+    ORDER BY journal_date
+'''
+
 
 def register_routes(app):
     # HealthPlanet同期テストページ
@@ -96,7 +145,7 @@ def register_routes(app):
         return ' / '.join(parts)
 
     def _upsert_healthplanet_block(cursor, page_id, content):
-        cursor.execute('SELECT id, position, props FROM blocks WHERE page_id = ? ORDER BY position ASC', (page_id,))
+        cursor.execute('SELECT id, props FROM blocks WHERE page_id = ? ORDER BY position ASC', (page_id,))
         rows = cursor.fetchall()
         target_id = None
         for row in rows:
@@ -113,11 +162,7 @@ def register_routes(app):
             cursor.execute('UPDATE blocks SET content = ?, updated_at = CURRENT_TIMESTAMP WHERE id = ?', (content, target_id))
             return
 
-        if rows:
-            min_pos = min(row['position'] for row in rows)
-            new_pos = min_pos - 1000.0
-        else:
-            new_pos = 1000.0
+        new_pos = position_after(cursor, 'blocks', page_id, None)
 
         props = json.dumps({'source': 'healthplanet', 'type': 'body'})
         cursor.execute(
@@ -233,19 +278,13 @@ def register_routes(app):
 
         conn = get_db()
         cursor = conn.cursor()
-        cursor.execute('''
-            SELECT b.*, p.title AS page_title, p.id AS page_id
-            FROM blocks b
-            JOIN pages p ON b.page_id = p.id
-            WHERE b.id = ?
-        ''', (block_id,))
+        cursor.execute('SELECT * FROM blocks WHERE id = ?', (block_id,))
         row = cursor.fetchone()
         if not row:
             conn.close()
             return jsonify({'error': 'Block not found'}), 404
 
-        page_title = row['page_title'] or ''
-        if page_title != '🔖 あとで調べる':
+        if not is_system_page(cursor, 'inbox', row['page_id']):
             conn.close()
             return jsonify({'error': 'Only inbox items can be resolved'}), 400
 
@@ -306,19 +345,13 @@ def register_routes(app):
 
         conn = get_db()
         cursor = conn.cursor()
-        cursor.execute('''
-            SELECT b.*, p.title AS page_title
-            FROM blocks b
-            JOIN pages p ON b.page_id = p.id
-            WHERE b.id = ?
-        ''', (block_id,))
+        cursor.execute('SELECT * FROM blocks WHERE id = ?', (block_id,))
         row = cursor.fetchone()
         if not row:
             conn.close()
             return jsonify({'error': 'Block not found'}), 404
 
-        page_title = row['page_title'] or ''
-        if page_title != '🔖 あとで調べる':
+        if not is_system_page(cursor, 'inbox', row['page_id']):
             conn.close()
             return jsonify({'error': 'Only inbox items can be un-resolved'}), 400
 
@@ -353,107 +386,171 @@ def register_routes(app):
 
     @app.route('/api/pages', methods=['GET'])
     def get_pages():
+        """サイドバー用のページツリー（プロセス内キャッシュから返す）
+
+        ?roots=1 ならルートだけを child_count 付きで返す（子は /api/pages/<id>/children で取得）。
+        """
+        if request.args.get('roots') in ('1', 'true'):
+            return get_child_pages(None)
         conn = get_db()
-        cursor = conn.cursor()
-        # インデックスを活用して高速化
-        cursor.execute('''
-            SELECT * FROM pages 
-            WHERE is_deleted = 0 
-            ORDER BY parent_id, position
-        ''')
-        all_pages = [dict(row) for row in cursor.fetchall()]
+        roots = get_page_cache().tree(conn.cursor())
         conn.close()
-        
-        # フロントエンドで階層構造を構築（DBクエリを削減）
-        page_map = {page['id']: {**page, 'children': []} for page in all_pages}
-        roots = []
-        for page in all_pages:
-            if page['parent_id'] and page['parent_id'] in page_map:
-                page_map[page['parent_id']]['children'].append(page_map[page['id']])
-            else:
-                roots.append(page_map[page['id']])
         return jsonify(roots)
 
+    @app.route('/api/pages/<int:page_id>/children', methods=['GET'])
+    def get_page_children(page_id):
+        """子ページを position 順に child_count 付きで返す（?limit=&cursor=）"""
+        return get_child_pages(page_id)
+
+    def get_child_pages(parent_id):
+        """子ページ（parent_id が None ならルート）の1ページ分。続きは X-Next-Cursor ヘッダー"""
+        limit = max(1, min(request.args.get('limit', 100, type=int), 500))
+        after = None
+        if request.args.get('cursor'):
+            try:
+                after = decode_cursor(request.args['cursor'], float, int)
+            except ValueError as e:
+                return jsonify({'error': str(e)}), 400
+        conn = get_db()
+        result = get_page_cache().children_page(conn.cursor(), parent_id, limit, after)
+        conn.close()
+        if result is None:
+            return jsonify({'error': 'Page not found'}), 404
+        pages, has_more = result
+        response = jsonify(pages)
+        if has_more:
+            last = pages[-1]
+            response.headers['X-Next-Cursor'] = encode_cursor(last['position'] or 0, last['id'])
+        return response
+
     @app.route('/api/trash', methods=['GET'])
     def get_trash():
         conn = get_db()
         cursor = conn.cursor()
-        cursor.execute('SELECT * FROM pages WHERE is_deleted = 1 ORDER BY updated_at DESC')
+        cursor.execute(TRASH_SQL)
         trash_pages = [dict(row) for row in cursor.fetchall()]
         conn.close()
         return jsonify(trash_pages)
 
     def get_items_by_category(category_title):
-        """指定されたカテゴリーのページとブロックを取得する汎用関数"""
+        """指定カテゴリー（食事・筋トレなど）のページと親ページ・ブロックを取得する汎用関数
+
+        ?from=&to= は親（日付ページ）の journal_date、?limit= はページ数（既定 100、最大 500）、
+        ?cursor= は前回の X-Next-Cursor、?skip_empty=1 で中身が空のテンプレートブロックを除く。
+        カテゴリーページ ⋈ 親 ⋈ ブロックの1クエリで、履歴の長さに関係なくクエリ数は一定。
+        """
+        limit = max(1, min(request.args.get('limit', 100, type=int), 500))
+        conditions = ['p.title = ?', 'p.is_deleted = 0']
+        params = [category_title]
+        for arg, op in (('from', '>='), ('to', '<=')):
+            value = request.args.get(arg)
+            if value:
+                try:
+                    value = datetime.strptime(value, '%Y-%m-%d').strftime('%Y-%m-%d')
+                except ValueError:
+                    return jsonify({'error': f'Invalid {arg} date'}), 400
+                conditions.append(f'parent.journal_date {op} ?')
+                params.append(value)
+        if request.args.get('cursor'):
+            try:
+                updated_at, page_id = decode_cursor(request.args['cursor'], str, int)
+            except ValueError as e:
+                return jsonify({'error': str(e)}), 400
+            conditions.append('(p.updated_at < ? OR (p.updated_at = ? AND p.id < ?))')
+            params.extend([updated_at, updated_at, page_id])
+        block_join = 'b.page_id = p.id'
+        if request.args.get('skip_empty') in ('1', 'true'):
+            block_join += (" AND NOT (TRIM(COALESCE(b.content, '')) = '' AND COALESCE(b.details, '') = ''"
+                           " AND COALESCE(b.props, '') IN ('', '{}'))")
+
         conn = get_db()
         cursor = conn.cursor()
-        
-        # 1. 指定されたカテゴリーページをすべて見つける（例：食事、筋トレ）
-        cursor.execute('''
-            SELECT * FROM pages 
-            WHERE title = ? AND is_deleted = 0
-            ORDER BY updated_at DESC
-        ''', (category_title,))
-        category_pages = [dict(row) for row in cursor.fetchall()]
-        
+        page_columns = len(cursor.execute('PRAGMA table_info(pages)').fetchall())
+        # 1つ余分に取って続きがあるかを判定する
+        cursor.execute(CATEGORY_SQL.format(conditions=' AND '.join(conditions), block_join=block_join),
+                       params + [limit + 1])
+        names = [column[0] for column in cursor.description]
+
         result = []
-        for category_page in category_pages:
-            # 2. カテゴリーページ自体のブロックを取得
-            cursor.execute('''
-                SELECT * FROM blocks 
-                WHERE page_id = ?
-                ORDER BY position
-            ''', (category_page['id'],))
-            blocks = [dict(row) for row in cursor.fetchall()]
-            
-            # 3. 親ページ情報（日記ページなど）を取得
-            parent_page = None
-            if category_page['parent_id']:
-                cursor.execute('SELECT * FROM pages WHERE id = ?', (category_page['parent_id'],))
-                parent_row = cursor.fetchone()
-                if parent_row:
-                    parent_page = dict(parent_row)
-            
-            result.append({
-                'page': category_page,
-                'parent_page': parent_page,
-                'blocks': blocks
-            })
-        
+        next_cursor = None
+        for row in cursor:
+            page = dict(zip(names[:page_columns], row[:page_columns]))
+            if not result or result[-1]['page']['id'] != page['id']:
+                if len(result) == limit:
+                    last = result[-1]['page']
+                    next_cursor = encode_cursor(last['updated_at'], last['id'])
+                    break
+                parent = dict(zip(names[page_columns:2 * page_columns], row[page_columns:2 * page_columns]))
+                result.append({
+                    'page': page,
+                    'parent_page': parent if parent['id'] is not None else None,
+                    'blocks': [],
+                })
+            block = dict(zip(names[2 * page_columns:], row[2 * page_columns:]))
+            if block['id'] is not None:
+                result[-1]['blocks'].append(block)
         conn.close()
-        return result
+
+        response = jsonify(result)
+        if next_cursor:
+            response.headers['X-Next-Cursor'] = next_cursor
+        return response
 
     @app.route('/api/all-workouts', methods=['GET'])
     def get_all_workouts():
         """全ての日記から筋トレページとそのブロックを取得"""
-        return jsonify(get_items_by_category('筋トレ'))
+        return get_items_by_category('筋トレ')
 
     @app.route('/api/all-english-learning', methods=['GET'])
     def get_all_english_learning():
         """全ての日記から英語学習ページとそのブロックを取得"""
-        return jsonify(get_items_by_category('英語学習'))
+        return get_items_by_category('英語学習')
 
     @app.route('/api/all-meals', methods=['GET'])
     def get_all_meals():
         """全ての日記から食事ページとそのブロックを取得"""
-        return jsonify(get_items_by_category('食事'))
+        return get_items_by_category('食事')
 
     @app.route('/api/today-highlights/<int:page_id>', methods=['GET'])
     def get_today_highlights(page_id):
         """指定ページ内で今日作成されたブロックを取得"""
         conn = get_db()
         cursor = conn.cursor()
-        today = datetime.now().strftime('%Y-%m-%d')
-        cursor.execute('''
-            SELECT * FROM blocks 
-            WHERE page_id = ? AND DATE(created_at) = ?
-            ORDER BY created_at DESC
-            LIMIT 10
-        ''', (page_id, today))
+        today = datetime.now()
+        tomorrow = today + timedelta(days=1)
+        cursor.execute(TODAY_HIGHLIGHTS_SQL, (page_id, today.strftime('%Y-%m-%d'), tomorrow.strftime('%Y-%m-%d')))
         highlights = [dict(row) for row in cursor.fetchall()]
         conn.close()
         return jsonify(highlights)
 
+    @app.route('/api/activity', methods=['GET'])
+    def get_activity_feed():
+        """最近作成・更新されたページとブロック（新しい順）
+
+        ?since= は下限（YYYY-MM-DD か YYYY-MM-DD HH:MM:SS、UTC）、?limit= は件数（既定 50、最大 200）、
+        ?cursor= は前回の X-Next-Cursor。
+        """
+        since = request.args.get('since')
+        try:
+            since = parse_since(since) if since else None
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 400
+        limit = request.args.get('limit', ACTIVITY_DEFAULT_LIMIT, type=int)
+
+        conn = get_db()
+        cursor = conn.cursor()
+        try:
+            items, next_cursor = get_activity(cursor, since, limit, request.args.get('cursor'))
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 400
+        finally:
+            conn.close()
+
+        response = jsonify(items)
+        if next_cursor:
+            response.headers['X-Next-Cursor'] = next_cursor
+        return response
+
     @app.route('/api/pages', methods=['POST'])
     def create_page():
         data = request.json
@@ -557,18 +654,8 @@ def register_routes(app):
         }
         
         template = templates.get(template_type, templates['daily'])
-        new_pos = get_next_position(cursor, None)
-        
-        cursor.execute('INSERT INTO pages (title, icon, parent_id, position) VALUES (?, ?, ?, ?)',
-                       (template['title'], template['icon'], None, new_pos))
-        page_id = cursor.lastrowid
-        
-        for i, block in enumerate(template['blocks']):
-            cursor.execute(
-                "INSERT INTO blocks (page_id, type, content, checked, position, props) VALUES (?, ?, ?, ?, ?, ?)",
-                (page_id, block['type'], block['content'], block.get('checked', 0), (i + 1) * 1000.0, '{}')
-            )
-        
+        page_id = insert_tree(cursor, template)
+
         conn.commit()
         cursor.execute('SELECT * FROM pages WHERE id = ?', (page_id,))
         page = dict(cursor.fetchone())
@@ -577,7 +664,7 @@ def register_routes(app):
 
     @app.route('/api/pages/from-date', methods=['POST'])
     def create_page_from_date():
-        """指定日付のページを作成（存在しない場合は前日をコピー）"""
+        """指定日付のページを作成（存在しない場合は前日をコピー。carry_over で引き継ぐブロックを絞れる）"""
         data = request.json
         date_str = data.get('date')
 
@@ -586,7 +673,11 @@ def register_routes(app):
 
         conn = get_db()
         cursor = conn.cursor()
-        page = get_or_create_date_page(cursor, date_str)
+        try:
+            page = get_or_create_date_page(cursor, date_str, carry_over=data.get('carry_over'))
+        except ValueError as e:
+            conn.close()
+            return jsonify({'error': str(e)}), 400
         if not page:
             conn.close()
             return jsonify({'error': 'Invalid date format'}), 400
@@ -594,6 +685,29 @@ def register_routes(app):
         conn.close()
         return jsonify(page)
 
+    @app.route('/api/days', methods=['GET'])
+    def list_days():
+        """日付ページを期間で取得（?from=YYYY-MM-DD&to=YYYY-MM-DD、両端を含む）"""
+        conditions = ['journal_date IS NOT NULL', 'is_deleted = 0']
+        params = []
+        for arg, op in (('from', '>='), ('to', '<=')):
+            value = request.args.get(arg)
+            if not value:
+                continue
+            try:
+                value = datetime.strptime(value, '%Y-%m-%d').strftime('%Y-%m-%d')
+            except ValueError:
+                return jsonify({'error': f'Invalid {arg} date'}), 400
+            conditions.append(f'journal_date {op} ?')
+            params.append(value)
+
+        conn = get_db()
+        cursor = conn.cursor()
+        cursor.execute(DAYS_SQL.format(conditions=' AND '.join(conditions)), params)
+        days = [dict(row) for row in cursor.fetchall()]
+        conn.close()
+        return jsonify(days)
+
     @app.route('/api/pages/<int:page_id>', methods=['GET'])
     def get_page(page_id):
         conn = get_db()
@@ -605,35 +719,67 @@ def register_routes(app):
             return jsonify({'error': 'Page not found'}), 404
         page = dict(page_row)
         # インデックスを活用してブロック取得を高速化
-        cursor.execute('''
-            SELECT * FROM blocks 
-            WHERE page_id = ? 
-            ORDER BY position
-        ''', (page_id,))
+        cursor.execute(PAGE_BLOCKS_SQL, (page_id,))
         page['blocks'] = [dict(row) for row in cursor.fetchall()]
         conn.close()
         return jsonify(page)
 
+    @app.route('/api/pages/<int:page_id>/full', methods=['GET'])
+    def get_page_full(page_id):
+        """ページと depth 段下までの子孫ページ・全ブロックを1リクエストで返す
+
+        ?depth=N（既定 1、最大 10）
+        ?fields=title,icon,blocks.type,blocks.content のように返すカラムを絞れる
+        （blocks. の付いたものがブロック、付いていないものがページのカラム）
+        """
+        try:
+            depth = int(request.args.get('depth', 1))
+        except ValueError:
+            return jsonify({'error': 'depth must be an integer'}), 400
+        depth = max(0, min(depth, 10))
+
+        page_fields = None
+        block_fields = None
+        if request.args.get('fields'):
+            page_fields = []
+            block_fields = []
+            for field in request.args['fields'].split(','):
+                field = field.strip()
+                if field.startswith('blocks.'):
+                    block_fields.append(field[len('blocks.'):])
+                elif field:
+                    page_fields.append(field)
+            # 片方しか指定がなければ、もう片方は全カラム
+            page_fields = page_fields or None
+            block_fields = block_fields or None
+
+        conn = get_db()
+        cursor = conn.cursor()
+        try:
+            page = get_page_tree(cursor, page_id, depth, page_fields, block_fields)
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 400
+        finally:
+            conn.close()
+        if page is None:
+            return jsonify({'error': 'Page not found'}), 404
+        return jsonify(page)
+
     @app.route('/api/pages/<int:page_id>', methods=['PUT'])
     def update_page(page_id):
         data = request.json
-        conn = get_db()
-        cursor = conn.cursor()
-        updates = []
-        values = []
-        fields = ['title', 'icon', 'parent_id', 'cover_image', 'is_pinned', 'is_deleted', 'position']
-        for field in fields:
-            if field in data:
-                updates.append(f'{field} = ?')
-                values.append(data[field])
-        if updates:
-            updates.append('updated_at = CURRENT_TIMESTAMP')
-            values.append(page_id)
-            cursor.execute(f'UPDATE pages SET {", ".join(updates)} WHERE id = ?', values)
-            conn.commit()
-        cursor.execute('SELECT * FROM pages WHERE id = ?', (page_id,))
-        page = dict(cursor.fetchone())
-        conn.close()
+        updates = {field: data[field] for field in PAGE_FIELDS if field in data}
+        try:
+            page = submit_update('pages', page_id, updates)
+        except sqlite3.IntegrityError:
+            # page_closure のトリガーが循環（自分の子孫の下への移動）を拒否した
+            return jsonify({'error': 'Cannot move a page under itself'}), 400
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 400
+        except TimeoutError as e:
+            return jsonify({'error': str(e)}), 503
+        if page is None:
+            return jsonify({'error': 'Page not found'}), 404
         return jsonify(page)
 
     @app.route('/api/pages/<int:page_id>/toggle-pin', methods=['POST'])
@@ -657,20 +803,78 @@ def register_routes(app):
         conn.close()
         return jsonify({'success': True})
 
+    @app.route('/api/pages/bulk', methods=['POST'])
+    def bulk_pages():
+        """複数ページ（とその子孫）をまとめて操作する（1トランザクション）
+
+        body: {"action": "trash" | "restore" | "delete" | "move", "page_ids": [...],
+               "parent_id": 移動先（move のみ、null ならルート）}
+        """
+        data = request.json or {}
+        action = data.get('action')
+        page_ids = data.get('page_ids')
+        if action not in ('trash', 'restore', 'delete', 'move'):
+            return jsonify({'error': "action must be one of 'trash', 'restore', 'delete', 'move'"}), 400
+        if not isinstance(page_ids, list) or not page_ids or not all(isinstance(i, int) for i in page_ids):
+            return jsonify({'error': 'page_ids must be a non-empty list of page IDs'}), 400
+        page_ids = list(dict.fromkeys(page_ids))
+        detached_dates = []
+
+        conn = get_db()
+        cursor = conn.cursor()
+        try:
+            # 例外ならロールバック（404 は何も書いていないのでそのまま抜ける）
+            with conn.transaction():
+                cursor.execute(
+                    f'SELECT id FROM pages WHERE id IN ({", ".join("?" for _ in page_ids)})', page_ids
+                )
+                missing = set(page_ids) - {row[0] for row in cursor.fetchall()}
+                if missing:
+                    return jsonify({'error': 'Page not found', 'page_ids': sorted(missing)}), 404
+
+                if action == 'trash':
+                    mark_trees_deleted(cursor, page_ids, is_deleted=True)
+                elif action == 'restore':
+                    detached_dates = mark_trees_deleted(cursor, page_ids, is_deleted=False)
+                elif action == 'delete':
+                    hard_delete_trees(cursor, page_ids)
+                else:
+                    parent_id = data.get('parent_id')
+                    if parent_id is not None:
+                        cursor.execute('SELECT 1 FROM pages WHERE id = ?', (parent_id,))
+                        if cursor.fetchone() is None:
+                            return jsonify({'error': 'Parent page not found'}), 404
+                    position = get_next_position(cursor, parent_id)
+                    cursor.executemany(
+                        'UPDATE pages SET parent_id = ?, position = ?, updated_at = CURRENT_TIMESTAMP WHERE id = ?',
+                        [(parent_id, position + i * POSITION_STEP, page_id) for i, page_id in enumerate(page_ids)]
+                    )
+        except sqlite3.IntegrityError:
+            # page_closure のトリガーが循環（自分の子孫の下への移動）を拒否した
+            return jsonify({'error': 'Cannot move a page under itself'}), 400
+        finally:
+            conn.close()
+        return jsonify({'success': True, 'count': len(page_ids), 'detached_dates': detached_dates})
+
     @app.route('/api/pages/<int:page_id>/restore', methods=['POST'])
     def restore_page(page_id):
         conn = get_db()
         cursor = conn.cursor()
-        mark_tree_deleted(cursor, page_id, is_deleted=False)
+        # 同じ日付のページがすでにあれば、復元したページは日付ページではなくなる（detached_dates）
+        detached_dates = mark_tree_deleted(cursor, page_id, is_deleted=False)
         conn.commit()
         conn.close()
-        return jsonify({'success': True})
+        return jsonify({'success': True, 'detached_dates': detached_dates})
 
     @app.route('/api/pages/<int:page_id>/copy', methods=['POST'])
     def copy_page(page_id):
-        """ページをコピー（ツリー構造ごと）"""
+        """ページをコピー（ツリー構造ごと。carry_over でコピーするブロックを絞れる）"""
         data = request.json or {}
         parent_id = data.get('parent_id')
+        try:
+            block_filter = carry_over_filter(data.get('carry_over'))
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 400
         
         conn = get_db()
         cursor = conn.cursor()
@@ -679,7 +883,8 @@ def register_routes(app):
         original = cursor.fetchone()
         new_title = (dict(original)['title'] if original else '無題') + 'のコピー'
         
-        new_page_id = copy_page_tree(cursor, page_id, new_parent_id=parent_id, new_title=new_title)
+        new_page_id = copy_tree(cursor, page_id, new_parent_id=parent_id, new_title=new_title,
+                                block_filter=block_filter)
         
         conn.commit()
         cursor.execute('SELECT * FROM pages WHERE id = ?', (new_page_id,))
@@ -692,7 +897,6 @@ def register_routes(app):
     def delete_page(page_id):
         conn = get_db()
         cursor = conn.cursor()
-        cursor.execute('PRAGMA foreign_keys = ON')
         hard_delete_tree(cursor, page_id)
         conn.commit()
         conn.close()
@@ -700,47 +904,44 @@ def register_routes(app):
 
     @app.route('/api/search', methods=['GET'])
     def search():
+        """全文検索（?q=&from=&to=&category=&type=&limit=&cursor=）
+
+        続きがあれば次ページのカーソルを X-Next-Cursor ヘッダーで返す。
+        """
         query = request.args.get('q', '')
         if not query: return jsonify([])
+        dates = {}
+        for arg in ('from', 'to'):
+            value = request.args.get(arg)
+            if value:
+                try:
+                    dates[arg] = datetime.strptime(value, '%Y-%m-%d').strftime('%Y-%m-%d')
+                except ValueError:
+                    return jsonify({'error': f'Invalid {arg} date'}), 400
         conn = get_db()
         cursor = conn.cursor()
-        search_query = f"{query}*"
         try:
-            sql = '''
-                SELECT blocks.id as block_id, blocks.page_id, pages.title as page_title, pages.icon, blocks.content, 
-                       snippet(blocks_fts, 0, '<b>', '</b>', '...', 10) as snippet,
-                       pages.parent_id
-                FROM blocks_fts
-                JOIN blocks ON blocks_fts.rowid = blocks.id
-                JOIN pages ON blocks.page_id = pages.id
-                WHERE blocks_fts MATCH ?
-                ORDER BY rank
-                LIMIT 20
-            '''
-            cursor.execute(sql, (search_query,))
-            results = [dict(row) for row in cursor.fetchall()]
-            
-            for result in results:
-                breadcrumb = []
-                current_id = result.get('parent_id')
-                while current_id:
-                    cursor.execute('SELECT id, title, icon, parent_id FROM pages WHERE id = ?', (current_id,))
-                    parent_row = cursor.fetchone()
-                    if parent_row:
-                        parent_dict = dict(parent_row)
-                        breadcrumb.insert(0, {
-                            'id': parent_dict['id'],
-                            'title': parent_dict['title'],
-                            'icon': parent_dict['icon']
-                        })
-                        current_id = parent_dict['parent_id']
-                    else:
-                        break
-                result['breadcrumb'] = breadcrumb
-        except Exception as e:
-            results = []
+            results, next_cursor = search_blocks(
+                cursor, query,
+                limit=request.args.get('limit', 20, type=int),
+                after=request.args.get('cursor'),
+                date_from=dates.get('from'),
+                date_to=dates.get('to'),
+                category=request.args.get('category'),
+                block_type=request.args.get('type'),
+            )
+        except ValueError as e:
+            conn.close()
+            return jsonify({'error': str(e)}), 400
+
+        ancestors = get_page_cache().ancestor_map(cursor, [result['page_id'] for result in results])
+        for result in results:
+            result['breadcrumb'] = ancestors.get(result['page_id'], [])
         conn.close()
-        return jsonify(results)
+        response = jsonify(results)
+        if next_cursor:
+            response.headers['X-Next-Cursor'] = next_cursor
+        return response
 
     @app.route('/api/ai/query', methods=['POST'])
     def ai_query():
@@ -762,38 +963,26 @@ def register_routes(app):
             matched_activity = next((t for t in activity_titles if t in query), None)
             if matched_activity:
                 cursor.execute('''
-                    SELECT p.id, p.parent_id, parent.title as parent_title
+                    SELECT DISTINCT parent.journal_date
                     FROM pages p
                     JOIN pages parent ON parent.id = p.parent_id
                     WHERE p.title = ? AND p.is_deleted = 0 AND parent.is_deleted = 0
-                ''', (matched_activity,))
-                rows = cursor.fetchall()
-
-                date_titles = []
-                for row in rows:
-                    parent_title = row['parent_title'] or ''
-                    if not re.match(r'^\d{4}年\d{1,2}月\d{1,2}日$', parent_title):
-                        continue
-                    cursor.execute('''
+                      AND parent.journal_date IS NOT NULL
+                      AND EXISTS (
                         SELECT 1 FROM blocks
-                        WHERE page_id = ? AND (
+                        WHERE blocks.page_id = p.id AND (
                             (content IS NOT NULL AND TRIM(content) != '') OR
                             (details IS NOT NULL AND TRIM(details) != '') OR
                             checked = 1 OR
                             (props IS NOT NULL AND TRIM(props) NOT IN ('', '{}'))
                         )
-                        LIMIT 1
-                    ''', (row['id'],))
-                    if cursor.fetchone():
-                        date_titles.append(parent_title)
-
-                def _date_key(title):
-                    m = re.match(r'^(\d{4})年(\d{1,2})月(\d{1,2})日$', title)
-                    if not m:
-                        return (9999, 99, 99)
-                    return (int(m.group(1)), int(m.group(2)), int(m.group(3)))
-
-                date_titles = sorted(set(date_titles), key=_date_key)
+                      )
+                    ORDER BY parent.journal_date
+                ''', (matched_activity,))
+                date_titles = [
+                    journal_title(datetime.strptime(row['journal_date'], '%Y-%m-%d'))
+                    for row in cursor.fetchall()
+                ]
                 if date_titles:
                     conn.close()
                     return jsonify({'answer': f"{matched_activity}した日: " + '、'.join(date_titles)})
@@ -807,130 +996,37 @@ def register_routes(app):
             keywords = [t for t in re.split(r'\s+', q) if t]
 
             if keywords:
-                date_titles = set()
+                journal_dates = set()
                 for keyword in keywords:
-                    pattern = f"%{keyword}%"
-                    cursor.execute('''
-                        SELECT blocks.page_id, pages.title as page_title, pages.parent_id
-                        FROM blocks
-                        JOIN pages ON blocks.page_id = pages.id
-                        WHERE blocks.content LIKE ?
-                           OR blocks.details LIKE ?
-                           OR blocks.props LIKE ?
-                           OR pages.title LIKE ?
-                        LIMIT 200
-                    ''', (pattern, pattern, pattern, pattern))
-                    rows = cursor.fetchall()
-                    for row in rows:
-                        page_title = row['page_title'] or ''
-                        parent_id = row['parent_id']
-                        if re.match(r'^\d{4}年\d{1,2}月\d{1,2}日$', page_title):
-                            date_titles.add(page_title)
-                            continue
-                        current_id = parent_id
-                        while current_id:
-                            cursor.execute('SELECT title, parent_id FROM pages WHERE id = ?', (current_id,))
-                            parent_row = cursor.fetchone()
-                            if not parent_row:
-                                break
-                            parent_title = parent_row['title'] or ''
-                            if re.match(r'^\d{4}年\d{1,2}月\d{1,2}日$', parent_title):
-                                date_titles.add(parent_title)
-                                break
-                            current_id = parent_row['parent_id']
-
-                if date_titles:
-                    def _date_key(title):
-                        m = re.match(r'^(\d{4})年(\d{1,2})月(\d{1,2})日$', title)
-                        if not m:
-                            return (9999, 99, 99)
-                        return (int(m.group(1)), int(m.group(2)), int(m.group(3)))
-                    sorted_dates = sorted(date_titles, key=_date_key)
+                    hits, _ = search_blocks(cursor, [keyword], limit=200)
+                    journal_dates.update(hit['journal_date'] for hit in hits if hit['journal_date'])
+
+                if journal_dates:
+                    sorted_dates = [
+                        journal_title(datetime.strptime(d, '%Y-%m-%d'))
+                        for d in sorted(journal_dates)
+                    ]
                     conn.close()
                     return jsonify({'answer': '該当しそうな日: ' + '、'.join(sorted_dates)})
-        results = []
-        try:
-            search_query = f"{query}*"
-            sql = '''
-                SELECT blocks.id as block_id, blocks.page_id, pages.title as page_title, pages.icon, blocks.content,
-                       snippet(blocks_fts, 0, '<b>', '</b>', '...', 10) as snippet,
-                       pages.parent_id
-                FROM blocks_fts
-                JOIN blocks ON blocks_fts.rowid = blocks.id
-                JOIN pages ON blocks.page_id = pages.id
-                WHERE blocks_fts MATCH ?
-                ORDER BY rank
-                LIMIT 30
-            '''
-            cursor.execute(sql, (search_query,))
-            results = [dict(row) for row in cursor.fetchall()]
-        except Exception:
-            results = []
-
-        if not results:
-            terms = [t for t in re.split(r'\s+', query) if t]
-            like_terms = terms if terms else [query]
-            like_sql = '''
-                SELECT blocks.id as block_id, blocks.page_id, pages.title as page_title, pages.icon, blocks.content,
-                       '' as snippet,
-                       pages.parent_id
-                FROM blocks
-                JOIN pages ON blocks.page_id = pages.id
-                WHERE blocks.content LIKE ? OR pages.title LIKE ?
-                ORDER BY pages.updated_at DESC
-                LIMIT 50
-            '''
-            combined = []
-            for term in like_terms:
-                pattern = f"%{term}%"
-                cursor.execute(like_sql, (pattern, pattern))
-                combined.extend([dict(row) for row in cursor.fetchall()])
-            seen = set()
-            results = []
-            for row in combined:
-                key = row.get('block_id') or row.get('page_id')
-                if key in seen:
-                    continue
-                seen.add(key)
-                results.append(row)
+        terms = split_terms(query)
+        results, _ = search_blocks(cursor, terms, limit=50, match_any=True)
 
         page_candidates = []
         if len(results) < 5:
-            terms = [t for t in re.split(r'\s+', query) if t]
-            like_terms = terms if terms else [query]
-            for term in like_terms[:5]:
-                pattern = f"%{term}%"
-                cursor.execute('''
-                    SELECT id, title, icon, parent_id
-                    FROM pages
-                    WHERE is_deleted = 0 AND title LIKE ?
-                    ORDER BY updated_at DESC
-                    LIMIT 10
-                ''', (pattern,))
-                page_candidates.extend([dict(row) for row in cursor.fetchall()])
-
-        for result in results:
-            breadcrumb = []
-            current_id = result.get('parent_id')
-            while current_id:
-                cursor.execute('SELECT id, title, icon, parent_id FROM pages WHERE id = ?', (current_id,))
-                parent_row = cursor.fetchone()
-                if parent_row:
-                    parent_dict = dict(parent_row)
-                    breadcrumb.insert(0, {
-                        'id': parent_dict['id'],
-                        'title': parent_dict['title'],
-                        'icon': parent_dict['icon']
-                    })
-                    current_id = parent_dict['parent_id']
-                else:
-                    break
-            result['breadcrumb'] = breadcrumb
+            page_candidates = search_pages(cursor, terms[:5], limit=20)
 
         if not results:
             conn.close()
             return jsonify({'answer': '見つかりませんでした。'}), 200
 
+        # 検索結果と候補ページのパンくずをページツリーのキャッシュから取得
+        ancestors = get_page_cache().ancestor_map(
+            cursor,
+            [result.get('page_id') for result in results] + [page.get('id') for page in page_candidates]
+        )
+        for result in results:
+            result['breadcrumb'] = ancestors.get(result.get('page_id'), [])
+
         max_context_len = 12000
         context_lines = []
 
@@ -978,18 +1074,9 @@ def register_routes(app):
             if not page_row:
                 continue
             page = dict(page_row)
-            breadcrumb = []
-            current_id = page.get('parent_id')
-            while current_id:
-                cursor.execute('SELECT id, title, icon, parent_id FROM pages WHERE id = ?', (current_id,))
-                parent_row = cursor.fetchone()
-                if parent_row:
-                    parent_dict = dict(parent_row)
-                    breadcrumb.insert(0, f"{parent_dict['icon']} {parent_dict['title']}")
-                    current_id = parent_dict['parent_id']
-                else:
-                    break
-            breadcrumb_text = ' / '.join(breadcrumb)
+            breadcrumb_text = ' / '.join(
+                f"{b['icon']} {b['title']}" for b in ancestors.get(page_id, [])
+            )
             header = f"- {page.get('icon', '')} {page.get('title', '')}"
             if breadcrumb_text:
                 header = f"{header} ({breadcrumb_text})"
@@ -1087,68 +1174,12 @@ def register_routes(app):
         if last_user:
             conn = get_db()
             cursor = conn.cursor()
-            results = []
-            try:
-                search_query = f"{last_user}*"
-                sql = '''
-                    SELECT blocks.id as block_id, blocks.page_id, pages.title as page_title, pages.icon, blocks.content,
-                           snippet(blocks_fts, 0, '<b>', '</b>', '...', 10) as snippet,
-                           pages.parent_id
-                    FROM blocks_fts
-                    JOIN blocks ON blocks_fts.rowid = blocks.id
-                    JOIN pages ON blocks.page_id = pages.id
-                    WHERE blocks_fts MATCH ?
-                    ORDER BY rank
-                    LIMIT 15
-                '''
-                cursor.execute(sql, (search_query,))
-                results = [dict(row) for row in cursor.fetchall()]
-            except Exception:
-                results = []
-
-            if not results:
-                terms = [t for t in re.split(r'\s+', last_user) if t]
-                like_sql = '''
-                    SELECT blocks.id as block_id, blocks.page_id, pages.title as page_title, pages.icon, blocks.content,
-                           '' as snippet,
-                           pages.parent_id
-                    FROM blocks
-                    JOIN pages ON blocks.page_id = pages.id
-                    WHERE blocks.content LIKE ? OR pages.title LIKE ?
-                    ORDER BY pages.updated_at DESC
-                    LIMIT 20
-                '''
-                combined = []
-                for term in terms[:5]:
-                    pattern = f"%{term}%"
-                    cursor.execute(like_sql, (pattern, pattern))
-                    combined.extend([dict(row) for row in cursor.fetchall()])
-                seen = set()
-                results = []
-                for row in combined:
-                    key = row.get('block_id') or row.get('page_id')
-                    if key in seen:
-                        continue
-                    seen.add(key)
-                    results.append(row)
+            results, _ = search_blocks(cursor, last_user, limit=20, match_any=True)
 
             context_lines = []
+            ancestors = get_page_cache().ancestor_map(cursor, [result['page_id'] for result in results])
             for result in results:
-                breadcrumb = []
-                current_id = result.get('parent_id')
-                while current_id:
-                    cursor.execute('SELECT id, title, icon, parent_id FROM pages WHERE id = ?', (current_id,))
-                    parent_row = cursor.fetchone()
-                    if parent_row:
-                        parent_dict = dict(parent_row)
-                        breadcrumb.insert(0, {
-                            'id': parent_dict['id'],
-                            'title': parent_dict['title'],
-                            'icon': parent_dict['icon']
-                        })
-                        current_id = parent_dict['parent_id']
-                    else:
-                        break
+                breadcrumb = ancestors.get(result['page_id'], [])
                 breadcrumb_text = ' / '.join([f"{b['icon']} {b['title']}" for b in breadcrumb])
                 page_title = result.get('page_title') or ''
                 snippet = result.get('snippet') or result.get('content') or ''
@@ -1293,6 +1324,13 @@ def register_routes(app):
         cursor = conn.cursor()
         if data.get('position') is not None:
             new_pos = float(data.get('position'))
+        elif 'after_id' in data:
+            # after_id の直後に挿入（null なら先頭）
+            try:
+                new_pos = position_after(cursor, 'blocks', page_id, data.get('after_id'))
+            except ValueError as e:
+                conn.close()
+                return jsonify({'error': str(e)}), 400
         else:
             new_pos = get_block_next_position(cursor, page_id)
         cursor.execute('INSERT INTO blocks (page_id, type, content, checked, position, props) VALUES (?, ?, ?, ?, ?, ?)',
@@ -1304,30 +1342,38 @@ def register_routes(app):
         conn.close()
         return jsonify(block)
 
-    @app.route('/api/blocks/<int:block_id>', methods=['PUT'])
-    def update_block(block_id):
-        data = request.json
+    @app.route('/api/pages/<int:page_id>/blocks/reorder', methods=['POST'])
+    def reorder_blocks(page_id):
+        """ページ内のブロックを block_ids の順に並べ替える（1トランザクション）"""
+        data = request.json or {}
+        block_ids = data.get('block_ids')
+        if not isinstance(block_ids, list) or not all(isinstance(i, int) for i in block_ids):
+            return jsonify({'error': 'block_ids must be a list of block IDs'}), 400
+
         conn = get_db()
         cursor = conn.cursor()
-        updates = []
-        values = []
-        fields = ['type', 'content', 'checked', 'position', 'collapsed', 'details', 'props']
-        for field in fields:
-            if field in data:
-                updates.append(f'{field} = ?')
-                values.append(data[field])
-        if updates:
-            updates.append('updated_at = CURRENT_TIMESTAMP')
-            values.append(block_id)
-            cursor.execute(f'UPDATE blocks SET {", ".join(updates)} WHERE id = ?', values)
-            conn.commit()
-        cursor.execute('SELECT * FROM blocks WHERE id = ?', (block_id,))
-        row = cursor.fetchone()
-        if not row:
+        try:
+            positions = apply_order(cursor, 'blocks', page_id, block_ids)
+        except ValueError as e:
+            conn.rollback()
             conn.close()
-            return jsonify({'error': 'Block not found'}), 404
-        block = dict(row)
+            return jsonify({'error': str(e)}), 400
+        conn.commit()
         conn.close()
+        return jsonify([{'id': block_id, 'position': position} for block_id, position in positions])
+
+    @app.route('/api/blocks/<int:block_id>', methods=['PUT'])
+    def update_block(block_id):
+        data = request.json
+        updates = {field: data[field] for field in BLOCK_FIELDS if field in data}
+        try:
+            block = submit_update('blocks', block_id, updates)
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 400
+        except TimeoutError as e:
+            return jsonify({'error': str(e)}), 503
+        if block is None:
+            return jsonify({'error': 'Block not found'}), 404
         
         import time
         current_time = time.time()
@@ -1338,6 +1384,66 @@ def register_routes(app):
         
         return jsonify(block)
 
+    @app.route('/api/write-queue/metrics', methods=['GET'])
+    def write_queue_metrics():
+        """書き込みキューの深さとコミット時間"""
+        write_queue = get_write_queue()
+        if write_queue is None:
+            return jsonify({'running': False, 'queue_depth': 0})
+        return jsonify(write_queue.metrics())
+
+    @app.route('/api/changes', methods=['GET'])
+    def list_changes():
+        """前回のカーソル以降に変わったページ/ブロック/テンプレート（?since=&limit=&tables=）
+
+        同じ行の変更は最新の1件にまとめて返す（upsert は行の内容付き、削除は墓標）。
+        has_more が true なら next_cursor を since にしてもう一度呼ぶ。
+        """
+        tables = CHANGE_TABLES
+        if request.args.get('tables'):
+            tables = tuple(t for t in request.args['tables'].split(',') if t)
+            if not tables or any(t not in CHANGE_TABLES for t in tables):
+                return jsonify({'error': f'tables must be some of {", ".join(CHANGE_TABLES)}'}), 400
+
+        conn = get_db()
+        cursor = conn.cursor()
+        try:
+            # ログと行を同じスナップショットから読む
+            cursor.execute('BEGIN')
+            changes, next_cursor, has_more = get_changes(
+                cursor, request.args.get('since'),
+                limit=request.args.get('limit', 500, type=int), tables=tables
+            )
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 400
+        finally:
+            conn.rollback()
+            conn.close()
+        return jsonify({'changes': changes, 'next_cursor': next_cursor, 'has_more': has_more})
+
+    @app.route('/api/batch', methods=['POST'])
+    def batch_operations():
+        """ページ/ブロックの create / update / delete / move をまとめて1トランザクションで実行
+
+        body: {"operations": [{"op": "create", "type": "block", "temp_id": "tmp-1",
+                               "page_id": 12, "after_id": 34, "data": {...}}, ...]}
+        後の操作の id / page_id / parent_id / after_id には、先に作成した temp_id を使える。
+        1件でも失敗したら全体をロールバックし、失敗した操作の index を返す。
+        自動保存の PUT と同じく書き込みキュー（書き込みスレッド）を通して実行する。
+        """
+        data = request.json or {}
+        operations = data.get('operations')
+        if not isinstance(operations, list):
+            return jsonify({'error': 'operations must be a list'}), 400
+
+        try:
+            results, id_map = submit_transaction(lambda cursor: apply_batch(cursor, operations))
+        except BatchError as e:
+            return jsonify({'error': e.message, 'index': e.index}), 400
+        except TimeoutError as e:
+            return jsonify({'error': str(e)}), 503
+        return jsonify({'results': results, 'id_map': id_map})
+
     @app.route('/api/pages/<int:page_id>/mood', methods=['PUT'])
     def update_page_mood(page_id):
         """ページの感情（ムード）を更新"""
@@ -1425,66 +1531,8 @@ def register_routes(app):
 
         conn = get_db()
         cursor = conn.cursor()
-
-        cursor.execute('SELECT id, title, parent_id FROM pages WHERE id = ?', (current_page_id,))
-        row = cursor.fetchone()
-        if not row:
-            conn.close()
-            return jsonify({'prev_page': None, 'delta': None})
-
-        page = dict(row)
-        date_title = page.get('title') or ''
-        date_page_id = page['id']
-
-        if not re.match(r'\d{4}年\d{1,2}月\d{1,2}日', date_title):
-            if page.get('parent_id'):
-                cursor.execute('SELECT id, title FROM pages WHERE id = ?', (page['parent_id'],))
-                parent = cursor.fetchone()
-                if parent:
-                    date_page_id = parent['id']
-                    date_title = parent['title'] or ''
-
-        match = re.match(r'(\d{4})年(\d{1,2})月(\d{1,2})日', date_title)
-        if not match:
-            conn.close()
-            return jsonify({'prev_page': None, 'delta': None})
-
-        year, month, day = map(int, match.groups())
-        prev_date = datetime(year, month, day) - timedelta(days=1)
-        prev_title = f"{prev_date.year}年{prev_date.month}月{prev_date.day}日"
-
-        cursor.execute('SELECT id FROM pages WHERE title = ? AND is_deleted = 0 LIMIT 1', (prev_title,))
-        prev_date_row = cursor.fetchone()
-        if not prev_date_row:
-            conn.close()
-            return jsonify({'prev_page': None, 'delta': None})
-
-        target_page_id = prev_date_row['id']
-        if page.get('parent_id') and page.get('parent_id') != target_page_id:
-            cursor.execute(
-                'SELECT id FROM pages WHERE parent_id = ? AND title = ? AND is_deleted = 0 ORDER BY position LIMIT 1',
-                (target_page_id, page.get('title'))
-            )
-            child = cursor.fetchone()
-            if not child:
-                conn.close()
-                return jsonify({'prev_page': None, 'delta': None})
-            target_page_id = child['id']
-
-        cursor.execute(
-            'SELECT props FROM blocks WHERE page_id = ? AND type = ? AND props IS NOT NULL',
-            (target_page_id, 'book')
-        )
-        prev_value = None
-        for block_row in cursor.fetchall():
-            try:
-                props = json.loads(block_row['props'] or '{}')
-            except Exception:
-                props = {}
-            if (props.get('title') or '').strip() == title:
-                prev_value = props.get('currentPage')
-                break
-
+        journal_date = get_journal_date(cursor, current_page_id)
+        prev_value = get_previous_day_progress(cursor, title, journal_date) if journal_date else None
         conn.close()
         if prev_value is None:
             return jsonify({'prev_page': None, 'delta': None})
@@ -1498,6 +1546,24 @@ def register_routes(app):
 
         return jsonify({'prev_page': prev_value, 'delta': delta})
 
+    @app.route('/api/books/<path:title>/history', methods=['GET'])
+    def get_book_history_route(title):
+        """本の日ごとのページ数・差分と集計（?from=&to= は journal_date、YYYY-MM-DD）"""
+        dates = {}
+        for arg in ('from', 'to'):
+            value = request.args.get(arg)
+            if value:
+                try:
+                    value = datetime.strptime(value, '%Y-%m-%d').strftime('%Y-%m-%d')
+                except ValueError:
+                    return jsonify({'error': f'Invalid {arg} date'}), 400
+            dates[arg] = value or None
+
+        conn = get_db()
+        history = get_book_history(conn.cursor(), title.strip(), dates['from'], dates['to'])
+        conn.close()
+        return jsonify(history)
+
     @app.route('/api/upload', methods=['POST'])
     def upload_file():
         if 'file' not in request.files: return jsonify({'error': 'No file'}), 400
@@ -1518,8 +1584,7 @@ def register_routes(app):
             conn.close()
             return jsonify({'success': True, 'file_url': file_url, 'type': 'cover'})
         elif page_id:
-            cursor.execute('SELECT MAX(position) FROM blocks WHERE page_id = ?', (page_id,))
-            new_pos = (cursor.fetchone()[0] or -1) + 1
+            new_pos = get_block_next_position(cursor, page_id)
             block_type = 'image' if filename.rsplit('.', 1)[1].lower() in {'png', 'jpg', 'jpeg', 'gif', 'webp'} else 'file'
             cursor.execute('INSERT INTO blocks (page_id, type, content, position) VALUES (?, ?, ?, ?)',
                            (page_id, block_type, file_url, new_pos))
@@ -1528,53 +1593,46 @@ def register_routes(app):
             return jsonify({'success': True, 'file_url': file_url, 'block_type': block_type})
         return jsonify({'error': 'Page ID missing'}), 400
 
+    def streamed_export(page_id, jsonl):
+        """JSON / JSON Lines のエクスポートをストリームで返す（page_id なしなら全ページ）"""
+        filename = 'diary_export'
+        if page_id is not None:
+            conn = get_db()
+            cursor = conn.cursor()
+            cursor.execute('SELECT title FROM pages WHERE id = ?', (page_id,))
+            page = cursor.fetchone()
+            conn.close()
+            if not page:
+                return jsonify({'error': 'Page not found'}), 404
+            filename = page['title'] or 'page'
+
+        if jsonl:
+            body, mimetype, ext = stream_jsonl(page_id), 'application/x-ndjson', 'jsonl'
+        else:
+            body, mimetype, ext = stream_json(page_id), 'application/json', 'json'
+        response = Response(stream_with_context(body), mimetype=mimetype)
+        attachment_headers(response.headers, f"{filename}_{datetime.now().strftime('%Y%m%d_%H%M%S')}.{ext}")
+        return response
+
     @app.route('/api/export/all/json', methods=['GET'])
     def export_all_json():
-        """全ページをJSON形式でエクスポート"""
-        conn = get_db()
-        cursor = conn.cursor()
-        cursor.execute('SELECT * FROM pages WHERE is_deleted = 0 AND parent_id IS NULL ORDER BY position')
-        root_pages = [export_page_to_dict(cursor, row['id']) for row in cursor.fetchall()]
-        conn.close()
-        
-        export_data = {
-            'version': '1.0',
-            'exported_at': datetime.now().isoformat(),
-            'pages': root_pages
-        }
-        
-        response = send_file(
-            io.BytesIO(json.dumps(export_data, ensure_ascii=False, indent=2).encode('utf-8')),
-            mimetype='application/json',
-            as_attachment=True,
-            download_name=f"diary_export_{datetime.now().strftime('%Y%m%d_%H%M%S')}.json"
-        )
-        return response
+        """全ページをJSON形式でエクスポート（ストリーム）"""
+        return streamed_export(None, False)
+
+    @app.route('/api/export/all/jsonl', methods=['GET'])
+    def export_all_jsonl():
+        """全ページを JSON Lines（1行1ページ）でエクスポート（ストリーム）"""
+        return streamed_export(None, True)
 
     @app.route('/api/export/pages/<int:page_id>/json', methods=['GET'])
     def export_page_json(page_id):
-        """指定ページをJSON形式でエクスポート"""
-        conn = get_db()
-        cursor = conn.cursor()
-        page = export_page_to_dict(cursor, page_id)
-        conn.close()
-        
-        if not page:
-            return jsonify({'error': 'Page not found'}), 404
-        
-        export_data = {
-            'version': '1.0',
-            'exported_at': datetime.now().isoformat(),
-            'page': page
-        }
-        
-        response = send_file(
-            io.BytesIO(json.dumps(export_data, ensure_ascii=False, indent=2).encode('utf-8')),
-            mimetype='application/json',
-            as_attachment=True,
-            download_name=f"{page.get('title', 'page')}_{datetime.now().strftime('%Y%m%d_%H%M%S')}.json"
-        )
-        return response
+        """指定ページをJSON形式でエクスポート（ストリーム）"""
+        return streamed_export(page_id, False)
+
+    @app.route('/api/export/pages/<int:page_id>/jsonl', methods=['GET'])
+    def export_page_jsonl(page_id):
+        """指定ページを JSON Lines（1行1ページ）でエクスポート（ストリーム）"""
+        return streamed_export(page_id, True)
 
     @app.route('/api/export/pages/<int:page_id>/markdown', methods=['GET'])
     def export_page_markdown(page_id):
@@ -1599,157 +1657,105 @@ def register_routes(app):
 
     @app.route('/api/export/pages/<int:page_id>/zip', methods=['GET'])
     def export_page_zip(page_id):
-        """指定ページを添付ファイル含めZIP化してエクスポート"""
-        conn = get_db()
-        cursor = conn.cursor()
-        page = export_page_to_dict(cursor, page_id)
-        conn.close()
-        
-        if not page:
+        """指定ページを添付ファイル含めZIP化してエクスポート（書いたそばから送る）"""
+        manifest = zip_manifest(page_id, UPLOAD_FOLDER)
+        if manifest is None:
             return jsonify({'error': 'Page not found'}), 404
-        
-        zip_buffer = io.BytesIO()
-        
-        def add_page_to_zip(z, pg, prefix=''):
-            """ページとその子ページを再帰的にZIPに追加"""
-            page_dir = f"{prefix}{pg.get('title', '無題')}_[{pg['id']}]"
-            
-            md_content = page_to_markdown(pg, level=1)
-            z.writestr(f"{page_dir}/page.md", md_content.encode('utf-8'))
-            
-            metadata = {
-                'id': pg['id'],
-                'title': pg.get('title', ''),
-                'icon': pg.get('icon', ''),
-                'created_at': pg.get('created_at', ''),
-                'updated_at': pg.get('updated_at', '')
-            }
-            z.writestr(f"{page_dir}/metadata.json", json.dumps(metadata, ensure_ascii=False, indent=2).encode('utf-8'))
-            
-            for block in pg.get('blocks', []):
-                if block.get('type') in ['image', 'file']:
-                    file_path = block.get('content', '')
-                    if file_path and file_path.startswith('/uploads/'):
-                        filename = file_path.split('/')[-1]
-                        full_path = os.path.join(UPLOAD_FOLDER, filename)
-                        if os.path.exists(full_path):
-                            z.write(full_path, f"{page_dir}/files/{filename}")
-            
-            for child in pg.get('children', []):
-                add_page_to_zip(z, child, f"{page_dir}/")
-        
-        with zipfile.ZipFile(zip_buffer, 'w', zipfile.ZIP_DEFLATED) as zf:
-            add_page_to_zip(zf, page)
-        
-        zip_buffer.seek(0)
-        response = send_file(
-            zip_buffer,
-            mimetype='application/zip',
-            as_attachment=True,
-            download_name=f"{page.get('title', 'page')}_{datetime.now().strftime('%Y%m%d_%H%M%S')}.zip"
-        )
+
+        page, entries = manifest
+        response = Response(stream_with_context(stream_zip(entries)), mimetype='application/zip')
+        attachment_headers(response.headers, f"{page['title'] or 'page'}_{datetime.now().strftime('%Y%m%d_%H%M%S')}.zip")
         return response
 
     @app.route('/api/import/json', methods=['POST'])
     def import_json():
-        """JSONファイルをインポート"""
+        """JSON / JSON Lines ファイルをインポート（ストリームで読み、1トランザクションでまとめて挿入）"""
         if 'file' not in request.files:
             return jsonify({'error': 'No file provided'}), 400
-        
+
         file = request.files['file']
-        if file.filename == '' or not file.filename.endswith('.json'):
+        jsonl = file.filename.endswith(('.jsonl', '.ndjson'))
+        if file.filename == '' or not (file.filename.endswith('.json') or jsonl):
             return jsonify({'error': 'Invalid file format, expected JSON'}), 400
-        
-        try:
-            import_data = json.loads(file.read().decode('utf-8'))
-        except Exception as e:
-            return jsonify({'error': f'Failed to parse JSON: {str(e)}'}), 400
-        
+
+        def report(pages, blocks):
+            app.logger.info('Import: %d pages / %d blocks', pages, blocks)
+
         conn = get_db()
         cursor = conn.cursor()
-        
         try:
-            imported_ids = []
-            
-            pages_to_import = import_data.get('pages', [])
-            if import_data.get('page'):
-                pages_to_import = [import_data.get('page')]
-            
-            for page_dict in pages_to_import:
-                new_id = create_page_from_dict(cursor, page_dict)
-                imported_ids.append(new_id)
-            
+            cursor.execute('BEGIN IMMEDIATE')
+            with PageImporter(cursor, on_progress=report) as importer:
+                for page_dict in iter_pages(file.stream, jsonl=jsonl):
+                    importer.add(page_dict)
             conn.commit()
-            conn.close()
-            
-            return jsonify({
-                'success': True,
-                'message': f'{len(imported_ids)} page(s) imported',
-                'imported_ids': imported_ids
-            })
+        except ValueError as e:
+            # 壊れた JSON（JSONDecodeError も ValueError）
+            conn.rollback()
+            return jsonify({'error': f'Failed to parse JSON: {str(e)}'}), 400
         except Exception as e:
             conn.rollback()
-            conn.close()
             return jsonify({'error': f'Import failed: {str(e)}'}), 500
+        finally:
+            conn.close()
+
+        return jsonify({
+            'success': True,
+            'message': f'{len(importer.root_ids)} page(s) imported',
+            'imported_ids': importer.root_ids,
+            'pages': importer.page_count,
+            'blocks': importer.block_count
+        })
 
     @app.route('/api/import/zip', methods=['POST'])
     def import_zip():
-        """ZIPファイルをインポート"""
+        """ZIPファイルをインポート（子ページ・ブロックの種類・添付も戻し、1トランザクションでまとめて挿入）"""
         if 'file' not in request.files:
             return jsonify({'error': 'No file provided'}), 400
-        
+
         file = request.files['file']
         if file.filename == '' or not file.filename.endswith('.zip'):
             return jsonify({'error': 'Invalid file format, expected ZIP'}), 400
-        
+
+        try:
+            zf = zipfile.ZipFile(file.stream)
+        except zipfile.BadZipFile:
+            return jsonify({'error': 'Invalid ZIP file'}), 400
+
+        # 添付のコピー・markdown の解析は書き込みロックを取る前に済ませる
+        reader = ZipPageReader(zf, UPLOAD_FOLDER)
+        try:
+            with zf:
+                roots = reader.read()
+        except Exception as e:
+            reader.discard()
+            return jsonify({'error': f'ZIP import failed: {str(e)}'}), 400
+        if not roots:
+            return jsonify({'error': 'No valid ZIP structure found'}), 400
+
         conn = get_db()
         cursor = conn.cursor()
-        
         try:
-            with zipfile.ZipFile(io.BytesIO(file.read()), 'r') as zf:
-                metadata_files = [f for f in zf.namelist() if f.endswith('metadata.json') and f.count('/') == 1]
-                
-                if not metadata_files:
-                    return jsonify({'error': 'No valid ZIP structure found'}), 400
-                
-                imported_ids = []
-                
-                for metadata_file in metadata_files:
-                    metadata = json.loads(zf.read(metadata_file).decode('utf-8'))
-                    
-                    cursor.execute('SELECT MAX(position) FROM pages WHERE parent_id IS NULL')
-                    max_pos = cursor.fetchone()[0]
-                    position = (max_pos if max_pos is not None else -1) + 1
-                    
-                    cursor.execute(
-                        'INSERT INTO pages (title, icon, parent_id, position) VALUES (?, ?, ?, ?)',
-                        (metadata.get('title', ''), metadata.get('icon', '📄'), None, position)
-                    )
-                    new_page_id = cursor.lastrowid
-                    imported_ids.append(new_page_id)
-                    
-                    page_dir = metadata_file.split('/')[0]
-                    page_md_path = f"{page_dir}/page.md"
-                    
-                    if page_md_path in zf.namelist():
-                        md_content = zf.read(page_md_path).decode('utf-8')
-                        cursor.execute(
-                            "INSERT INTO blocks (page_id, type, content, position) VALUES (?, 'text', ?, 0)",
-                            (new_page_id, md_content)
-                        )
-            
+            cursor.execute('BEGIN IMMEDIATE')
+            with PageImporter(cursor) as importer:
+                for page_dict in roots:
+                    importer.add(page_dict)
             conn.commit()
-            conn.close()
-            
-            return jsonify({
-                'success': True,
-                'message': f'{len(imported_ids)} page(s) imported from ZIP',
-                'imported_ids': imported_ids
-            })
         except Exception as e:
             conn.rollback()
-            conn.close()
+            reader.discard()
             return jsonify({'error': f'ZIP import failed: {str(e)}'}), 500
+        finally:
+            conn.close()
+
+        return jsonify({
+            'success': True,
+            'message': f'{len(importer.root_ids)} page(s) imported from ZIP',
+            'imported_ids': importer.root_ids,
+            'pages': importer.page_count,
+            'blocks': importer.block_count,
+            'files': reader.file_count
+        })
 
     @app.route('/api/templates', methods=['GET'])
     def get_templates():
@@ -1844,43 +1850,13 @@ def register_routes(app):
         
         template = dict(template_row)
         content = json.loads(template['content_json'])
-        
-        new_pos = get_next_position(cursor, None)
-        cursor.execute(
-            'INSERT INTO pages (title, icon, parent_id, position) VALUES (?, ?, ?, ?)',
-            (content.get('title', template['name']), template['icon'], None, new_pos)
-        )
-        page_id = cursor.lastrowid
-        
-        for i, block in enumerate(content.get('blocks', [])):
-            cursor.execute(
-                'INSERT INTO blocks (page_id, type, content, checked, position, collapsed, details, props) VALUES (?, ?, ?, ?, ?, ?, ?, ?)',
-                (
-                    page_id,
-                    block.get('type', 'text'),
-                    block.get('content', ''),
-                    block.get('checked', 0),
-                    (i + 1) * 1000.0,
-                    block.get('collapsed', 0),
-                    block.get('details', ''),
-                    block.get('props', '{}')
-                )
-            )
-        
-        for i, child in enumerate(content.get('children', [])):
-            child_pos = (i + 1) * 1000.0
-            cursor.execute(
-                'INSERT INTO pages (title, icon, parent_id, position) VALUES (?, ?, ?, ?)',
-                (child.get('title', ''), child.get('icon', '📄'), page_id, child_pos)
-            )
-            child_id = cursor.lastrowid
-            
-            for j, block in enumerate(child.get('blocks', [])):
-                cursor.execute(
-                    'INSERT INTO blocks (page_id, type, content, checked, position, props) VALUES (?, ?, ?, ?, ?, ?)',
-                    (child_id, block.get('type', 'text'), block.get('content', ''), block.get('checked', 0), (j + 1) * 1000.0, '{}')
-                )
-        
+        page_id = insert_tree(cursor, {
+            'title': content.get('title', template['name']),
+            'icon': template['icon'],
+            'blocks': content.get('blocks', []),
+            'children': content.get('children', []),
+        })
+
         conn.commit()
         cursor.execute('SELECT * FROM pages WHERE id = ?', (page_id,))
         page = dict(cursor.fetchone())
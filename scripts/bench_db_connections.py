@@ -0,0 +1,117 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+DB接続のベンチマーク
+
+1リクエストで複数のヘルパー（ユーザー取得・トークン取得・ページ一覧）を呼ぶ
+典型的なリクエストを Flask のテストクライアントで再現し、
+- 旧方式: 呼び出し毎に sqlite3.connect() / close()
+- 新方式: database.get_db() によるリクエスト単位の共有接続 + PRAGMA
+の1リクエストあたりのレイテンシを比較する。
+
+使い方:
+    python scripts/bench_db_connections.py --requests 2000 --pages 2000
+"""
+
+import argparse
+import os
+import sqlite3
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from flask import Flask, jsonify  # noqa: E402
+
+import database  # noqa: E402
+
+
+def legacy_get_db():
+    """変更前の get_db() と同じ（毎回新規接続）"""
+    conn = sqlite3.connect(database.DATABASE)
+    conn.row_factory = sqlite3.Row
+    return conn
+
+
+def seed(page_count):
+    conn = database.get_db()
+    cursor = conn.cursor()
+    cursor.execute("INSERT INTO users (username, password_hash) VALUES ('bench', 'x')")
+    cursor.executemany(
+        'INSERT INTO pages (title, icon, parent_id, position) VALUES (?, ?, NULL, ?)',
+        [(f'page {i}', '📄', i * 1000.0) for i in range(page_count)]
+    )
+    conn.commit()
+    conn.close()
+
+
+def build_app(connect):
+    app = Flask(__name__)
+    database.register_db_teardown(app)
+
+    def helper_user():
+        conn = connect()
+        row = conn.execute('SELECT * FROM users WHERE id = 1').fetchone()
+        conn.close()
+        return row
+
+    def helper_token():
+        conn = connect()
+        row = conn.execute('SELECT * FROM healthplanet_tokens ORDER BY id DESC LIMIT 1').fetchone()
+        conn.close()
+        return row
+
+    @app.route('/bench')
+    def bench():
+        helper_user()
+        helper_token()
+        conn = connect()
+        rows = conn.execute(
+            'SELECT id, title FROM pages WHERE is_deleted = 0 ORDER BY parent_id, position LIMIT 50'
+        ).fetchall()
+        conn.close()
+        return jsonify(len(rows))
+
+    return app
+
+
+def measure(app, requests):
+    client = app.test_client()
+    for _ in range(50):
+        client.get('/bench')
+    timings = []
+    for _ in range(requests):
+        start = time.perf_counter()
+        client.get('/bench')
+        timings.append(time.perf_counter() - start)
+    timings.sort()
+    return {
+        'mean_ms': sum(timings) / len(timings) * 1000,
+        'p50_ms': timings[len(timings) // 2] * 1000,
+        'p95_ms': timings[int(len(timings) * 0.95)] * 1000,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description='DB接続方式ごとのリクエストレイテンシを計測')
+    parser.add_argument('--requests', type=int, default=2000)
+    parser.add_argument('--pages', type=int, default=2000)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        database.DATABASE = os.path.join(tmp, 'bench.db')
+        database.init_db()
+        seed(args.pages)
+
+        results = {
+            'legacy (connect per call)': measure(build_app(legacy_get_db), args.requests),
+            'pooled get_db()': measure(build_app(database.get_db), args.requests),
+        }
+
+    for name, r in results.items():
+        print(f"{name:28s} mean {r['mean_ms']:.3f} ms  p50 {r['p50_ms']:.3f} ms  p95 {r['p95_ms']:.3f} ms")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,128 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+全文検索トリガーの書き込み増幅ベンチマーク
+
+calorie.js の自動保存（props だけの UPDATE）やチェック切り替え・並べ替えを
+1件ずつコミットしながら繰り返し、
+- 旧トリガー: blocks の全 UPDATE で search_fts を削除→再登録
+- 新トリガー: 検索対象の列が変わった時だけ search_fts を更新
+の1回あたりの時間と WAL に書かれたページ数を比較する。
+
+使い方:
+    python scripts/bench_fts_write_amplification.py --updates 2000 --blocks 5000
+"""
+
+import argparse
+import json
+import os
+import random
+import sqlite3
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from flask import Flask  # noqa: E402
+
+import database  # noqa: E402
+import migrations  # noqa: E402
+
+# 変更前と同じ「blocks の全 UPDATE で索引を削除→再登録する」トリガーを現在の search_fts に対して作る
+LEGACY_BLOCKS_AU = """
+CREATE TRIGGER blocks_au AFTER UPDATE ON blocks BEGIN
+    INSERT INTO search_fts(search_fts, rowid, title, content, details) VALUES ('delete', old.id,
+        COALESCE((SELECT title FROM pages WHERE id = old.page_id), '') || char(1, 1),
+        COALESCE(old.content, '') || char(1, 1), COALESCE(old.details, '') || char(1, 1));
+    INSERT INTO search_fts(rowid, title, content, details) VALUES (new.id,
+        COALESCE((SELECT title FROM pages WHERE id = new.page_id), '') || char(1, 1),
+        COALESCE(new.content, '') || char(1, 1), COALESCE(new.details, '') || char(1, 1));
+END;
+"""
+
+# 自動保存パスで実際に発行される UPDATE（content は変わらない）
+AUTOSAVE_STATEMENTS = [
+    ('UPDATE blocks SET props = ?, updated_at = CURRENT_TIMESTAMP WHERE id = ?',
+     lambda i: json.dumps({'items': [{'input': f'ご飯 {i}', 'kcal': 240}], 'total_kcal': 240 + i})),
+    ('UPDATE blocks SET checked = ?, updated_at = CURRENT_TIMESTAMP WHERE id = ?', lambda i: i % 2),
+    ('UPDATE blocks SET position = ?, updated_at = CURRENT_TIMESTAMP WHERE id = ?', lambda i: 1000.0 + i),
+]
+
+
+def build_db(path, block_count, legacy):
+    # DB を切り替えるので、アプリコンテキスト単位の接続でマイグレーションする
+    database.DATABASE = path
+    app = Flask(__name__)
+    database.register_db_teardown(app)
+    with app.app_context():
+        migrations.migrate()
+    conn = sqlite3.connect(path)
+    if legacy:
+        conn.execute('DROP TRIGGER blocks_au')
+        conn.execute(LEGACY_BLOCKS_AU)
+    cursor = conn.cursor()
+    pages = max(1, block_count // 20)
+    cursor.executemany(
+        'INSERT INTO pages (title, icon, parent_id, position) VALUES (?, ?, NULL, ?)',
+        [(f'2026年1月{i % 28 + 1}日 食事 {i}', '📄', i * 1000.0) for i in range(pages)]
+    )
+    rng = random.Random(0)
+    words = ['朝食', '昼食', '夕食', 'ご飯', '納豆', 'プロテイン', '筋トレ', '読書', '英語', 'メモ']
+    cursor.executemany(
+        'INSERT INTO blocks (page_id, type, content, position, props) VALUES (?, ?, ?, ?, ?)',
+        [
+            (i % pages + 1, 'text', ' '.join(rng.choice(words) for _ in range(30)), i * 1000.0, '{}')
+            for i in range(block_count)
+        ]
+    )
+    conn.commit()
+    conn.close()
+
+
+def wal_pages(conn, path):
+    page_size = conn.execute('PRAGMA page_size').fetchone()[0]
+    wal = path + '-wal'
+    return (os.path.getsize(wal) if os.path.exists(wal) else 0) / page_size
+
+
+def measure(path, updates, block_count):
+    conn = sqlite3.connect(path)
+    conn.execute('PRAGMA journal_mode = WAL')
+    conn.execute('PRAGMA synchronous = NORMAL')
+    conn.execute('PRAGMA wal_autocheckpoint = 0')
+    conn.execute('PRAGMA wal_checkpoint(TRUNCATE)')
+    rng = random.Random(1)
+    start = time.perf_counter()
+    for i in range(updates):
+        sql, value = AUTOSAVE_STATEMENTS[i % len(AUTOSAVE_STATEMENTS)]
+        conn.execute(sql, (value(i), rng.randint(1, block_count)))
+        conn.commit()
+    elapsed = time.perf_counter() - start
+    result = {
+        'us_per_update': elapsed / updates * 1e6,
+        'wal_pages_per_update': wal_pages(conn, path) / updates,
+    }
+    conn.close()
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description='FTS トリガーの書き込み増幅を計測')
+    parser.add_argument('--updates', type=int, default=2000)
+    parser.add_argument('--blocks', type=int, default=5000)
+    args = parser.parse_args()
+
+    results = {}
+    with tempfile.TemporaryDirectory() as tmp:
+        for name, legacy in (('legacy (every UPDATE)', True), ('conditional (content only)', False)):
+            path = os.path.join(tmp, f'{"legacy" if legacy else "conditional"}.db')
+            build_db(path, args.blocks, legacy)
+            results[name] = measure(path, args.updates, args.blocks)
+
+    for name, r in results.items():
+        print(f"{name:28s} {r['us_per_update']:8.1f} us/update  {r['wal_pages_per_update']:6.2f} WAL pages/update")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,235 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+よく使うクエリの実行計画チェック
+
+アプリのモジュールの関数（またはモジュールの SQL 定数）を実際に呼び、発行された SQL をすべて
+EXPLAIN QUERY PLAN にかけて、テーブルを読む行がすべて SEARCH（インデックスの範囲を絞って読む）に
+なっているかを確認する。SCAN pages のようなフルスキャンだけでなく、
+SCAN pages USING INDEX ... のようなインデックス全体の読み出しも NG とする。
+順に読んで LIMIT で止まる・ゴミ箱だけを読むなど、範囲を持たずに読んでよい部分インデックスは
+クエリごとに明示する。1つでも NG があれば終了コード 1。
+
+呼び出しは1トランザクションの中で行い、最後にロールバックする（--db の DB は変更しない）。
+
+使い方:
+    python scripts/check_query_plans.py             # 一時 DB にマイグレーションと試験用のページを作って確認
+    python scripts/check_query_plans.py --db notion.db
+"""
+
+import argparse
+import os
+import re
+import sqlite3
+import sys
+import tempfile
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from flask import Flask  # noqa: E402
+
+import activity  # noqa: E402
+import books  # noqa: E402
+import changes  # noqa: E402
+import database  # noqa: E402
+import exporter  # noqa: E402
+import migrations  # noqa: E402
+import ordering  # noqa: E402
+import routes  # noqa: E402
+import search  # noqa: E402
+import trash_purger  # noqa: E402
+import utils  # noqa: E402
+
+# 検査するテーブル（FTS などの仮想テーブルは対象外）
+TABLES = ('pages', 'blocks', 'page_closure', 'change_log', 'templates', 'book_progress')
+
+DATE = '2026-02-04'
+BOOK = '試験の本'
+
+
+def sample_ids(cursor):
+    """呼び出しに使う ID（ページ・子ページ・ブロック）。計測の外で1回だけ引く"""
+    cursor.execute('SELECT id, parent_id FROM pages WHERE parent_id IS NOT NULL AND is_deleted = 0 LIMIT 1')
+    child = cursor.fetchone()
+    cursor.execute('SELECT id, page_id FROM blocks LIMIT 1')
+    block = cursor.fetchone()
+    return {
+        'page': child['parent_id'] if child else 0,
+        'child': child['id'] if child else 0,
+        'block': block['id'] if block else 0,
+        'block_page': block['page_id'] if block else 0,
+    }
+
+
+def _search_short_terms(cursor, query, match_any=False):
+    """展開しきれない短い語の検索（試験用の DB は語彙が少ないので、展開の上限を 0 にして通す）"""
+    limit = search.MAX_TERM_EXPANSION
+    search.MAX_TERM_EXPANSION = 0
+    try:
+        search.search_blocks(cursor, query, match_any=match_any)
+        search.search_pages(cursor, query, match_any=match_any)
+    finally:
+        search.MAX_TERM_EXPANSION = limit
+
+
+def _export_all(cursor, ids):
+    list(exporter.iter_pages_with_blocks(cursor.connection, exporter.load_tree(cursor)))
+
+
+# (名前, 関数(cursor, sample_ids の戻り値), 範囲なしで読んでよい部分インデックス)
+# SQL はモジュールの関数を呼ぶか、モジュールの SQL 定数を使う（ここに SQL を書き写さない）
+HOT_QUERIES = [
+    ('page with blocks', lambda c, ids: c.execute(routes.PAGE_BLOCKS_SQL, (ids['page'],)), ()),
+    ('next page position', lambda c, ids: ordering.next_position(c, 'pages', ids['page']), ()),
+    ('next root position', lambda c, ids: ordering.next_position(c, 'pages', None), ()),
+    ('next block position', lambda c, ids: ordering.next_position(c, 'blocks', ids['block_page']), ()),
+    ('insert block after', lambda c, ids: ordering.position_after(c, 'blocks', ids['block_page'], ids['block']), ()),
+    ('date page', lambda c, ids: utils.find_date_page(c, DATE), ()),
+    ('create next date page', lambda c, ids: utils.get_or_create_date_page(c, '2026-02-05'), ()),
+    ('category pages', lambda c, ids: c.execute(
+        routes.CATEGORY_SQL.format(conditions='p.title = ? AND p.is_deleted = 0', block_join='b.page_id = p.id'),
+        ('食事', 101)
+    ), ()),
+    ('days range', lambda c, ids: c.execute(
+        routes.DAYS_SQL.format(
+            conditions='journal_date IS NOT NULL AND is_deleted = 0 AND journal_date >= ? AND journal_date <= ?'
+        ),
+        ('2026-01-01', '2026-02-28')
+    ), ()),
+    ('trash', lambda c, ids: c.execute(routes.TRASH_SQL), ('idx_pages_trash_updated',)),
+    ('today highlights', lambda c, ids: c.execute(routes.TODAY_HIGHLIGHTS_SQL, (ids['page'], DATE, '2026-02-05')), ()),
+    # since がなければ新しい順に読んで LIMIT で止まる
+    ('activity', lambda c, ids: activity.get_activity(c), ('idx_pages_live_updated', 'idx_blocks_updated_at')),
+    ('activity since', lambda c, ids: activity.get_activity(c, since=f'{DATE} 00:00:00', limit=1), ()),
+    ('subtree', lambda c, ids: database.get_subtree_pages(c, ids['page']), ()),
+    ('subtree blocks', lambda c, ids: database.get_subtree_blocks(c, ids['page']), ()),
+    ('ancestors', lambda c, ids: database.get_ancestor_map(c, [ids['page'], ids['child']]), ()),
+    ('page depth', lambda c, ids: database.get_page_depth(c, ids['child']), ()),
+    ('export all', _export_all, ()),
+    ('change feed', lambda c, ids: changes.get_changes(c), ()),
+    ('latest seq', lambda c, ids: changes.latest_seqs(c, changes.TABLES), ()),
+    ('book progress on day', lambda c, ids: books.get_progress_on(c, BOOK, DATE), ()),
+    ('book history', lambda c, ids: books.get_book_history(c, BOOK, DATE, '2026-02-28'), ()),
+    # 子ページの移動（book_progress の日付を付け替えるトリガーが走る）
+    ('move page', lambda c, ids: c.execute('UPDATE pages SET parent_id = NULL WHERE id = ?', (ids['child'],)), ()),
+    ('expired trash', lambda c, ids: c.execute(trash_purger.EXPIRED_SQL, ('-30 days', 100)), ()),
+    ('search', lambda c, ids: search.search_blocks(c, 'ごはん 朝', date_from=DATE, category='食事'), ()),
+    ('search pages', lambda c, ids: search.search_pages(c, '食事 日記'), ()),
+    ('search short terms', lambda c, ids: _search_short_terms(c, 'ご はん'), ()),
+    ('search short terms (any)', lambda c, ids: _search_short_terms(c, 'ご 朝ごはん', match_any=True), ()),
+]
+
+# 実行計画の SCAN 行（USING [COVERING] INDEX があればそのインデックス名）
+TABLE_SCAN = re.compile(r'\bSCAN (?:TABLE )?(\w+)(?: AS \w+)?(?: USING (?:COVERING )?INDEX (\w+))?')
+# FROM/JOIN/UPDATE の別名 → テーブル名（実行計画には別名で出る）
+TABLE_ALIAS = re.compile(
+    r'\b(?:FROM|JOIN|UPDATE)\s+(\w+)(?:\s+(?:AS\s+)?(?!ON\b|WHERE\b|JOIN\b|LEFT\b|ORDER\b|SET\b)(\w+))?', re.I
+)
+# EXPLAIN するもの（BEGIN・SAVEPOINT・PRAGMA などは除く）
+STATEMENT = re.compile(r'\s*(?:SELECT|WITH|INSERT|UPDATE|DELETE)\b', re.I)
+
+
+def seed(cursor):
+    """試験用のページ（日付ページと子ページ・ブロック・本・ゴミ箱）"""
+    cursor.execute("INSERT INTO pages (title, icon, position) VALUES ('日記', '📔', 1000)")
+    root_id = cursor.lastrowid
+    cursor.execute("INSERT INTO pages (title, icon, parent_id, position, journal_date) VALUES (?, '📅', ?, 1000, ?)",
+                   (DATE, root_id, DATE))
+    day_id = cursor.lastrowid
+    cursor.execute("INSERT INTO pages (title, icon, parent_id, position) VALUES ('食事', '🍽️', ?, 1000)", (day_id,))
+    meal_id = cursor.lastrowid
+    cursor.executemany('INSERT INTO blocks (page_id, type, content, props, position) VALUES (?, ?, ?, ?, ?)', [
+        (meal_id, 'text', '朝ごはん', '{}', 1000),
+        (meal_id, 'text', '昼ごはん', '{}', 2000),
+        (day_id, 'book', '', f'{{"title": "{BOOK}", "currentPage": 120}}', 1000),
+    ])
+    cursor.execute("""
+        INSERT INTO pages (title, icon, position, is_deleted, deleted_at)
+        VALUES ('ゴミ箱', '🗑️', 2000, 1, datetime('now', '-40 days'))
+    """)
+
+
+def build_db(path):
+    database.DATABASE = path
+    app = Flask(__name__)
+    database.register_db_teardown(app)
+    with app.app_context():
+        migrations.migrate()
+        conn = database.get_db()
+        seed(conn.cursor())
+        conn.commit()
+        conn.close()
+
+
+def table_scans(conn, sql, allowed):
+    """実行計画と、そのうち対象テーブルをインデックスの範囲なしで読む行"""
+    details = [row[3] for row in conn.execute('EXPLAIN QUERY PLAN ' + sql).fetchall()]
+    aliases = {table: table for table in TABLES}
+    for table, alias in TABLE_ALIAS.findall(sql):
+        if alias:
+            aliases[alias] = table
+    scans = []
+    for detail in details:
+        match = TABLE_SCAN.search(detail)
+        if match and aliases.get(match.group(1)) in TABLES and match.group(2) not in allowed:
+            scans.append(detail)
+    return details, scans
+
+
+def traced_statements(conn, run, ids):
+    """run(cursor, ids) が発行した SQL（パラメータを埋め込んだもの）のリスト。トリガーの中の文は除く"""
+    statements = []
+    conn.set_trace_callback(statements.append)
+    try:
+        run(conn.cursor(), ids)
+    finally:
+        conn.set_trace_callback(None)
+    unique = []
+    for sql in statements:
+        if STATEMENT.match(sql) and sql not in unique:
+            unique.append(sql)
+    return unique
+
+
+def main():
+    parser = argparse.ArgumentParser(description='よく使うクエリがフルスキャンになっていないか確認')
+    parser.add_argument('--db', help='確認する DB（変更はロールバックする。省略時は一時 DB を作る）')
+    parser.add_argument('-v', '--verbose', action='store_true', help='全クエリの実行計画を表示')
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        path = args.db or os.path.join(tmp, 'plans.db')
+        if not args.db:
+            build_db(path)
+        conn = sqlite3.connect(path, isolation_level=None)
+        conn.row_factory = sqlite3.Row
+        conn.execute('BEGIN')
+        failures = 0
+        checked = 0
+        try:
+            ids = sample_ids(conn.cursor())
+            for name, run, allowed in HOT_QUERIES:
+                statements = traced_statements(conn, run, ids)
+                checked += len(statements)
+                results = [(sql, *table_scans(conn, sql, allowed)) for sql in statements]
+                bad = any(scans for _, _, scans in results)
+                print(f"{'NG' if bad else 'ok':2s} {name} ({len(statements)} SQL)")
+                for sql, details, scans in results:
+                    if scans or args.verbose:
+                        print(f"     {' '.join(sql.split())[:160]}")
+                        for detail in details:
+                            print(f"       {'✗' if detail in scans else ' '} {detail}")
+                failures += bad
+        finally:
+            conn.rollback()
+            conn.close()
+
+    if failures:
+        print(f"❌ {failures} 件の処理でテーブルかインデックス全体を読んでいます")
+        return 1
+    print(f"✅ {len(HOT_QUERIES)} 件の処理（{checked} SQL）がすべてインデックスの範囲を絞って読んでいます")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
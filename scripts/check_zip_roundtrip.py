@@ -0,0 +1,174 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+ZIP エクスポート → インポートの往復チェック
+
+ページツリーを ZIP にエクスポートしてインポートし直し、ページ（タイトル・アイコン・入れ子）と
+ブロック（種類・内容・チェック・details・props・並び順）、添付の中身が元と同じかを確認する。
+違いがあれば終了コード 1。
+
+使い方:
+    python scripts/check_zip_roundtrip.py                       # 一時 DB に試験用のページを作って確認
+    python scripts/check_zip_roundtrip.py --db notion.db --page 69   # DB のコピーで既存ページを確認
+"""
+
+import argparse
+import io
+import os
+import shutil
+import sqlite3
+import sys
+import tempfile
+import zipfile
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from flask import Flask  # noqa: E402
+
+import database  # noqa: E402
+import migrations  # noqa: E402
+from exporter import zip_manifest, stream_zip  # noqa: E402
+from importer import PageImporter  # noqa: E402
+from zip_importer import ZipPageReader  # noqa: E402
+
+# page.md では区切れない・消えてしまうブロック
+SAMPLE_BLOCKS = [
+    ('h1', '見出し', 0, '', '{}'),
+    ('text', '1段落目\n\n空行のあとの2段落目', 0, '', '{}'),
+    ('text', '', 0, '', '{}'),
+    ('todo', '改行を\n含むTODO', 1, '', '{}'),
+    ('todo', '- [☐] TODO に見えるTODO', 0, '', '{}'),
+    ('toggle', 'トグル', 0, '詳細1\n\n詳細2', '{}'),
+    ('text', '**太字だけのテキスト**', 0, '', '{}'),
+    ('speak', '読み上げ', 0, '', '{"voice": "ja"}'),
+    ('book', '', 0, '', '{"title": "本", "currentPage": 120}'),
+    ('image', '/uploads/roundtrip.png', 0, '', '{"width": 320}'),
+    ('file', '/uploads/roundtrip.txt', 0, '', '{}'),
+    ('text', '/uploads/roundtrip.txt', 0, '', '{}'),
+]
+
+
+def create_sample(cursor, upload_folder):
+    """試験用のページツリー（子・孫ページと添付つき）を作ってルートの ID を返す"""
+    with open(os.path.join(upload_folder, 'roundtrip.png'), 'wb') as f:
+        f.write(os.urandom(4096))
+    with open(os.path.join(upload_folder, 'roundtrip.txt'), 'wb') as f:
+        f.write('添付\n'.encode('utf-8') * 100)
+    cursor.execute("INSERT INTO pages (title, icon, position) VALUES ('往復テスト', '📦', 1000)")
+    root_id = cursor.lastrowid
+    cursor.execute("INSERT INTO pages (title, icon, parent_id, position) VALUES ('子/スラッシュ', '🌱', ?, 1000)",
+                   (root_id,))
+    child_id = cursor.lastrowid
+    cursor.execute("INSERT INTO pages (title, icon, parent_id, position) VALUES ('孫', '📄', ?, 1000)", (child_id,))
+    grand_id = cursor.lastrowid
+    for page_id in (root_id, child_id, grand_id):
+        cursor.executemany(
+            'INSERT INTO blocks (page_id, type, content, checked, details, props, position) VALUES (?, ?, ?, ?, ?, ?, ?)',
+            [(page_id,) + block + ((i + 1) * 1000.0,) for i, block in enumerate(SAMPLE_BLOCKS)]
+        )
+    return root_id
+
+
+def snapshot(cursor, page_id, upload_folder):
+    """比べる形（ID・position・添付のファイル名を除く）"""
+    cursor.execute('SELECT title, icon, cover_image, is_pinned FROM pages WHERE id = ?', (page_id,))
+    page = tuple(cursor.fetchone())
+    cursor.execute('''
+        SELECT type, content, checked, collapsed, details, props FROM blocks WHERE page_id = ? ORDER BY position
+    ''', (page_id,))
+    blocks = []
+    for row in cursor.fetchall():
+        row = list(row)
+        if row[0] in ('image', 'file') and (row[1] or '').startswith('/uploads/'):
+            path = os.path.join(upload_folder, row[1].split('/')[-1])
+            row[1] = open(path, 'rb').read() if os.path.exists(path) else None
+        blocks.append(tuple(row))
+    cursor.execute('SELECT id FROM pages WHERE parent_id = ? ORDER BY position', (page_id,))
+    children = [snapshot(cursor, child_id, upload_folder) for (child_id,) in cursor.fetchall()]
+    return page, blocks, children
+
+
+def diff(before, after, path='root'):
+    (page_a, blocks_a, children_a), (page_b, blocks_b, children_b) = before, after
+    problems = []
+    if page_a != page_b:
+        problems.append(f"{path}: ページ {page_a!r} → {page_b!r}")
+    if len(blocks_a) != len(blocks_b):
+        problems.append(f"{path}: ブロック数 {len(blocks_a)} → {len(blocks_b)}")
+    for i, (a, b) in enumerate(zip(blocks_a, blocks_b)):
+        if a != b:
+            problems.append(f"{path}: ブロック {i} {a!r:.120} → {b!r:.120}")
+    if len(children_a) != len(children_b):
+        problems.append(f"{path}: 子ページ数 {len(children_a)} → {len(children_b)}")
+    for i, (a, b) in enumerate(zip(children_a, children_b)):
+        problems.extend(diff(a, b, f"{path}/{i}"))
+    return problems
+
+
+def main():
+    parser = argparse.ArgumentParser(description='ZIP エクスポート → インポートで元と同じになるか確認')
+    parser.add_argument('--db', help='確認する DB（コピーして使う。省略時は一時 DB に試験用のページを作る）')
+    parser.add_argument('--page', type=int, help='--db のときに往復させるページ ID')
+    parser.add_argument('--uploads', default='uploads', help='--db のときの添付フォルダ（読むだけ）')
+    args = parser.parse_args()
+    if args.db and args.page is None:
+        parser.error('--db には --page が必要です')
+
+    with tempfile.TemporaryDirectory() as tmp:
+        database.DATABASE = os.path.join(tmp, 'roundtrip.db')
+        if args.db:
+            src = sqlite3.connect(args.db)
+            src.backup(sqlite3.connect(database.DATABASE))
+            src.close()
+        source_uploads = os.path.join(tmp, 'source_uploads')
+        import_uploads = os.path.join(tmp, 'import_uploads')
+        os.makedirs(import_uploads)
+        if args.db and os.path.isdir(args.uploads):
+            shutil.copytree(args.uploads, source_uploads)
+        else:
+            os.makedirs(source_uploads)
+
+        app = Flask(__name__)
+        database.register_db_teardown(app)
+        with app.app_context():
+            migrations.migrate()
+            conn = database.get_db()
+            cursor = conn.cursor()
+            page_id = args.page
+            if page_id is None:
+                page_id = create_sample(cursor, source_uploads)
+                conn.commit()
+
+            manifest = zip_manifest(page_id, source_uploads)
+            if manifest is None:
+                print(f"❌ ページ {page_id} がありません")
+                return 1
+            archive = b''.join(stream_zip(manifest[1]))
+
+            with zipfile.ZipFile(io.BytesIO(archive)) as zf:
+                reader = ZipPageReader(zf, import_uploads)
+                roots = reader.read()
+            cursor.execute('BEGIN IMMEDIATE')
+            with PageImporter(cursor) as importer:
+                for page_dict in roots:
+                    importer.add(page_dict)
+            conn.commit()
+
+            before = snapshot(cursor, page_id, source_uploads)
+            after = snapshot(cursor, importer.root_ids[0], import_uploads)
+            conn.close()
+
+    problems = diff(before, after)
+    print(f"ZIP {len(archive):,} bytes / {importer.page_count} ページ / {importer.block_count} ブロック / "
+          f"添付 {reader.file_count} 件")
+    for problem in problems:
+        print(f"NG {problem}")
+    if problems:
+        print(f"❌ {len(problems)} 件の違いがあります")
+        return 1
+    print('✅ エクスポートした ZIP をインポートすると元と同じになります')
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,210 @@
+# -*- coding: utf-8 -*-
+"""
+全文検索
+- search_fts（FTS5 trigram）でブロック本文・詳細・ページタイトルを、page_title_fts でページタイトルを検索
+- 3文字以上の語はそのまま部分一致、1〜2文字の語は語彙表 (*_vocab) から
+  その語で始まるトライグラムに展開する（どちらもインデックスだけで引ける）
+- 展開が上限を超える語（「の」「a」など、ほとんどの行に出る語）は、出現表 (*_instance) で
+  その語で始まるトライグラムの範囲を引いて行 ID の集合にする（これもインデックスの範囲読み）
+- bm25 の列の重みで並べ、(rank, block_id) のキーセットでページングする
+"""
+import re
+
+from utils import encode_cursor, decode_cursor
+
+# 1〜2文字の語を MATCH 式に展開するトライグラム数の上限（超えたら出現表から行 ID を引く）
+MAX_TERM_EXPANSION = 200
+
+# 出現表から引いた行の snippet に入れる前後の文字数
+SNIPPET_CONTEXT = 10
+
+# 索引時に値の末尾に付けている番兵（migrations の search_source と同じ）
+SENTINEL = '\x01'
+
+DEFAULT_LIMIT = 20
+MAX_LIMIT = 200
+
+
+def split_terms(text):
+    """空白区切りで検索語に分割"""
+    return [t for t in re.split(r'\s+', text or '') if t]
+
+
+def _quote(token):
+    return '"' + token.replace('"', '""') + '"'
+
+
+def _prefix_range(term):
+    """term で始まるトライグラムの範囲 [low, high)"""
+    prefix = term.lower()
+    return prefix, prefix + '\U0010ffff'
+
+
+def _term_expression(cursor, table, term):
+    """1語分の MATCH 式。該当するトライグラムが1つもなければ ''、上限を超えて展開できなければ None"""
+    if len(term) >= 3:
+        return _quote(term)
+    cursor.execute(
+        f'SELECT term FROM {table}_vocab WHERE term >= ? AND term < ? LIMIT ?',
+        _prefix_range(term) + (MAX_TERM_EXPANSION + 1,)
+    )
+    tokens = [row[0] for row in cursor.fetchall()]
+    if len(tokens) > MAX_TERM_EXPANSION:
+        return None
+    return '(' + ' OR '.join(_quote(token) for token in tokens) + ')' if tokens else ''
+
+
+def build_match(cursor, terms, match_any=False, table='search_fts'):
+    """検索語のリストから (FTS5 の MATCH 式, 出現表で引く語のリスト) を組み立てる
+
+    該当なしが確定なら (None, [])。展開しきれない語は MATCH 式に入れず、出現表で引く語にする。
+    """
+    expressions = []
+    short_terms = []
+    for term in terms:
+        expression = _term_expression(cursor, table, term)
+        if expression is None:
+            short_terms.append(term)
+        elif expression:
+            expressions.append(expression)
+        elif not match_any:
+            return None, []
+    match = (' OR ' if match_any else ' AND ').join(expressions) or None
+    return match, short_terms
+
+
+def _row_ids(table, match, short_terms, match_any):
+    """MATCH 式と出現表の語に当たる行 ID（列名 id）のサブクエリとパラメータ
+
+    出現表は出現ごとの行なので DISTINCT にする。語ごとの集合は既定は INTERSECT、match_any なら UNION でまとめる。
+    """
+    selects = []
+    params = []
+    if match:
+        selects.append(f'SELECT rowid AS id FROM {table} WHERE {table} MATCH ?')
+        params.append(match)
+    for term in short_terms:
+        selects.append(f'SELECT DISTINCT doc AS id FROM {table}_instance WHERE term >= ? AND term < ?')
+        params.extend(_prefix_range(term))
+    return (' UNION ' if match_any else ' INTERSECT ').join(selects), params
+
+
+def _plain_snippet(row, terms):
+    """出現表で見つけた行の snippet（最初に見つかった語を <b> で囲み、前後を少し付ける）"""
+    for text in (row['content'], row['page_title']):
+        text = text or ''
+        for term in terms:
+            i = text.lower().find(term.lower())
+            if i < 0:
+                continue
+            end = i + len(term)
+            start, stop = max(0, i - SNIPPET_CONTEXT), end + SNIPPET_CONTEXT
+            return (('...' if start else '') + text[start:i] + '<b>' + text[i:end] + '</b>'
+                    + text[end:stop] + ('...' if stop < len(text) else ''))
+    return ''
+
+
+def search_blocks(cursor, query, limit=DEFAULT_LIMIT, after=None, date_from=None, date_to=None,
+                  category=None, block_type=None, match_any=False):
+    """ブロックを全文検索する
+
+    query は文字列（空白区切り）または語のリスト。match_any=True なら語の OR、既定は AND。
+    date_from / date_to は日付ページ（自身か最も近い祖先）の journal_date で絞り込む。
+    category はブロックのページ名（筋トレ・食事など）、block_type はブロック種別。
+    after は前回の next_cursor。戻り値は (結果のリスト, next_cursor or None)。
+    """
+    terms = split_terms(query) if isinstance(query, str) else list(query)
+    limit = max(1, min(int(limit), MAX_LIMIT))
+    match, short_terms = build_match(cursor, terms, match_any=match_any)
+    if match is None and not short_terms:
+        return [], None
+
+    conditions = ['pages.is_deleted = 0']
+    params = []
+    ranked = match is not None and not (match_any and short_terms)
+    if ranked:
+        source = 'search_fts JOIN blocks ON blocks.id = search_fts.rowid'
+        rank_column = 'search_fts.rank'
+        snippet = "snippet(search_fts, -1, '<b>', '</b>', '...', 10)"
+        conditions.append('search_fts MATCH ?')
+        params.append(match)
+        if short_terms:
+            # MATCH の結果を、出現表で引いた行 ID で絞る
+            row_ids, row_params = _row_ids('search_fts', None, short_terms, False)
+            conditions.append(f'search_fts.rowid IN ({row_ids})')
+            params.extend(row_params)
+    else:
+        # bm25 を付けられない（MATCH に使える語がない・OR に出現表の語が入る）。行 ID 順で返す
+        row_ids, params = _row_ids('search_fts', match, short_terms, match_any)
+        source = f'({row_ids}) AS hit JOIN blocks ON blocks.id = hit.id'
+        rank_column = '0.0'
+        snippet = 'NULL'
+    if block_type:
+        conditions.append('blocks.type = ?')
+        params.append(block_type)
+    if category:
+        conditions.append('pages.title = ?')
+        params.append(category)
+    if date_from or date_to:
+        date_conditions = ['c.descendant_id = blocks.page_id', 'd.journal_date IS NOT NULL']
+        if date_from:
+            date_conditions.append('d.journal_date >= ?')
+            params.append(date_from)
+        if date_to:
+            date_conditions.append('d.journal_date <= ?')
+            params.append(date_to)
+        conditions.append(f'''EXISTS (
+            SELECT 1 FROM page_closure c JOIN pages d ON d.id = c.ancestor_id
+            WHERE {' AND '.join(date_conditions)}
+        )''')
+    if after:
+        rank, block_id = decode_cursor(after, float, int)
+        conditions.append(f'({rank_column} > ? OR ({rank_column} = ? AND blocks.id > ?))')
+        params.extend([rank, rank, block_id])
+
+    cursor.execute(f'''
+        SELECT blocks.id AS block_id, blocks.page_id, blocks.type, blocks.content,
+               pages.title AS page_title, pages.icon, pages.parent_id,
+               {snippet} AS snippet,
+               (
+                   SELECT d.journal_date FROM page_closure c JOIN pages d ON d.id = c.ancestor_id
+                   WHERE c.descendant_id = blocks.page_id AND d.journal_date IS NOT NULL
+                   ORDER BY c.depth LIMIT 1
+               ) AS journal_date,
+               {rank_column} AS rank
+        FROM {source}
+        JOIN pages ON pages.id = blocks.page_id
+        WHERE {' AND '.join(conditions)}
+        ORDER BY {rank_column}, blocks.id
+        LIMIT ?
+    ''', params + [limit + 1])
+    rows = [dict(row) for row in cursor.fetchall()]
+
+    next_cursor = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        next_cursor = encode_cursor(rows[-1]['rank'], rows[-1]['block_id'])
+    for row in rows:
+        if ranked:
+            row['snippet'] = (row['snippet'] or '').replace(SENTINEL, '')
+        else:
+            row['snippet'] = _plain_snippet(row, terms)
+    return rows, next_cursor
+
+
+def search_pages(cursor, query, limit=10, match_any=True):
+    """ページタイトルを全文検索する（新しく更新されたページ順。ブロックのないページも対象）"""
+    terms = split_terms(query) if isinstance(query, str) else list(query)
+    match, short_terms = build_match(cursor, terms, match_any=match_any, table='page_title_fts')
+    if match is None and not short_terms:
+        return []
+    row_ids, params = _row_ids('page_title_fts', match, short_terms, match_any)
+    cursor.execute(f'''
+        SELECT pages.id, pages.title, pages.icon, pages.parent_id
+        FROM ({row_ids}) AS hit
+        JOIN pages ON pages.id = hit.id
+        WHERE pages.is_deleted = 0
+        ORDER BY pages.updated_at DESC
+        LIMIT ?
+    ''', params + [limit])
+    return [dict(row) for row in cursor.fetchall()]
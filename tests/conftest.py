@@ -0,0 +1,56 @@
+# -*- coding: utf-8 -*-
+"""
+テスト共通の準備
+- テストごとに一時ディレクトリの DB を作り、マイグレーションを最新まで適用する
+- アプリのモジュールはリポジトリ直下にあるので、sys.path に追加して import する
+"""
+
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from flask import Flask  # noqa: E402
+
+import database  # noqa: E402
+import migrations  # noqa: E402
+
+
+@pytest.fixture
+def app(tmp_path, monkeypatch):
+    """一時 DB を使う Flask アプリ（マイグレーション適用済み）"""
+    monkeypatch.setattr(database, 'DATABASE', str(tmp_path / 'test.db'))
+    app = Flask(__name__)
+    database.register_db_teardown(app)
+    with app.app_context():
+        migrations.migrate()
+    yield app
+    # アプリコンテキストの外（このスレッド）で開いた接続を閉じる
+    database.release_thread_db(close=True)
+
+
+@pytest.fixture
+def conn(app):
+    """アプリコンテキストの接続（テストの終わりに未コミットの変更は捨てる）"""
+    with app.app_context():
+        conn = database.get_db()
+        yield conn
+        conn.close()
+
+
+@pytest.fixture
+def make_page(conn):
+    """ページを作って ID を返す（blocks にブロックの本文のリストを渡すと 1000 刻みで追加する）"""
+    def make_page(title='', parent_id=None, blocks=()):
+        cursor = conn.cursor()
+        cursor.execute('INSERT INTO pages (title, parent_id, position) VALUES (?, ?, 1000)', (title, parent_id))
+        page_id = cursor.lastrowid
+        cursor.executemany(
+            "INSERT INTO blocks (page_id, type, content, position) VALUES (?, 'text', ?, ?)",
+            [(page_id, content, (i + 1) * 1000.0) for i, content in enumerate(blocks)]
+        )
+        conn.commit()
+        return page_id
+    return make_page
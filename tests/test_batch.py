@@ -0,0 +1,43 @@
+# -*- coding: utf-8 -*-
+"""一括更新 (batch) の仮 ID とロールバック"""
+
+import pytest
+
+from batch import BatchError, apply_batch
+
+
+def count(conn, table):
+    return conn.execute(f'SELECT COUNT(*) FROM {table}').fetchone()[0]
+
+
+def test_temp_ids_resolve_to_created_rows(conn):
+    with conn.transaction():
+        results, id_map = apply_batch(conn.cursor(), [
+            {'op': 'create', 'type': 'page', 'temp_id': 'p', 'data': {'title': '親'}},
+            {'op': 'create', 'type': 'page', 'temp_id': 'c', 'parent_id': 'p', 'data': {'title': '子'}},
+            {'op': 'create', 'type': 'block', 'temp_id': 'b', 'page_id': 'c', 'data': {'content': '本文'}},
+            {'op': 'update', 'type': 'block', 'id': 'b', 'data': {'content': '書き換え'}},
+        ])
+    assert set(id_map) == {'p', 'c', 'b'}
+    assert results[1]['row']['parent_id'] == id_map['p']
+    assert results[2]['row']['page_id'] == id_map['c']
+    assert results[3]['row']['id'] == id_map['b']
+    assert results[3]['row']['content'] == '書き換え'
+
+
+@pytest.mark.parametrize('bad_op', [
+    {'op': 'update', 'type': 'block', 'id': 'unknown', 'data': {}},
+    {'op': 'update', 'type': 'page', 'id': 'p', 'data': {'title': {'nested': 1}}},
+    {'op': 'update', 'type': 'page', 'id': 'p', 'data': ['not', 'an', 'object']},
+    {'op': 'create', 'type': 'page', 'temp_id': 'p'},
+])
+def test_bad_operation_rolls_back_the_whole_batch(conn, bad_op):
+    pages, blocks = count(conn, 'pages'), count(conn, 'blocks')
+    with pytest.raises(BatchError) as excinfo:
+        with conn.transaction():
+            apply_batch(conn.cursor(), [
+                {'op': 'create', 'type': 'page', 'temp_id': 'p', 'data': {'title': '消える'}},
+                bad_op,
+            ])
+    assert excinfo.value.index == 1
+    assert (count(conn, 'pages'), count(conn, 'blocks')) == (pages, blocks)
@@ -0,0 +1,55 @@
+# -*- coding: utf-8 -*-
+"""並び順 (ordering) の並べ替え"""
+
+import pytest
+
+from ordering import POSITION_STEP, _unmoved, apply_order
+
+
+def block_ids(conn, page_id):
+    cursor = conn.execute('SELECT id FROM blocks WHERE page_id = ? ORDER BY position', (page_id,))
+    return [row[0] for row in cursor.fetchall()]
+
+
+def positions(conn, page_id):
+    cursor = conn.execute('SELECT id, position FROM blocks WHERE page_id = ?', (page_id,))
+    return {row[0]: row[1] for row in cursor.fetchall()}
+
+
+def test_unmoved_keeps_longest_increasing_run():
+    ordered = [5, 1, 2, 3, 4]
+    assert _unmoved(ordered, {1: 1000, 2: 2000, 3: 3000, 4: 4000, 5: 5000}) == {1, 2, 3, 4}
+    assert _unmoved([], {}) == set()
+
+
+def test_single_move_writes_one_row(conn, make_page):
+    page_id = make_page(blocks=['a', 'b', 'c', 'd', 'e'])
+    ids = block_ids(conn, page_id)
+    before = positions(conn, page_id)
+
+    new_order = [ids[0], ids[4], ids[1], ids[2], ids[3]]
+    apply_order(conn.cursor(), 'blocks', page_id, new_order)
+
+    after = positions(conn, page_id)
+    assert block_ids(conn, page_id) == new_order
+    assert [item_id for item_id in ids if after[item_id] != before[item_id]] == [ids[4]]
+    assert before[ids[0]] < after[ids[4]] < before[ids[1]]
+
+
+def test_rebalance_when_gap_is_exhausted(conn, make_page):
+    page_id = make_page(blocks=['a', 'b', 'c'])
+    ids = block_ids(conn, page_id)
+    # 先頭2件の間をほとんど詰めておく（中点が取れない）
+    conn.execute('UPDATE blocks SET position = ? WHERE id = ?', (POSITION_STEP + 1e-9, ids[1]))
+
+    new_order = [ids[0], ids[2], ids[1]]
+    result = apply_order(conn.cursor(), 'blocks', page_id, new_order)
+
+    assert block_ids(conn, page_id) == new_order
+    assert [position for _, position in result] == [POSITION_STEP, 2 * POSITION_STEP, 3 * POSITION_STEP]
+
+
+def test_unknown_id_is_rejected(conn, make_page):
+    page_id = make_page(blocks=['a'])
+    with pytest.raises(ValueError):
+        apply_order(conn.cursor(), 'blocks', page_id, [-1])
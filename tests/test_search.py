@@ -0,0 +1,72 @@
+# -*- coding: utf-8 -*-
+"""全文検索の短い語（語彙表に展開しきれない語は出現表から引く）"""
+
+import pytest
+
+import search
+
+BLOCKS = ['今日の食事', '朝ごはんはパン', 'a short note', '日記を書いた', 'のんびり散歩']
+
+
+@pytest.fixture
+def pages(make_page):
+    return {
+        'diary': make_page('日記', blocks=BLOCKS),
+        'empty': make_page('ブロックのないページ'),
+    }
+
+
+@pytest.fixture(params=[search.MAX_TERM_EXPANSION, 0], ids=['expanded', 'instance'])
+def expansion(request, monkeypatch):
+    """1〜2文字の語を MATCH 式に展開する場合と、出現表から引く場合の両方で確かめる"""
+    monkeypatch.setattr(search, 'MAX_TERM_EXPANSION', request.param)
+
+
+def contents(conn, query, **kwargs):
+    """全ページを1件ずつたどった結果の本文（重複があれば失敗）"""
+    found = []
+    after = None
+    while True:
+        rows, after = search.search_blocks(conn.cursor(), query, limit=1, after=after, **kwargs)
+        found.extend(row['content'] for row in rows)
+        if after is None:
+            break
+    assert len(found) == len(set(found))
+    return set(found)
+
+
+def test_short_terms(conn, pages, expansion):
+    assert contents(conn, 'の') == {'今日の食事', 'のんびり散歩'}
+    assert contents(conn, 'の 食事') == {'今日の食事'}
+    assert contents(conn, 'a') == {'a short note'}
+    assert contents(conn, 'パン は') == {'朝ごはんはパン'}
+    assert contents(conn, '散歩 xyz') == set()
+
+
+def test_short_terms_match_any(conn, pages, expansion):
+    assert contents(conn, '食事 散歩', match_any=True) == {'今日の食事', 'のんびり散歩'}
+    assert contents(conn, 'a は', match_any=True) == {'a short note', '朝ごはんはパン'}
+    # 見つからない語は無視する
+    assert contents(conn, 'xyz 日記を', match_any=True) == {'日記を書いた'}
+
+
+def test_page_title_matches_every_block(conn, pages, expansion):
+    # search_fts はページタイトルも索引している
+    assert contents(conn, '日記') == set(BLOCKS)
+
+
+def test_snippet_marks_the_term(conn, pages, expansion):
+    rows, _ = search.search_blocks(conn.cursor(), 'パン')
+    assert '<b>' in rows[0]['snippet'] and search.SENTINEL not in rows[0]['snippet']
+
+
+def test_search_pages_finds_pages_without_blocks(conn, pages, expansion):
+    found = search.search_pages(conn.cursor(), 'ブロック')
+    assert [page['id'] for page in found] == [pages['empty']]
+    assert {page['id'] for page in search.search_pages(conn.cursor(), 'の')} == {pages['empty']}
+
+
+def test_search_pages_follows_renames(conn, pages):
+    conn.execute("UPDATE pages SET title = '改名した' WHERE id = ?", (pages['empty'],))
+    assert search.search_pages(conn.cursor(), 'ブロック') == []
+    assert [page['id'] for page in search.search_pages(conn.cursor(), '改名')] == [pages['empty']]
@@ -0,0 +1,50 @@
+# -*- coding: utf-8 -*-
+"""書き込みキューの取り消しと待ち時間"""
+
+import pytest
+
+import write_queue
+from write_queue import PendingWrite, WriteQueue, WriteStillRunning
+
+
+def content(conn, block_id):
+    return conn.execute('SELECT content FROM blocks WHERE id = ?', (block_id,)).fetchone()[0]
+
+
+def test_update_is_committed(conn, make_page):
+    page_id = make_page(blocks=['before'])
+    block_id = conn.execute('SELECT id FROM blocks WHERE page_id = ?', (page_id,)).fetchone()[0]
+    queue = WriteQueue(window_seconds=0)
+    queue.start()
+    try:
+        row = queue.submit('blocks', block_id, {'content': 'after'}).wait(5)
+    finally:
+        queue.stop()
+    assert row['content'] == 'after'
+    assert content(conn, block_id) == 'after'
+
+
+def test_timed_out_write_is_cancelled_and_not_applied(conn, make_page):
+    page_id = make_page(blocks=['before'])
+    block_id = conn.execute('SELECT id FROM blocks WHERE page_id = ?', (page_id,)).fetchone()[0]
+    queue = WriteQueue(window_seconds=0)
+    # 書き込みスレッドがまだ動いていないので、待ち時間内に取りかかられない
+    pending = queue.submit('blocks', block_id, {'content': 'late'})
+    with pytest.raises(TimeoutError) as excinfo:
+        pending.wait(0.01)
+    assert not isinstance(excinfo.value, WriteStillRunning)
+
+    queue.start()
+    queue.stop()
+    assert content(conn, block_id) == 'before'
+    assert queue.metrics()['cancelled'] == 1
+
+
+def test_running_write_wait_is_bounded(monkeypatch):
+    monkeypatch.setattr(write_queue, 'RUNNING_WAIT_SECONDS', 0.01)
+    pending = PendingWrite('blocks', 1, {})
+    # 書き込みスレッドが取りかかった（もう取り消せない）まま終わらない
+    assert pending.take()
+    assert not pending.cancel()
+    with pytest.raises(WriteStillRunning):
+        pending.wait(0.01)
@@ -0,0 +1,132 @@
+# -*- coding: utf-8 -*-
+"""
+ゴミ箱の自動削除
+- ゴミ箱に入れてから保存期間（既定 30 日）を過ぎたページを完全削除する
+- 1回のトランザクションで消すのは batch_size ページまで。バッチの間は書き込みロックを手放す
+- 子ページが残っているページは消さない（葉から順に消すので、部分木は数バッチで消える）
+- TRASH_RETENTION_DAYS=0 で無効
+- スキーマが最新になる（マイグレーションが終わる）までは何も消さない
+"""
+
+import os
+import threading
+import time
+
+from database import get_db, release_thread_db
+from migrations import get_schema_version, latest_version
+
+TRASH_RETENTION_DAYS = int(os.getenv('TRASH_RETENTION_DAYS', '30'))
+
+# 保存期間を過ぎた葉のページ（削除した順）。パラメータは datetime の修飾子（'-30 days'）と件数
+EXPIRED_SQL = '''
+    SELECT id FROM pages p
+    WHERE p.is_deleted = 1 AND p.deleted_at < datetime('now', ?)
+      AND NOT EXISTS (SELECT 1 FROM pages c WHERE c.parent_id = p.id)
+    ORDER BY p.deleted_at
+    LIMIT ?
+'''
+
+
+class TrashPurger:
+    """保存期間を過ぎたゴミ箱のページを少しずつ完全削除するスレッド"""
+
+    def __init__(self, retention_days=TRASH_RETENTION_DAYS, batch_size=100,
+                 interval_seconds=3600, pause_seconds=0.05, start_delay_seconds=60):
+        self.retention_days = retention_days
+        self.start_delay_seconds = start_delay_seconds
+        self.batch_size = batch_size
+        self.interval_seconds = interval_seconds
+        self.pause_seconds = pause_seconds
+        self.thread = None
+        self.running = False
+        self._wake = threading.Event()
+
+    def purge_batch(self):
+        """保存期間を過ぎた葉のページを batch_size 件まで削除し、削除したページ数を返す"""
+        conn = get_db()
+        cursor = conn.cursor()
+        try:
+            cursor.execute('BEGIN IMMEDIATE')
+            cursor.execute(EXPIRED_SQL, (f'-{int(self.retention_days)} days', self.batch_size))
+            page_ids = [row[0] for row in cursor.fetchall()]
+            if page_ids:
+                placeholders = ', '.join('?' for _ in page_ids)
+                # ブロックを先に消す（search_fts のトリガーがページ名を引くため）
+                cursor.execute(f'DELETE FROM blocks WHERE page_id IN ({placeholders})', page_ids)
+                cursor.execute(f'DELETE FROM pages WHERE id IN ({placeholders})', page_ids)
+            conn.commit()
+            return len(page_ids)
+        except Exception:
+            conn.rollback()
+            raise
+        finally:
+            conn.close()
+
+    def schema_ready(self):
+        """マイグレーションが適用済みか（deleted_at の埋め直し前に消さないため）"""
+        conn = get_db()
+        try:
+            return get_schema_version(conn) >= latest_version()
+        finally:
+            conn.close()
+
+    def purge_expired(self):
+        """期限切れのページがなくなるまでバッチを繰り返し、削除した合計を返す"""
+        if not self.schema_ready():
+            return 0
+        total = 0
+        while True:
+            count = self.purge_batch()
+            total += count
+            # 葉を消すと親が次の葉になるので、1件も消えなくなるまで続ける
+            if count == 0 or self._wake.is_set():
+                break
+            time.sleep(self.pause_seconds)
+        return total
+
+    def start(self):
+        if not self.running:
+            self.running = True
+            self.thread = threading.Thread(target=self._loop, name='trash-purger', daemon=True)
+            self.thread.start()
+
+    def stop(self):
+        if self.running:
+            self.running = False
+            self._wake.set()
+            if self.thread:
+                self.thread.join(timeout=5)
+
+    def _loop(self):
+        # 起動直後（DB の初期化・復元中）は避ける
+        self._wake.wait(self.start_delay_seconds)
+        try:
+            while self.running:
+                try:
+                    purged = self.purge_expired()
+                    if purged:
+                        print(f"🗑️ Purged {purged} page(s) from trash (older than {self.retention_days} days)")
+                except Exception as e:
+                    print(f"⚠️ Trash purge error: {e}")
+                finally:
+                    release_thread_db()
+                self._wake.wait(self.interval_seconds)
+        finally:
+            release_thread_db(close=True)
+
+
+# グローバルインスタンス
+_trash_purger = None
+
+
+def init_trash_purger():
+    """ゴミ箱の自動削除スレッドを開始"""
+    global _trash_purger
+    if _trash_purger is None and TRASH_RETENTION_DAYS > 0:
+        _trash_purger = TrashPurger()
+        _trash_purger.start()
+    return _trash_purger
+
+
+def get_trash_purger():
+    return _trash_purger
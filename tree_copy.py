@@ -0,0 +1,161 @@
+# -*- coding: utf-8 -*-
+"""
+ページツリーの一括コピー・一括作成
+- コピー先のページIDを部分木ぶん先にまとめて割り当て、旧ID → 新ID の対応表を作る
+- ページ・ブロックは対応表と JOIN した INSERT ... SELECT 各1文でコピー（行を Python に読み込まない）
+- 引き継ぐブロックは block_filter（ブロックを b とした SQL の条件）で絞り込める。API からは carry_over の名前で指定する
+- テンプレート（辞書）からの作成も、IDを割り当ててからページ・ブロックを executemany でまとめて挿入する
+"""
+
+import json
+
+from database import get_next_position, next_row_id
+
+# 引き継ぐブロックの条件（copy_tree の block_filter に渡す）
+UNCHECKED_TODOS = "b.type = 'todo' AND b.checked = 0"
+SKIP_CHECKED_TODOS = "NOT (b.type = 'todo' AND b.checked = 1)"
+HEADINGS = "b.type IN ('h1', 'h2', 'h3')"
+
+# carry_over（API の引き継ぎ方の指定）→ block_filter
+CARRY_OVER = {
+    'all': None,
+    'unchecked_todos': UNCHECKED_TODOS,
+    'skip_checked_todos': SKIP_CHECKED_TODOS,
+    'headings': HEADINGS,
+}
+
+# 対応表（[[旧ID, 新ID], ...] の JSON）を表として読む
+_ID_MAP = '''
+    WITH id_map AS (
+        SELECT json_extract(value, '$[0]') AS old_id, json_extract(value, '$[1]') AS new_id
+        FROM json_each(?)
+    )
+'''
+
+
+def carry_over_filter(carry_over):
+    """carry_over の名前を block_filter にする（None は 'all'）。知らない名前なら ValueError"""
+    if carry_over is None:
+        return None
+    if carry_over not in CARRY_OVER:
+        raise ValueError(f"carry_over must be one of: {', '.join(CARRY_OVER)}")
+    return CARRY_OVER[carry_over]
+
+
+def copy_tree(cursor, source_page_id, new_title=None, new_parent_id=None, position=None, override_icon=None,
+              into_page_id=None, block_filter=None, include_deleted=False):
+    """ページを部分木ごとコピーし、コピー先のルートのIDを返す（元ページがなければ None）
+
+    into_page_id を指定すると、ルートページは作らずに既存ページ into_page_id へ
+    ルートのブロックと子ページをコピーする（呼び出し側が同じトランザクションで書き込み済みであること）。
+    block_filter でコピーするブロックを絞り込める（UNCHECKED_TODOS など）。
+    ゴミ箱の子ページはコピーしない（include_deleted=True で含める）。
+    """
+    cursor.execute('''
+        SELECT pages.id, pages.parent_id, pages.is_deleted FROM page_closure
+        JOIN pages ON pages.id = page_closure.descendant_id
+        WHERE page_closure.ancestor_id = ?
+        ORDER BY page_closure.depth, pages.position
+    ''', (source_page_id,))
+    pages = cursor.fetchall()
+    if not pages:
+        return None
+
+    if into_page_id is not None:
+        root_id = into_page_id
+    else:
+        parent_id = new_parent_id if new_parent_id is not None else pages[0]['parent_id']
+        if position is None:
+            position = get_next_position(cursor, parent_id)
+        cursor.execute('''
+            INSERT INTO pages (title, icon, cover_image, parent_id, position, is_pinned, is_deleted)
+            SELECT COALESCE(?, title), COALESCE(?, icon), cover_image, ?, ?, is_pinned, 0
+            FROM pages WHERE id = ?
+        ''', (new_title, override_icon, parent_id, position, source_page_id))
+        root_id = cursor.lastrowid
+
+    # 深さ順に並んでいるので、新IDも親が子より小さくなる（挿入順 = 新ID順で閉包テーブルのトリガーが通る）
+    id_map = [[source_page_id, root_id]]
+    copied = {source_page_id}
+    next_id = next_row_id(cursor, 'pages')
+    for page in pages[1:]:
+        if page['parent_id'] in copied and (include_deleted or not page['is_deleted']):
+            copied.add(page['id'])
+            id_map.append([page['id'], next_id])
+            next_id += 1
+    id_map_json = json.dumps(id_map)
+
+    if len(id_map) > 1:
+        cursor.execute(_ID_MAP + '''
+            INSERT INTO pages (id, title, icon, cover_image, parent_id, position, is_pinned, is_deleted)
+            SELECT m.new_id, p.title, p.icon, p.cover_image, parent.new_id, p.position, p.is_pinned, 0
+            FROM id_map m
+            JOIN pages p ON p.id = m.old_id
+            JOIN id_map parent ON parent.old_id = p.parent_id
+            WHERE m.old_id != ?
+            ORDER BY m.new_id
+        ''', (id_map_json, source_page_id))
+
+    cursor.execute(_ID_MAP + f'''
+        INSERT INTO blocks (page_id, type, content, checked, position, collapsed, details, props)
+        SELECT m.new_id, b.type, b.content, b.checked, b.position, b.collapsed, b.details, b.props
+        FROM id_map m
+        JOIN blocks b ON b.page_id = m.old_id
+        {f'WHERE {block_filter}' if block_filter else ''}
+        ORDER BY m.new_id, b.position
+    ''', (id_map_json,))
+
+    return root_id
+
+
+def _block_values(page_id, index, block):
+    props = block.get('props', '{}')
+    if not isinstance(props, str):
+        props = json.dumps(props, ensure_ascii=False)
+    return (page_id, block.get('type', 'text'), block.get('content', ''), block.get('checked', 0),
+            (index + 1) * 1000.0, block.get('collapsed', 0), block.get('details', ''), props)
+
+
+def insert_tree(cursor, page_dict, parent_id=None, position=None, into_page_id=None):
+    """辞書（title / icon / blocks / children）のページツリーをまとめて作成し、ルートのIDを返す
+
+    ブロックと子ページの position は並び順から振り直す（1000, 2000, ...）。
+    into_page_id を指定すると、ルートページは作らずに既存ページへブロックと子ページを追加する。
+    """
+    if into_page_id is not None:
+        root_id = into_page_id
+    else:
+        if position is None:
+            position = get_next_position(cursor, parent_id)
+        cursor.execute(
+            'INSERT INTO pages (title, icon, cover_image, parent_id, position, is_pinned) VALUES (?, ?, ?, ?, ?, ?)',
+            (page_dict.get('title', ''), page_dict.get('icon', '📄'), page_dict.get('cover_image', ''),
+             parent_id, position, page_dict.get('is_pinned', 0))
+        )
+        root_id = cursor.lastrowid
+
+    # 幅優先で新IDを振る（親が子より先に挿入される）
+    pages = []
+    blocks = [_block_values(root_id, i, block) for i, block in enumerate(page_dict.get('blocks', []))]
+    queue = [(root_id, page_dict.get('children', []))]
+    next_id = next_row_id(cursor, 'pages')
+    while queue:
+        page_id, children = queue.pop(0)
+        for i, child in enumerate(children):
+            child_id = next_id
+            next_id += 1
+            pages.append((child_id, child.get('title', ''), child.get('icon', '📄'), child.get('cover_image', ''),
+                          page_id, (i + 1) * 1000.0, child.get('is_pinned', 0)))
+            blocks.extend(_block_values(child_id, j, block) for j, block in enumerate(child.get('blocks', [])))
+            queue.append((child_id, child.get('children', [])))
+
+    cursor.executemany(
+        'INSERT INTO pages (id, title, icon, cover_image, parent_id, position, is_pinned) VALUES (?, ?, ?, ?, ?, ?, ?)',
+        pages
+    )
+    cursor.executemany(
+        'INSERT INTO blocks (page_id, type, content, checked, position, collapsed, details, props) '
+        'VALUES (?, ?, ?, ?, ?, ?, ?, ?)',
+        blocks
+    )
+    return root_id
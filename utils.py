@@ -5,13 +5,18 @@
 - ページエクスポート/インポート
 - バックアップ
 """
+import base64
 import json
 import re
 import os
 import urllib.parse
 import urllib.request
 from datetime import datetime, timedelta
-from database import get_db, get_next_position, get_block_next_position, mark_tree_deleted
+from database import (
+    get_db, get_next_position, get_block_next_position, mark_tree_deleted,
+    get_subtree_pages, get_subtree_blocks
+)
+from tree_copy import carry_over_filter, copy_tree, insert_tree
 
 # パス設定
 BASE_DIR = os.path.dirname(os.path.abspath(__file__))
@@ -47,6 +52,21 @@ def allowed_file(filename):
     """許可されたファイル拡張子かチェック"""
     return '.' in filename and filename.rsplit('.', 1)[1].lower() in ALLOWED_EXTENSIONS
 
+def encode_cursor(*values):
+    """キーセットページングのカーソル（値のリストを base64 の JSON にする）"""
+    raw = json.dumps(list(values)).encode('utf-8')
+    return base64.urlsafe_b64encode(raw).decode('ascii')
+
+def decode_cursor(token, *types):
+    """encode_cursor の逆。types で各値を変換し、不正なら ValueError"""
+    try:
+        values = json.loads(base64.urlsafe_b64decode(token.encode('ascii')))
+        if len(values) != len(types):
+            raise ValueError
+        return tuple(convert(value) for convert, value in zip(types, values))
+    except Exception:
+        raise ValueError('Invalid cursor')
+
 def _extract_number(text, pattern):
     """テキストから数値を抽出"""
     match = re.search(pattern, text)
@@ -274,20 +294,25 @@ def estimate_calories_items(items):
     }
 
 def export_page_to_dict(cursor, page_id):
-    """ページとその全ブロック・子ページを辞書に変換（エクスポート用）"""
-    cursor.execute('SELECT * FROM pages WHERE id = ?', (page_id,))
-    page_row = cursor.fetchone()
-    if not page_row:
+    """ページとその全ブロック・子ページを辞書に変換（エクスポート用）
+
+    部分木のページとブロックをそれぞれ1クエリで取得し、Python側で組み立てる。
+    """
+    pages = get_subtree_pages(cursor, page_id)
+    if not pages:
         return None
-    
-    page = dict(page_row)
-    cursor.execute('SELECT * FROM blocks WHERE page_id = ? ORDER BY position', (page_id,))
-    page['blocks'] = [dict(row) for row in cursor.fetchall()]
-    
-    cursor.execute('SELECT * FROM pages WHERE parent_id = ? ORDER BY position', (page_id,))
-    page['children'] = [export_page_to_dict(cursor, row['id']) for row in cursor.fetchall()]
-    
-    return page
+
+    page_map = {}
+    for page in pages:
+        page['blocks'] = []
+        page['children'] = []
+        page_map[page['id']] = page
+    for block in get_subtree_blocks(cursor, page_id):
+        page_map[block['page_id']]['blocks'].append(block)
+    for page in pages[1:]:
+        page_map[page['parent_id']]['children'].append(page)
+
+    return page_map[page_id]
 
 def page_to_markdown(page, level=1):
     """ページをMarkdownフォーマットに変換（再帰的）"""
@@ -333,73 +358,53 @@ def page_to_markdown(page, level=1):
     
     return '\n'.join(lines)
 
-def create_page_from_dict(cursor, page_dict, parent_id=None, position=None):
-    """辞書からページを作成（インポート用）"""
-    parent_id = parent_id if parent_id is not None else page_dict.get('parent_id')
-    
-    if position is None:
-        position = get_next_position(cursor, parent_id)
-    
-    cursor.execute(
-        'INSERT INTO pages (title, icon, cover_image, parent_id, position, is_pinned, is_deleted) VALUES (?, ?, ?, ?, ?, ?, ?)',
-        (
-            page_dict.get('title', ''),
-            page_dict.get('icon', '📄'),
-            page_dict.get('cover_image', ''),
-            parent_id,
-            position,
-            page_dict.get('is_pinned', 0),
-            0
-        )
-    )
-    new_page_id = cursor.lastrowid
-    
-    # ブロック追加
-    for block in page_dict.get('blocks', []):
-        cursor.execute(
-            'INSERT INTO blocks (page_id, type, content, checked, position, collapsed, details, props) VALUES (?, ?, ?, ?, ?, ?, ?, ?)',
-            (
-                new_page_id,
-                block.get('type', 'text'),
-                block.get('content', ''),
-                block.get('checked', 0),
-                block.get('position', 1000.0),
-                block.get('collapsed', 0),
-                block.get('details', ''),
-                block.get('props', '{}')
-            )
-        )
-    
-    # 子ページ追加
-    for i, child in enumerate(page_dict.get('children', [])):
-        child_pos = (i + 1) * 1000.0
-        create_page_from_dict(cursor, child, parent_id=new_page_id, position=child_pos)
-    
-    return new_page_id
+def journal_title(day):
+    """日付ページのタイトル（例: 2026年2月4日）"""
+    return f"{day.year}年{day.month}月{day.day}日"
 
-def get_or_create_date_page(cursor, date_str):
-    """指定日付のページを取得または作成（存在しない場合は前日をコピー）"""
+def find_date_page(cursor, journal_date):
+    """journal_date（'YYYY-MM-DD'）の日付ページを取得（一意インデックスを引くだけ）"""
+    cursor.execute('SELECT * FROM pages WHERE journal_date = ? AND is_deleted = 0', (journal_date,))
+    row = cursor.fetchone()
+    return dict(row) if row else None
+
+def get_or_create_date_page(cursor, date_str, carry_over=None):
+    """指定日付のページを取得または作成（存在しない場合は前日をコピー）
+
+    日付ページの行は journal_date の一意インデックスに対する
+    INSERT ... ON CONFLICT DO NOTHING で確保するため、同時に呼ばれても重複しない。
+    carry_over で前日から引き継ぐブロックを絞れる（tree_copy.CARRY_OVER の名前。知らない名前なら ValueError）。
+    """
+    block_filter = carry_over_filter(carry_over)
     try:
-        target_date = datetime.strptime(date_str, '%Y-%m-%d')
-        title = f"{target_date.year}年{target_date.month}月{target_date.day}日"
+        target_date = datetime.strptime(date_str, '%Y-%m-%d').date()
     except Exception:
         return None
+    journal_date = target_date.isoformat()
+    title = journal_title(target_date)
 
-    cursor.execute('SELECT * FROM pages WHERE title = ? AND is_deleted = 0 LIMIT 1', (title,))
-    existing = cursor.fetchone()
+    existing = find_date_page(cursor, journal_date)
     if existing:
-        return dict(existing)
+        return existing
 
-    prev_date = target_date - timedelta(days=1)
-    prev_title = f"{prev_date.year}年{prev_date.month}月{prev_date.day}日"
-    cursor.execute('SELECT id FROM pages WHERE title = ? AND is_deleted = 0 ORDER BY created_at DESC LIMIT 1', (prev_title,))
-    prev_row = cursor.fetchone()
+    prev_page = find_date_page(cursor, (target_date - timedelta(days=1)).isoformat())
+    parent_id = prev_page['parent_id'] if prev_page else None
+    cursor.execute(
+        '''INSERT INTO pages (title, icon, cover_image, parent_id, position, journal_date)
+           VALUES (?, ?, ?, ?, ?, ?)
+           ON CONFLICT (journal_date) WHERE journal_date IS NOT NULL AND is_deleted = 0 DO NOTHING''',
+        (title, '📅', prev_page.get('cover_image', '') if prev_page else '',
+         parent_id, get_next_position(cursor, parent_id), journal_date)
+    )
+    if cursor.rowcount == 0:
+        # 別のリクエストが先に作成した
+        return find_date_page(cursor, journal_date)
 
-    if prev_row:
-        previous_page_id = prev_row['id']
-        new_page_id = copy_page_tree(cursor, previous_page_id, new_title=title, new_parent_id=None, override_icon='📅')
+    page_id = cursor.lastrowid
+    if prev_page:
+        copy_tree(cursor, prev_page['id'], into_page_id=page_id, block_filter=block_filter)
 
-        cursor.execute('SELECT title FROM pages WHERE parent_id = ? AND is_deleted = 0', (new_page_id,))
+        cursor.execute('SELECT title FROM pages WHERE parent_id = ? AND is_deleted = 0', (page_id,))
         existing_titles = {row['title'] for row in cursor.fetchall()}
 
         required_children = [
@@ -413,7 +418,7 @@ def get_or_create_date_page(cursor, date_str):
         required_titles = {title_req for title_req, _ in required_children}
         cursor.execute(
             'SELECT id, title FROM pages WHERE parent_id = ? AND is_deleted = 0 ORDER BY position',
-            (new_page_id,)
+            (page_id,)
         )
         seen_titles = set()
         for row in cursor.fetchall():
@@ -424,27 +429,19 @@ def get_or_create_date_page(cursor, date_str):
                 else:
                     seen_titles.add(title_value)
 
-        next_pos = get_next_position(cursor, new_page_id)
+        next_pos = get_next_position(cursor, page_id)
         for title_req, icon_req in required_children:
             if title_req not in existing_titles:
                 cursor.execute(
                     'INSERT INTO pages (title, icon, parent_id, position) VALUES (?, ?, ?, ?)',
-                    (title_req, icon_req, new_page_id, next_pos)
+                    (title_req, icon_req, page_id, next_pos)
                 )
                 next_pos += 1000.0
 
-        cursor.execute('SELECT * FROM pages WHERE id = ?', (new_page_id,))
+        cursor.execute('SELECT * FROM pages WHERE id = ?', (page_id,))
         page = dict(cursor.fetchone())
         return page
 
-    new_pos = get_next_position(cursor, None)
-    cursor.execute('INSERT INTO pages (title, icon, parent_id, position) VALUES (?, ?, ?, ?)',
-                   (title, '📅', None, new_pos))
-    page_id = cursor.lastrowid
-
-    cursor.execute("INSERT INTO blocks (page_id, type, content, position, props) VALUES (?, 'text', '', ?, ?)",
-                   (page_id, 1000.0, '{}'))
-
     children_templates = [
         {
             'title': '日記',
@@ -514,73 +511,13 @@ def get_or_create_date_page(cursor, date_str):
         }
     ]
 
-    for i, child in enumerate(children_templates):
-        child_pos = (i + 1) * 1000.0
-        cursor.execute(
-            'INSERT INTO pages (title, icon, parent_id, position) VALUES (?, ?, ?, ?)',
-            (child['title'], child['icon'], page_id, child_pos)
-        )
-        child_id = cursor.lastrowid
-        for j, block in enumerate(child['blocks']):
-            cursor.execute(
-                "INSERT INTO blocks (page_id, type, content, checked, position, props) VALUES (?, ?, ?, ?, ?, ?)",
-                (child_id, block['type'], block['content'], block.get('checked', 0), (j + 1) * 1000.0, '{}')
-            )
+    insert_tree(cursor, {'blocks': [{'type': 'text', 'content': ''}], 'children': children_templates},
+                into_page_id=page_id)
 
     cursor.execute('SELECT * FROM pages WHERE id = ?', (page_id,))
     page = dict(cursor.fetchone())
     return page
 
-def copy_page_tree(cursor, source_page_id, new_title=None, new_parent_id=None, position=None, override_icon=None):
-    """ページとブロックを再帰的にコピー"""
-    cursor.execute('SELECT * FROM pages WHERE id = ?', (source_page_id,))
-    source_page = cursor.fetchone()
-    if not source_page:
-        return None
-
-    src = dict(source_page)
-    parent_id = new_parent_id if new_parent_id is not None else src['parent_id']
-    if position is None:
-        position = get_next_position(cursor, parent_id)
-
-    cursor.execute(
-        'INSERT INTO pages (title, icon, cover_image, parent_id, position, is_pinned, is_deleted) VALUES (?, ?, ?, ?, ?, ?, 0)',
-        (
-            new_title if new_title is not None else src.get('title', ''),
-            override_icon if override_icon is not None else src.get('icon', '📄'),
-            src.get('cover_image', ''),
-            parent_id,
-            position,
-            src.get('is_pinned', 0)
-        )
-    )
-    new_page_id = cursor.lastrowid
-
-    # ブロックコピー
-    cursor.execute('SELECT * FROM blocks WHERE page_id = ? ORDER BY position', (source_page_id,))
-    for block in cursor.fetchall():
-        block_dict = dict(block)
-        cursor.execute(
-            'INSERT INTO blocks (page_id, type, content, checked, position, collapsed, details, props) VALUES (?, ?, ?, ?, ?, ?, ?, ?)',
-            (
-                new_page_id,
-                block_dict.get('type', 'text'),
-                block_dict.get('content', ''),
-                block_dict.get('checked', 0),
-                block_dict.get('position', 0),
-                block_dict.get('collapsed', 0),
-                block_dict.get('details', ''),
-                block_dict.get('props', '{}')
-            )
-        )
-
-    # 子ページを再帰コピー
-    cursor.execute('SELECT * FROM pages WHERE parent_id = ? ORDER BY position', (source_page_id,))
-    for child in cursor.fetchall():
-        copy_page_tree(cursor, child['id'], new_parent_id=new_page_id, position=child['position'])
-
-    return new_page_id
-
 def backup_database_to_json():
     """データベースをJSONテキスト形式でバックアップ"""
     try:
@@ -0,0 +1,337 @@
+# -*- coding: utf-8 -*-
+"""
+書き込みキュー（自動保存の UPDATE をまとめてコミット）
+- ブロック/ページの UPDATE を専用の書き込みスレッド1本に集める
+- 短い時間窓に届いた更新をまとめ、同じ行への更新はマージして1トランザクションでコミット
+- 更新ごとにコミット後の行を返す（ack）
+- 複数の行にまたがる処理（POST /api/batch）も submit_transaction で同じスレッドに流し、1つの SAVEPOINT で実行する
+- キューの深さとコミット時間を metrics() で取得できる
+"""
+
+import queue
+import threading
+import time
+
+from database import DB_PRAGMAS, get_db, release_thread_db
+
+# 更新を受け付けるテーブル
+TABLES = ('pages', 'blocks')
+
+# カラムに書ける値の型（dict や list は SQLite に渡せない）
+VALUE_TYPES = (str, int, float, type(None))
+
+# 実行中の書き込みを待つ上限（秒）。ロック待ち (busy_timeout) にコミットぶんの余裕を足す
+RUNNING_WAIT_SECONDS = dict(DB_PRAGMAS)['busy_timeout'] / 1000 + 5
+
+
+class WriteStillRunning(TimeoutError):
+    """取り消せない（実行中の）書き込みが待ち時間内に終わらなかった。あとでコミットされるかもしれない"""
+
+
+class PendingWrite:
+    """1件の更新（または work(cursor) の実行）の完了待ち"""
+
+    def __init__(self, table, row_id, fields, work=None):
+        self.table = table
+        self.row_id = row_id
+        self.fields = fields
+        self.work = work
+        self.result = None
+        self.error = None
+        self._done = threading.Event()
+        # queued → taken（書き込みスレッドが実行する）/ cancelled（待ち切れずに取り消した）
+        self._state = 'queued'
+        self._state_lock = threading.Lock()
+
+    def take(self):
+        """書き込みスレッドが実行する前に呼ぶ。取り消し済みなら False"""
+        with self._state_lock:
+            if self._state == 'cancelled':
+                return False
+            self._state = 'taken'
+            return True
+
+    def cancel(self):
+        """まだ実行されていなければ取り消す（取り消せたら True）"""
+        with self._state_lock:
+            if self._state == 'queued':
+                self._state = 'cancelled'
+                return True
+            return False
+
+    def resolve(self, result=None, error=None):
+        self.result = result
+        self.error = error
+        self._done.set()
+
+    def wait(self, timeout=None):
+        """コミット後の行（dict、行がなければ None）を返す。失敗時は例外を送出
+
+        timeout までに書き込みスレッドが取りかからなければ取り消して TimeoutError（書き込まれない）。
+        すでに実行中なら、あとからコミットされて結果と食い違わないよう、RUNNING_WAIT_SECONDS まで
+        終わるのを待つ。それでも終わらなければ WriteStillRunning（書き込まれたかどうかは分からない）。
+        """
+        if not self._done.wait(timeout):
+            if self.cancel():
+                raise TimeoutError('write queue did not respond (the update was not applied)')
+            if not self._done.wait(RUNNING_WAIT_SECONDS):
+                raise WriteStillRunning('write is still running (the update may still be applied)')
+        if self.error is not None:
+            raise self.error
+        return self.result
+
+
+def check_values(fields):
+    """カラムに書けない型（オブジェクト・配列など）の値があれば ValueError"""
+    for field, value in fields.items():
+        if not isinstance(value, VALUE_TYPES):
+            raise ValueError(f'Invalid value for {field}: expected a string, number or null')
+
+
+def apply_updates(cursor, table, row_id, fields):
+    """1行を更新してコミット前の最新行を返す（行がなければ None）。値の型が不正なら ValueError"""
+    if table not in TABLES:
+        raise ValueError(f'Unknown table: {table}')
+    check_values(fields)
+    if fields:
+        assignments = ', '.join(f'{field} = ?' for field in fields)
+        cursor.execute(
+            f'UPDATE {table} SET {assignments}, updated_at = CURRENT_TIMESTAMP WHERE id = ?',
+            list(fields.values()) + [row_id]
+        )
+    cursor.execute(f'SELECT * FROM {table} WHERE id = ?', (row_id,))
+    row = cursor.fetchone()
+    return dict(row) if row else None
+
+
+class WriteQueue:
+    """単一の書き込みスレッドで更新をまとめてコミットするキュー"""
+
+    def __init__(self, window_seconds=0.02, max_batch=200):
+        self.window_seconds = window_seconds
+        self.max_batch = max_batch
+        self._queue = queue.Queue()
+        self.thread = None
+        self.running = False
+        self._lock = threading.Lock()
+        self._stats = {
+            'batches': 0,
+            'writes': 0,
+            'rows': 0,
+            'errors': 0,
+            'cancelled': 0,
+            'last_commit_ms': 0.0,
+            'max_commit_ms': 0.0,
+            'total_commit_ms': 0.0,
+        }
+
+    def submit(self, table, row_id, fields):
+        """更新をキューに入れて PendingWrite を返す"""
+        if table not in TABLES:
+            raise ValueError(f'Unknown table: {table}')
+        pending = PendingWrite(table, row_id, dict(fields))
+        self._queue.put(pending)
+        return pending
+
+    def submit_work(self, work):
+        """work(cursor) を書き込みスレッドで実行するようキューに入れて PendingWrite を返す"""
+        pending = PendingWrite(None, None, None, work=work)
+        self._queue.put(pending)
+        return pending
+
+    def start(self):
+        if not self.running:
+            self.running = True
+            self.thread = threading.Thread(target=self._loop, name='write-queue', daemon=True)
+            self.thread.start()
+
+    def stop(self):
+        """残っている更新を書き切ってからスレッドを止める"""
+        if self.running:
+            self.running = False
+            self._queue.put(None)
+            if self.thread:
+                self.thread.join(timeout=5)
+
+    def metrics(self):
+        with self._lock:
+            stats = dict(self._stats)
+        batches = stats.pop('batches')
+        total_ms = stats.pop('total_commit_ms')
+        stats.update({
+            'queue_depth': self._queue.qsize(),
+            'batches': batches,
+            'avg_commit_ms': total_ms / batches if batches else 0.0,
+            'running': self.running,
+        })
+        return stats
+
+    def _collect(self):
+        """最初の1件を待ち、時間窓の間に届いた分をまとめて返す"""
+        first = self._queue.get()
+        if first is None:
+            return None
+        batch = [first]
+        deadline = time.monotonic() + self.window_seconds
+        while len(batch) < self.max_batch:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                item = self._queue.get(timeout=remaining)
+            except queue.Empty:
+                break
+            if item is None:
+                self.running = False
+                break
+            batch.append(item)
+        return batch
+
+    def _loop(self):
+        try:
+            while True:
+                batch = self._collect()
+                if batch is None:
+                    break
+                try:
+                    self._commit(batch)
+                except Exception as e:
+                    # 接続できないなど。待っているリクエストを待たせたままにしない
+                    print(f"⚠️ Write queue error: {e}")
+                    for pending in batch:
+                        pending.resolve(error=e)
+                finally:
+                    # 書き込みロックを持ったままのトランザクションを残さない
+                    release_thread_db()
+                if not self.running and self._queue.empty():
+                    break
+        finally:
+            release_thread_db(close=True)
+
+    def _commit(self, batch):
+        # 待ち切れずに取り消された更新は書かない
+        taken = [pending for pending in batch if pending.take()]
+        if len(taken) < len(batch):
+            with self._lock:
+                self._stats['cancelled'] += len(batch) - len(taken)
+        batch = taken
+        if not batch:
+            return
+        # 同じ行への更新は到着順にマージ（後勝ち）。work は1件ずつ（units は [(key, fields / work, 待ち)]）
+        units = []
+        index = {}
+        for pending in batch:
+            if pending.work is not None:
+                units.append((None, pending.work, [pending]))
+                # 後の更新を前の更新にマージすると、間の work より先に書いてしまう
+                index = {}
+                continue
+            key = (pending.table, pending.row_id)
+            if key not in index:
+                index[key] = len(units)
+                units.append((key, {}, []))
+            units[index[key]][1].update(pending.fields)
+            units[index[key]][2].append(pending)
+
+        start = time.perf_counter()
+        conn = get_db()
+        cursor = conn.cursor()
+        results = []
+        errors = 0
+        try:
+            cursor.execute('BEGIN IMMEDIATE')
+            for key, action, _ in units:
+                # 1件の失敗（循環する親の付け替え・不正な値など）で他の更新を巻き込まない
+                cursor.execute('SAVEPOINT write_queue_row')
+                try:
+                    if key is None:
+                        result = action(cursor)
+                    else:
+                        result = apply_updates(cursor, key[0], key[1], action)
+                    cursor.execute('RELEASE write_queue_row')
+                    results.append((result, None))
+                except Exception as e:
+                    cursor.execute('ROLLBACK TO write_queue_row')
+                    cursor.execute('RELEASE write_queue_row')
+                    results.append((None, e))
+                    errors += 1
+            conn.commit()
+        except Exception as e:
+            conn.rollback()
+            results = [(None, e)] * len(units)
+            errors = len(units)
+        finally:
+            conn.close()
+        elapsed_ms = (time.perf_counter() - start) * 1000
+
+        with self._lock:
+            self._stats['batches'] += 1
+            self._stats['writes'] += len(batch)
+            self._stats['rows'] += len(units)
+            self._stats['errors'] += errors
+            self._stats['last_commit_ms'] = elapsed_ms
+            self._stats['max_commit_ms'] = max(self._stats['max_commit_ms'], elapsed_ms)
+            self._stats['total_commit_ms'] += elapsed_ms
+
+        for (_, _, waiters), (result, error) in zip(units, results):
+            for pending in waiters:
+                pending.resolve(result, error)
+
+
+# グローバル書き込みキューインスタンス
+_write_queue = None
+
+
+def init_write_queue():
+    """書き込みキューを作成して書き込みスレッドを開始"""
+    global _write_queue
+    if _write_queue is None:
+        _write_queue = WriteQueue()
+        _write_queue.start()
+    return _write_queue
+
+
+def get_write_queue():
+    return _write_queue
+
+
+def submit_update(table, row_id, fields, timeout=10):
+    """1行を更新してコミット後の行を返す（行がなければ None）
+
+    書き込みキューが動いていればそこを経由し、なければ呼び出し元のスレッドで直接更新する。
+    timeout 秒たっても書き込みスレッドが取りかからなければ取り消して TimeoutError（書き込まれないので送り直してよい）。
+    """
+    if _write_queue is not None and _write_queue.running:
+        return _write_queue.submit(table, row_id, fields).wait(timeout)
+    conn = get_db()
+    try:
+        row = apply_updates(conn.cursor(), table, row_id, fields)
+        conn.commit()
+        return row
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        conn.close()
+
+
+def submit_transaction(work, timeout=10):
+    """work(cursor) を1トランザクションで実行して戻り値を返す（work の例外はそのまま送出）
+
+    書き込みキューが動いていれば書き込みスレッドで（他の更新と同じコミットの中の SAVEPOINT として）、
+    なければ呼び出し元のスレッドで BEGIN IMMEDIATE して実行する。
+    """
+    if _write_queue is not None and _write_queue.running:
+        return _write_queue.submit_work(work).wait(timeout)
+    conn = get_db()
+    cursor = conn.cursor()
+    try:
+        cursor.execute('BEGIN IMMEDIATE')
+        result = work(cursor)
+        conn.commit()
+        return result
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        conn.close()
@@ -0,0 +1,208 @@
+# -*- coding: utf-8 -*-
+"""
+ZIP インポート（POST /api/import/zip）
+- /api/export/pages/<id>/zip の形（ページごとのディレクトリに page.md / metadata.json / blocks.json / files/）を読み戻す
+- ブロックは blocks.json（エクスポートしたブロックそのもの）から戻す。blocks.json のない以前の ZIP だけ、
+  page.md（page_to_markdown の出力）を種類付きのブロック（h1 / todo / toggle / image / speak / text）に戻す
+- 入れ子のディレクトリは子ページ、files/ の添付は内容のハッシュ名で uploads/ にコピーする（同じ内容は1つだけ）
+- 挿入は importer.PageImporter に渡し、呼び出し側の1トランザクションでまとめて行う
+"""
+
+import hashlib
+import json
+import os
+import posixpath
+import re
+import uuid
+
+from utils import allowed_file
+
+# 添付をコピーする時に読む単位
+COPY_CHUNK_SIZE = 1024 * 1024
+
+# blocks.json から戻すブロックの列（position は並び順から振り直す）
+BLOCK_FIELDS = ('type', 'content', 'checked', 'collapsed', 'details', 'props')
+
+# page_to_markdown の各行
+_TODO_LINE = re.compile(r'- \[([✓☐])\] ?(.*)')
+_IMAGE_LINE = re.compile(r'!\[Image\]\((.*)\)')
+_TOGGLE_LINE = re.compile(r'\*\*(.+)\*\*')
+_SPEAK_PREFIX = '🔊 [読み上げ]: '
+
+
+def parse_markdown(text, has_children=False):
+    """page_to_markdown の出力をブロックの辞書のリストに戻す（先頭のページ見出しは読み飛ばす）
+
+    has_children なら、子ページの見出し（## ...）以降は読まない（以前の形式では子ページも page.md に入っていた）。
+    """
+    lines = text.replace('\r\n', '\n').split('\n')
+    blocks = []
+    i = 0
+    # ページ見出し（# アイコン タイトル）
+    while i < len(lines) and not lines[i].strip():
+        i += 1
+    if i < len(lines) and lines[i].startswith('# '):
+        i += 1
+
+    while i < len(lines):
+        line = lines[i]
+        i += 1
+        if not line.strip():
+            continue
+        if has_children and line.startswith('## '):
+            break
+        if line.startswith('### '):
+            blocks.append({'type': 'h1', 'content': line[4:]})
+            continue
+        match = _TODO_LINE.fullmatch(line)
+        if match:
+            blocks.append({'type': 'todo', 'content': match.group(2), 'checked': int(match.group(1) == '✓')})
+            continue
+        match = _IMAGE_LINE.fullmatch(line)
+        if match:
+            blocks.append({'type': 'image', 'content': match.group(1)})
+            continue
+        if line.startswith(_SPEAK_PREFIX):
+            blocks.append({'type': 'speak', 'content': line[len(_SPEAK_PREFIX):]})
+            continue
+        # トグル・テキストは空行までが1ブロック（トグルは2行目以降が details）
+        rest = []
+        while i < len(lines) and lines[i].strip():
+            rest.append(lines[i])
+            i += 1
+        match = _TOGGLE_LINE.fullmatch(line)
+        if match:
+            blocks.append({'type': 'toggle', 'content': match.group(1), 'details': '\n'.join(rest)})
+        else:
+            blocks.append({'type': 'text', 'content': '\n'.join([line] + rest)})
+
+    for index, block in enumerate(blocks):
+        block['position'] = (index + 1) * 1000.0
+    return blocks
+
+
+def load_blocks(data):
+    """blocks.json（エクスポートしたブロックの配列）を読む。position は並び順から振り直す"""
+    rows = json.loads(data.decode('utf-8-sig'))
+    if not isinstance(rows, list):
+        raise ValueError('blocks.json must be an array')
+    blocks = []
+    for index, row in enumerate(rows):
+        if not isinstance(row, dict):
+            raise ValueError('Each block in blocks.json must be an object')
+        block = {field: row[field] for field in BLOCK_FIELDS if row.get(field) is not None}
+        block['position'] = (index + 1) * 1000.0
+        block.setdefault('content', '')
+        blocks.append(block)
+    return blocks
+
+
+class ZipPageReader:
+    """エクスポートした ZIP からページツリー（importer.PageImporter に渡せる辞書）を組み立てる
+
+    添付は uploads/ に「内容の SHA-256.拡張子」でコピーし、ブロックの URL を付け替える。
+    すでに同じ内容のファイルがあればコピーしない。取り込みに失敗したら discard() で今回コピーした分を消す。
+    """
+
+    def __init__(self, zf, upload_folder):
+        self.zf = zf
+        self.upload_folder = upload_folder
+        self.created_files = []
+        self.file_count = 0
+        self._stored = set()
+
+    def read(self):
+        """ルートページの辞書のリストを返す（metadata.json のあるディレクトリがページ）"""
+        names = self.zf.namelist()
+        name_set = set(names)
+        # ZIP 内の並び（エクスポート時のツリー順）のまま
+        page_dirs = [posixpath.dirname(name) for name in names if posixpath.basename(name) == 'metadata.json']
+        pages = {}
+        roots = []
+        for page_dir in page_dirs:
+            pages[page_dir] = {'children': []}
+            # いちばん近い祖先のページのディレクトリが親（タイトルに / を含む場合は途中のディレクトリを飛ばす）
+            parent = posixpath.dirname(page_dir)
+            while parent and parent not in pages:
+                parent = posixpath.dirname(parent)
+            (pages[parent]['children'] if parent in pages else roots).append(pages[page_dir])
+
+        files = {}
+        for name in names:
+            head, filename = posixpath.split(name)
+            page_dir, files_dir = posixpath.split(head)
+            if files_dir == 'files' and page_dir in pages and filename:
+                files.setdefault(page_dir, []).append(name)
+
+        for page_dir in page_dirs:
+            page = pages[page_dir]
+            metadata = json.loads(self.zf.read(posixpath.join(page_dir, 'metadata.json')).decode('utf-8'))
+            page['title'] = metadata.get('title', '')
+            page['icon'] = metadata.get('icon') or '📄'
+            page['cover_image'] = metadata.get('cover_image') or ''
+            page['is_pinned'] = metadata.get('is_pinned') or 0
+            blocks_path = posixpath.join(page_dir, 'blocks.json')
+            md_path = posixpath.join(page_dir, 'page.md')
+            if blocks_path in name_set:
+                page['blocks'] = load_blocks(self.zf.read(blocks_path))
+            else:
+                markdown = self.zf.read(md_path).decode('utf-8-sig') if md_path in name_set else ''
+                page['blocks'] = parse_markdown(markdown, has_children=bool(page['children']))
+            self._attach(page['blocks'], files.get(page_dir, []), from_markdown=blocks_path not in name_set)
+        return roots
+
+    def _attach(self, blocks, file_names, from_markdown=False):
+        """ページの files/ をコピーし、/uploads/元の名前 を指す image / file ブロックを付け替える"""
+        urls = {}
+        for name in file_names:
+            stored = self._copy(name)
+            if stored:
+                urls[f"/uploads/{posixpath.basename(name)}"] = f"/uploads/{stored}"
+        for block in blocks:
+            url = urls.get(block['content'])
+            if url is None:
+                continue
+            if from_markdown and block['type'] == 'text':
+                # page.md では file ブロックは URL だけのテキストとして書き出される
+                block['type'] = 'file'
+            if block['type'] in ('image', 'file'):
+                block['content'] = url
+
+    def _copy(self, name):
+        """添付を uploads/ にコピーして保存名を返す（許可されていない拡張子は None）"""
+        filename = posixpath.basename(name)
+        if not allowed_file(filename):
+            return None
+        digest = hashlib.sha256()
+        tmp_path = os.path.join(self.upload_folder, f".import-{uuid.uuid4().hex}")
+        try:
+            with self.zf.open(name) as src, open(tmp_path, 'wb') as dst:
+                while True:
+                    chunk = src.read(COPY_CHUNK_SIZE)
+                    if not chunk:
+                        break
+                    digest.update(chunk)
+                    dst.write(chunk)
+        except Exception:
+            os.remove(tmp_path)
+            raise
+        ext = filename.rsplit('.', 1)[1].lower()
+        stored = f"{digest.hexdigest()}.{ext}"
+        path = os.path.join(self.upload_folder, stored)
+        if stored in self._stored or os.path.exists(path):
+            os.remove(tmp_path)
+        else:
+            os.replace(tmp_path, path)
+            self.created_files.append(path)
+            self.file_count += 1
+        self._stored.add(stored)
+        return stored
+
+    def discard(self):
+        """今回コピーした添付を消す"""
+        for path in self.created_files:
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+        self.created_files = []